@@ -1,20 +1,38 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import requests
 import pickle
 import pandas as pd
 from datetime import datetime
 from create_model import RuleBasedStalenessDetector
+from json_stream import iter_json_array_items
+from servicenow_client import ServiceNowClient, TransferStats, iter_body, credential_key
+from compact_payload import compact_params, ci_class_names, expand_compact_datasets
+from snapshot_store import SnapshotStore
+from scan_jobs import ScanJobManager, TooManyJobsError
+from trace_logging import configure_logging, trace_logger
+from scan_progress import ScanProgress
+from single_flight import SingleFlight
+from scan_results import ScanResultStore, InvalidQueryError, FILTER_FIELDS, DEFAULT_PAGE_SIZE
+import response_compression
+from delta_sync import DeltaSyncStore, needs_full_refresh, delta_queries, merge_delta, materialize
 import logging
 import json
 from typing import Dict, List, Optional
 import os
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
+import heapq
+from collections import deque
+from itertools import islice
+from urllib.parse import urlencode
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (levels from LOG_LEVEL, see trace_logging)
+configure_logging()
 logger = logging.getLogger(__name__)
+# Sample records and per-record details, logged at DEBUG and sampled
+sample_log = trace_logger('app.samples')
 
 app = Flask(__name__)
 CORS(app, 
@@ -26,8 +44,9 @@ CORS(app,
      supports_credentials=True,
      allow_headers=['Content-Type', 'Authorization'],
      methods=['GET', 'POST', 'OPTIONS'],
-     expose_headers=['Content-Type'],
+     expose_headers=['Content-Type', 'X-Uncompressed-Length'],
      max_age=3600)
+response_compression.init_app(app)
 # Load the ML model
 MODEL_PATH = 'staleness_detector_model.pkl'
 model = None
@@ -35,20 +54,14 @@ model = None
 # Store assignment history in memory (in production this should be in a database)
 assignment_history = []
 
-# Configure retry strategy
-retry_strategy = Retry(
-    total=3,  # number of retries
-    backoff_factor=1,  # wait 1, 2, 4 seconds between retries
-    status_forcelist=[408, 429, 500, 502, 503, 504]  # HTTP status codes to retry on
-)
-http_adapter = HTTPAdapter(max_retries=retry_strategy)
-
-def create_session():
-    """Create a requests session with retry logic"""
-    session = requests.Session()
-    session.mount("http://", http_adapter)
-    session.mount("https://", http_adapter)
-    return session
+# Local copies of synced ServiceNow tables for delta scans
+sync_store = DeltaSyncStore()
+snapshot_store = SnapshotStore()
+# Stale CIs of finished scans, queryable page by page at /scan-results/<result_id>/cis
+scan_results = ScanResultStore()
+
+# Pooled, keep-alive client shared by every ServiceNow call
+servicenow = ServiceNowClient()
 
 def load_model():
     """Load the pickle model"""
@@ -72,7 +85,8 @@ def health_check():
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'service': 'CMDB Analyzer Backend',
-        'model_loaded': model is not None
+        'model_loaded': model is not None,
+        'scan_jobs': scan_jobs.counts()
     })
 
 @app.route('/test-connection', methods=['POST'])
@@ -99,9 +113,9 @@ def test_connection():
         test_url = f"{instance_url}/api/now/table/sys_user"
         
         try:
-            response = requests.get(
+            response = servicenow.get(
+                instance_url, username, password,
                 test_url,
-                auth=(username, password),
                 headers={
                     'Accept': 'application/json',
                     'Content-Type': 'application/json'
@@ -171,350 +185,1110 @@ def scan_stale_ownership():
             'error': 'ML model not loaded. Please check server logs.'
         }), 500
 
+    data = request.get_json()
+    sample_log.debug("scan_stale_ownership input keys: %s", sorted(data) if isinstance(data, dict) else type(data))
+    if data and (data.get('stream') or request.accept_mimetypes.best == 'application/x-ndjson'):
+        return stream_scan(data)
+    
+    def scan():
+        result, status_code = run_scan(data)
+        return result, status_code, scan_results.add(result['stale_cis']) if status_code == 200 else None
+    
+    if not data or not data.get('instance_url') or not data.get('username') or not data.get('password'):
+        result, status_code, result_id = scan()
+        return scan_response(result, status_code, result_id)
+    # Identical scans already running for the same user are joined rather than repeated
+    (result, status_code, result_id), shared = scan_flights.do(
+        scan_coalesce_key(data), scan,
+        credential=credential_key(data['username'], data['password']),
+        authorize=lambda: verify_credentials(data['instance_url'], data['username'], data['password']))
+    return scan_response(result, status_code, result_id, coalesced=shared)
+
+def stream_scan(data):
+    """
+    Answer a scan as NDJSON: one stale CI object per line, written as soon as the
+    model flags it, then a trailer line {"type": "summary", ...} with the summary and
+    grouped_by_owners. A failure after the response has started is reported as a
+    final {"type": "error", ...} line. Concurrent identical streamed scans share
+    one fetch of their inputs; each is scored for its own response, since a stream
+    can only be written to the caller reading it.
+    """
+    tracker = ScanProgress()
     try:
-        data = request.get_json()
-        logger.info(f"scan_stale_ownership input: {data}")
-        instance_url = data.get('instance_url')
-        username = data.get('username')
-        password = data.get('password')
-        
-        # Debug: Check credentials (mask password)
-        logger.info(f"Received credentials - URL: {instance_url}, Username: {username}, Password: {'*' * len(password) if password else 'None'}")
-        
-        if not instance_url or not username or not password:
-            return jsonify({'error': 'Missing required credentials'}), 400
+        if data.get('instance_url') and data.get('username') and data.get('password'):
+            # The model only reads its inputs, so one fetch can serve every stream that joins it
+            (inputs, error), _ = scan_flights.do(
+                scan_coalesce_key(data) + ('inputs',), lambda: load_scan_inputs(data, tracker),
+                credential=credential_key(data['username'], data['password']),
+                authorize=lambda: verify_credentials(data['instance_url'], data['username'], data['password']))
+        else:
+            inputs, error = load_scan_inputs(data, tracker)
+    except Exception as e:
+        logger.error(f"Error in stream_scan: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Scan failed: {str(e)}"}), 500
+    if error:
+        return jsonify(error[0]), error[1]
+    response_encoding = response_compression.negotiate_encoding(request.headers.get('Accept-Encoding'))
+    
+    def generate():
+        # The trailer's grouped_by_owners lists every stale CI by owner, and the
+        # retained result holds them for paging; both are built as CIs stream out
+        grouped = {}
+        tally = new_stale_tally()
+        result_index = scan_results.new_index()
+        try:
+            for ci in iter_stale_cis_with_model(inputs['ci_data'], inputs['audit_data'], inputs['user_data'], inputs['activity_data']):
+                add_to_owner_groups(grouped, ci)
+                tally_stale_ci(tally, ci)
+                result_index.append(ci)
+                yield app.json.dumps(ci) + '\n'
+            grouped_by_owners = owner_group_list(grouped)
+            summary = scan_summary(inputs, tally, grouped_by_owners)
+            summary['compression']['response_encoding'] = response_encoding
+            summary['result_id'] = scan_results.retain(result_index)
+            yield app.json.dumps({
+                'type': 'summary',
+                'success': True,
+                'message': 'Analysis completed successfully',
+                'summary': summary,
+                'grouped_by_owners': grouped_by_owners
+            }) + '\n'
+        except Exception as e:
+            logger.error(f"Error in stream_scan: {str(e)}", exc_info=True)
+            yield app.json.dumps({'type': 'error', 'error': f"Model analysis failed: {str(e)}"}) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
 
-        # Fetch data from ServiceNow
-        logger.info("Fetching data from ServiceNow...")
-        
-        # Get CI data
-        ci_data = fetch_ci_data(instance_url, username, password, limit=100000000)
-        logger.info(f"Fetched {len(ci_data)} CI records")
-        if not ci_data:
-            logger.error("No CI data fetched")
-            return jsonify({'error': 'Failed to fetch CI data'}), 500
-
-        # Get audit data
-        audit_data = fetch_audit_data(instance_url, username, password, limit=200000000)
-        logger.info(f"Fetched {len(audit_data)} audit records")
-        if not audit_data:
-            logger.error("No audit data fetched")
-            return jsonify({'error': 'Failed to fetch audit data'}), 500
-
-        # Get user data
-        user_data = fetch_user_data(instance_url, username, password, limit=500000)
-        logger.info(f"Fetched {len(user_data)} user records")
-        if not user_data:
-            logger.error("No user data fetched")
-            return jsonify({'error': 'Failed to fetch user data'}), 500
-
-        logger.info(f"Fetched {len(ci_data)} CIs, {len(audit_data)} audit records, {len(user_data)} users")
+def scan_response(result, status_code, result_id=None, coalesced=False):
+    """
+    Serialize a scan result, noting the encoding negotiated for this response, where
+    the result is retained and whether it was shared with another caller's scan
+    """
+    if 'summary' in result:
+        compression = dict(result['summary']['compression'],
+                           response_encoding=response_compression.negotiate_encoding(request.headers.get('Accept-Encoding')))
+        result = dict(result, summary=dict(result['summary'], compression=compression, result_id=result_id, coalesced=coalesced))
+    return jsonify(result), status_code
+
+def scan_coalesce_key(data):
+    """Scans with equal keys fetch the same data as the same user, so one can serve them all"""
+    params = {name: value for name, value in data.items() if name not in ('instance_url', 'password', 'stream')}
+    return (data['instance_url'].rstrip('/'), json.dumps(params, sort_keys=True, default=str))
+
+def verify_credentials(instance_url, username, password):
+    """Whether ServiceNow accepts these credentials, checked with a one-row read of sys_user"""
+    try:
+        response = servicenow.get(
+            instance_url, username, password,
+            f"{instance_url.rstrip('/')}/api/now/table/sys_user",
+            headers={'Accept': 'application/json'},
+            params={'sysparm_limit': '1', 'sysparm_fields': 'sys_id'},
+            timeout=30
+        )
+        response.close()
+        return response.status_code == 200
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Could not verify credentials for {username}: {str(e)}")
+        return False
+
+def run_scan(data, progress=None):
+    """
+    Fetch and analyze one instance for a scan request body. Returns (result, status
+    code). progress, when given, is called as progress(stage, percent, **details)
+    with a snapshot of the pages fetched, records normalized and CIs scored so far
+    (see ScanProgress) as the scan moves through its stages.
+    """
+    if model is None:
+        return {'error': 'ML model not loaded. Please check server logs.'}, 500
+    
+    tracker = ScanProgress(progress)
+    try:
+        inputs, error = load_scan_inputs(data, tracker)
+        if error:
+            return error
 
         # Process data and make predictions
+        tracker.set_stage('normalizing', tracker.percent)
         try:
-            stale_ci_list = analyze_cis_with_model(ci_data, audit_data, user_data)
+            stale_ci_list = analyze_cis_with_model(inputs['ci_data'], inputs['audit_data'], inputs['user_data'], inputs['activity_data'], progress=tracker)
         except Exception as model_exc:
             logger.error(f"Error in analyze_cis_with_model: {str(model_exc)}", exc_info=True)
-            return jsonify({
+            return {
                 "error": f"Model analysis failed: {str(model_exc)}"
-            }), 500
+            }, 500
 
         # Group stale CIs by recommended owners
+        tracker.set_stage('grouping', 95.0)
         grouped_by_owners = group_cis_by_recommended_owners(stale_ci_list)
+        tally = new_stale_tally()
+        for ci in stale_ci_list:
+            tally_stale_ci(tally, ci)
 
-        return jsonify({
+        return {
             'success': True,
             'message': 'Analysis completed successfully',
-            'summary': {
-                'total_cis_analyzed': len(ci_data),
-                'stale_cis_found': len(stale_ci_list),
-                'high_confidence_predictions': sum(1 for ci in stale_ci_list if ci['confidence'] > 0.8),
-                'critical_risk': sum(1 for ci in stale_ci_list if ci['risk_level'] == 'Critical'),
-                'high_risk': sum(1 for ci in stale_ci_list if ci['risk_level'] == 'High'),
-                'recommended_owners_count': len(grouped_by_owners)
-            },
+            'summary': scan_summary(inputs, tally, grouped_by_owners),
             'stale_cis': stale_ci_list,
             'grouped_by_owners': grouped_by_owners
-        })
+        }, 200
 
     except Exception as e:
-        logger.error(f"Error in scan_stale_ownership: {str(e)}", exc_info=True)
-        return jsonify({
+        logger.error(f"Error in run_scan: {str(e)}", exc_info=True)
+        return {
             "error": f"Scan failed: {str(e)}"
+        }, 500
+
+def load_scan_inputs(data, tracker):
+    """
+    Validate a scan request body and fetch (or load from a snapshot) the datasets it
+    needs. Returns (inputs, None), or (None, (error result, status code)).
+    """
+    instance_url = data.get('instance_url')
+    username = data.get('username')
+    password = data.get('password')
+    
+    # Debug: Check credentials (mask password)
+    logger.info(f"Received credentials - URL: {instance_url}, Username: {username}, Password: {'*' * len(password) if password else 'None'}")
+    
+    if not instance_url or not username or not password:
+        return None, ({'error': 'Missing required credentials'}, 400)
+
+    # Fetch data from ServiceNow - the four datasets are independent, so pull them concurrently.
+    # In delta mode only rows changed since the last sync are fetched and merged into the local copy.
+    sync_mode = data.get('sync_mode', 'full')
+    compact = data.get('payload_mode', PAYLOAD_MODE) == 'compact'
+    fetch_options = {
+        'audit_ci_filter': bool(data.get('audit_ci_filter', AUDIT_CI_FILTER)),
+        'audit_lookback_days': data.get('audit_lookback_days', AUDIT_LOOKBACK_DAYS),
+        'audit_mode': data.get('audit_mode', AUDIT_MODE)
+    }
+    # Delta scans always fetch the unfiltered raw tables
+    snapshot_key = dict(fetch_options, audit_ci_filter=False, audit_lookback_days=None, audit_mode='raw') if sync_mode == 'delta' else fetch_options
+    sync_info = None
+    
+    # A recent snapshot of the same fetch skips ServiceNow entirely unless a refresh is requested
+    snapshot = None if data.get('refresh') else snapshot_store.load(instance_url, username, snapshot_key)
+    if snapshot and not verify_credentials(instance_url, username, password):
+        # Snapshots are keyed by user, not password; a caller that can't log in fetches and fails like any other
+        logger.warning(f"Not serving snapshot to unverified credentials for {username}")
+        snapshot = None
+    tracker.set_stage('fetching', 0.0)
+    if snapshot:
+        datasets, snapshot_info = snapshot
+        fetch_stats = {}
+        logger.info(f"Using snapshot from {snapshot_info['age_seconds']}s ago")
+    else:
+        logger.info(f"Fetching data from ServiceNow (sync mode: {sync_mode}, payload: {'compact' if compact else 'full'})...")
+        if sync_mode == 'delta':
+            datasets, fetch_stats, sync_info = sync_scan_datasets(instance_url, username, password, compact=compact, progress=tracker)
+        else:
+            datasets, fetch_stats = fetch_scan_datasets(instance_url, username, password, compact=compact, progress=tracker, **fetch_options)
+        if compact:
+            datasets = resolve_compact_datasets(instance_url, username, password, datasets)
+        snapshot_info = None
+        # Never snapshot a degraded fetch: a failed audit fetch would make every owned CI look inactive until it expires
+        failed = failed_fetches(fetch_stats)
+        if failed:
+            logger.warning(f"Not saving a snapshot: the {', '.join(failed)} fetch did not complete")
+        elif not _missing_required_dataset(datasets):
+            try:
+                snapshot_info = snapshot_store.save(instance_url, username, snapshot_key, datasets)
+            except Exception as e:
+                logger.warning(f"Could not save snapshot: {str(e)}")
+    
+    # Get CI data
+    ci_data = datasets['ci_data']
+    if not ci_data:
+        logger.error("No CI data fetched")
+        return None, ({'error': 'Failed to fetch CI data'}, 500)
+
+    # Get audit data (CI audit records plus user profile changes). In aggregate
+    # mode CI activity arrives pre-grouped and only profile changes are raw rows.
+    audit_data = datasets.get('ci_audit_data', [])
+    audit_data.extend(datasets['user_audit_data'])
+    activity_data = datasets.get('ci_activity_data')
+    if not audit_data and not activity_data:
+        logger.error("No audit data fetched")
+        return None, ({'error': 'Failed to fetch audit data'}, 500)
+
+    # Get user data
+    user_data = datasets['user_data']
+    if not user_data:
+        logger.error("No user data fetched")
+        return None, ({'error': 'Failed to fetch user data'}, 500)
+
+    logger.info(f"Fetched {len(ci_data)} CIs, {len(audit_data)} audit records, {len(user_data)} users")
+    return {
+        'ci_data': ci_data,
+        'audit_data': audit_data,
+        'user_data': user_data,
+        'activity_data': activity_data,
+        'fetch_stats': fetch_stats,
+        'sync': sync_info,
+        'snapshot': snapshot_info
+    }, None
+
+def new_stale_tally():
+    return {'stale_cis_found': 0, 'high_confidence_predictions': 0, 'critical_risk': 0, 'high_risk': 0}
+
+def tally_stale_ci(tally, ci):
+    """Count a stale CI towards the scan summary"""
+    tally['stale_cis_found'] += 1
+    if ci['confidence'] > 0.8:
+        tally['high_confidence_predictions'] += 1
+    if ci['risk_level'] == 'Critical':
+        tally['critical_risk'] += 1
+    elif ci['risk_level'] == 'High':
+        tally['high_risk'] += 1
+
+def scan_summary(inputs, tally, grouped_by_owners):
+    fetch_stats = inputs['fetch_stats']
+    return {
+        'total_cis_analyzed': len(inputs['ci_data']),
+        **tally,
+        'recommended_owners_count': len(grouped_by_owners),
+        'fetch_stats': fetch_stats,
+        'sync': inputs['sync'],
+        'snapshot': inputs['snapshot'],
+        'compression': {
+            'servicenow': fetch_stats.get('transfer'),
+            'response_encoding': None,
+            'response_min_bytes': response_compression.RESPONSE_COMPRESS_MIN_BYTES
+        }
+    }
+
+def retain_job_result(job):
+    """Index a finished job's stale CIs under its job ID"""
+    try:
+        scan_results.add(job.result['stale_cis'], result_id=job.id)
+    except Exception as e:
+        logger.warning(f"Could not retain result of scan job {job.id}: {str(e)}")
+
+# Scans submitted through /scan-jobs run on a pool of worker processes
+scan_jobs = ScanJobManager(run_scan, on_result=retain_job_result)
+# Synchronous scans in progress, keyed by scan_coalesce_key
+scan_flights = SingleFlight()
+SSE_KEEPALIVE_SECONDS = 15
+
+@app.route('/scan-jobs', methods=['POST'])
+def submit_scan_job():
+    """
+    Start a scan in the background. Takes the same body as /scan-stale-ownership
+    and returns a job ID to poll at /scan-jobs/<job_id>.
+    """
+    if model is None:
+        return jsonify({
+            'error': 'ML model not loaded. Please check server logs.'
         }), 500
 
-def fetch_ci_data(instance_url, username, password, limit=10000):
-    """Fetch CI data from ServiceNow"""
+    data = request.get_json(silent=True) or {}
+    if not data.get('instance_url') or not data.get('username') or not data.get('password'):
+        return jsonify({'error': 'Missing required credentials'}), 400
+
     try:
-        url = f"{instance_url}/api/now/table/cmdb_ci"
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        }
+        job, shared = scan_jobs.submit(
+            data, key=scan_coalesce_key(data),
+            credential=credential_key(data['username'], data['password']),
+            authorize=lambda: verify_credentials(data['instance_url'], data['username'], data['password']))
+    except TooManyJobsError as e:
+        logger.warning(f"Rejected scan job: {str(e)}")
+        return jsonify({'error': f"Too many scan jobs queued: {str(e)}"}), 429
+
+    return jsonify(dict(job.as_dict(),
+                        coalesced=shared,
+                        status_url=f"/scan-jobs/{job.id}",
+                        result_url=f"/scan-jobs/{job.id}/result")), 202
+
+@app.route('/scan-jobs/<job_id>', methods=['GET'])
+def get_scan_job(job_id):
+    """State, stage and percent complete of a scan job"""
+    job = scan_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Scan job not found or expired'}), 404
+    return jsonify(job.as_dict())
+
+@app.route('/scan-jobs/<job_id>/events', methods=['GET'])
+def stream_scan_job_events(job_id):
+    """
+    Server-sent events for a scan job: a 'progress' event with the job's state,
+    stage, percent and progress details on every update, then a 'done' event.
+    Reconnecting clients resume after the Last-Event-ID they saw.
+    """
+    if scan_jobs.get(job_id) is None:
+        return jsonify({'error': 'Scan job not found or expired'}), 404
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or '0'
+    after = int(last_event_id) if last_event_id.isdigit() else 0
+    
+    def generate():
+        nonlocal after
+        while True:
+            events, done = scan_jobs.wait_events(job_id, after, timeout=SSE_KEEPALIVE_SECONDS)
+            if events is None:
+                return
+            for event in events:
+                after = event['id']
+                yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+            if done:
+                return
+            if not events:
+                # Comment line so proxies don't drop an idle connection
+                yield ": keep-alive\n\n"
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/scan-jobs/<job_id>/result', methods=['GET'])
+def get_scan_job_result(job_id):
+    """The scan result of a finished job, in the same form /scan-stale-ownership returns"""
+    job = scan_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Scan job not found or expired'}), 404
+    if not job.done:
+        return jsonify(dict(job.as_dict(), error='Scan job has not finished yet')), 409
+    if job.result is None:
+        return jsonify({'error': job.error}), job.status_code
+    return scan_response(job.result, job.status_code, job.id if scan_results.get(job.id) else None)
+
+@app.route('/scan-results/<result_id>', methods=['GET'])
+def get_scan_result(result_id):
+    """Size of a retained scan result and the number of stale CIs per filter value"""
+    index = scan_results.get(result_id)
+    if index is None:
+        return jsonify({'error': 'Scan result not found or expired'}), 404
+    return jsonify({
+        'result_id': index.id,
+        'total': len(index.items),
+        'created_at': datetime.fromtimestamp(index.created).isoformat(timespec='seconds'),
+        'facets': index.facets()
+    })
+
+@app.route('/scan-results/<result_id>/cis', methods=['GET'])
+def query_scan_result(result_id):
+    """
+    One page of a retained scan's stale CIs. Filters (risk_level, ci_class, rule,
+    owner, recommended_owner) take comma-separated or repeated values;
+    min_confidence/max_confidence bound confidence; sort, order, limit and the
+    cursor from the previous page select the page.
+    """
+    index = scan_results.get(result_id)
+    if index is None:
+        return jsonify({'error': 'Scan result not found or expired'}), 404
+    
+    filters = {}
+    for name in FILTER_FIELDS:
+        values = [value for arg in request.args.getlist(name) for value in arg.split(',') if value]
+        if values:
+            filters[name] = values
+    try:
+        page = index.query(
+            filters,
+            min_confidence=request.args.get('min_confidence', type=float),
+            max_confidence=request.args.get('max_confidence', type=float),
+            sort=request.args.get('sort', 'confidence'),
+            order=request.args.get('order', 'desc'),
+            limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+            cursor=request.args.get('cursor') or None
+        )
+    except InvalidQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
+# ServiceNow Table API paging
+PAGE_SIZE = int(os.environ.get('SERVICENOW_PAGE_SIZE', 10000))
+
+# Decode Table API bodies incrementally instead of with response.json()
+STREAM_DECODE = os.environ.get('SERVICENOW_STREAM_DECODE', 'true').lower() == 'true'
+STREAM_CHUNK_SIZE = 64 * 1024
+
+TABLE_API_HEADERS = {
+    'Accept': 'application/json',
+    'Content-Type': 'application/json'
+}
+
+# Parallel sys_audit fetch: number of disjoint sys_id ranges and concurrent workers
+AUDIT_FETCH_PARTITIONS = int(os.environ.get('AUDIT_FETCH_PARTITIONS', 1))
+AUDIT_FETCH_WORKERS = int(os.environ.get('AUDIT_FETCH_WORKERS', 4))
+
+# sys_audit query planning: push owned-CI and lookback filters into the query
+AUDIT_CI_FILTER = os.environ.get('AUDIT_CI_FILTER', 'false').lower() == 'true'
+AUDIT_LOOKBACK_DAYS = int(os.environ['AUDIT_LOOKBACK_DAYS']) if os.environ.get('AUDIT_LOOKBACK_DAYS') else None
+AUDIT_MAX_URL_LENGTH = int(os.environ.get('AUDIT_MAX_URL_LENGTH', 8000))
+
+# 'compact' requests raw values only and resolves display names locally from the user table
+PAYLOAD_MODE = os.environ.get('SERVICENOW_PAYLOAD_MODE', 'full').lower()
+
+# 'raw' pulls every CI audit row; 'aggregate' asks the Aggregate API for per-user activity counts instead
+AUDIT_MODE = os.environ.get('AUDIT_MODE', 'raw').lower()
+# Most groups one Aggregate API response returns (the instance's REST row limit); a chunk that
+# reaches it is split in two and asked again, as the stats endpoint cannot be paged
+AUDIT_AGGREGATE_MAX_GROUPS = int(os.environ.get('AUDIT_AGGREGATE_MAX_GROUPS', 10000))
+# Score CIs in bulk with the model's predict_batch; 'false' scores them one at a time with predict_single
+MODEL_PREDICT_BATCH = os.environ.get('MODEL_PREDICT_BATCH', 'true').lower() == 'true'
+# Worker processes that score a large scan's CIs in shards; 1 scores them in the scan's own process
+MODEL_SCORING_WORKERS = int(os.environ.get('MODEL_SCORING_WORKERS', 1))
+AUDIT_RECENT_DAYS = 30
+
+CI_AUDIT_FIELDS = 'sys_id,sys_created_on,tablename,fieldname,documentkey,user,user.user_name,user.name,user.sys_id,oldvalue,newvalue'
+CI_AUDIT_QUERY = 'tablename=cmdb_ci^ORtablename=cmdb_ci_server^ORtablename=cmdb_ci_computer^ORtablename=cmdb_ci_linux_server^ORtablename=cmdb_ci_win_server'
+
+class ServiceNowFetchError(Exception):
+    """Raised when a Table API page cannot be fetched or decoded"""
+
+class FetchCancelledError(ServiceNowFetchError):
+    """Raised when a paged fetch is cancelled between pages"""
+
+def and_query(query, condition):
+    """AND an extra condition onto an encoded query"""
+    if not condition:
+        return query
+    return f"{query}^{condition}" if query else condition
+
+def _iter_page_records(response, table, offset, counter, transfer_stats=None):
+    """Decode the records of one Table API page, counting them as they are produced"""
+    chunks = iter_body(response, STREAM_CHUNK_SIZE, transfer_stats)
+    try:
+        if STREAM_DECODE:
+            # Parse the body as it arrives instead of buffering it for response.json()
+            for record in iter_json_array_items(chunks):
+                counter[0] += 1
+                yield record
+        else:
+            page = json.loads(b''.join(chunks)).get('result', [])
+            if not isinstance(page, list):
+                raise ValueError(f"result is not a list: {type(page)}")
+            counter[0] = len(page)
+            yield from page
+    except ValueError as e:
+        raise ServiceNowFetchError(f"Failed to parse {table} page at offset {offset}: {str(e)}")
+    finally:
+        chunks.close()
+        response.close()
+
+def iter_table_pages(instance_url, username, password, table, params, limit=None, page_size=None, timeout=60, cancel_event=None, transfer_stats=None):
+    """
+    Yield each page of a ServiceNow table as an iterator of its records.
+    Pages are requested with sysparm_offset/sysparm_limit over a stable sys_id
+    ordering, and each page's records are decoded while the body streams in, so
+    memory tracks the record being parsed rather than the page or the table.
+    """
+    url = f"{instance_url}/api/now/table/{table}"
+    page_size = page_size or PAGE_SIZE
+    query = params.get('sysparm_query', '')
+    ordered_query = f"{query}^ORDERBYsys_id" if query else 'ORDERBYsys_id'
+    offset = 0
+    
+    while limit is None or offset < limit:
+        if cancel_event is not None and cancel_event.is_set():
+            raise FetchCancelledError(f"{table} fetch cancelled at offset {offset}")
         
-        response = requests.get(
+        page_limit = page_size if limit is None else min(page_size, limit - offset)
+        page_params = dict(params, sysparm_query=ordered_query, sysparm_limit=page_limit, sysparm_offset=offset)
+        
+        response = servicenow.get(
+            instance_url, username, password,
             url,
-            auth=(username, password),
-            headers=headers,
-            params={
-                'sysparm_limit': limit,
-                'sysparm_fields': 'sys_id,name,short_description,sys_class_name,sys_updated_on,assigned_to,assigned_to.user_name,assigned_to.name,assigned_to.sys_id',
-                'sysparm_display_value': 'all'
-            },
-            timeout=60
+            headers=TABLE_API_HEADERS,
+            params=page_params,
+            timeout=timeout,
+            stream=True
         )
         
-        if response.status_code == 200:
-            try:
-                json_data = response.json()
-                result = json_data.get('result', [])
-                if not isinstance(result, list):
-                    logger.error(f"CI data result is not a list: {type(result)} - {result}")
-                    return []
-                logger.info(f"Successfully fetched {len(result)} CI records")
-                return result
-            except (ValueError, KeyError) as e:
-                logger.error(f"Failed to parse CI data JSON: {str(e)} - Response: {response.text[:500]}")
-                return []
-        else:
-            logger.error(f"Failed to fetch CI data: {response.status_code} - {response.text[:500]}")
-            return []
-            
-    except Exception as e:
-        logger.error(f"Error fetching CI data: {str(e)}")
-        return []
-
-def fetch_audit_data(instance_url, username, password, limit=20000):
-    """Fetch audit data from ServiceNow including user profile changes"""
-    try:
-        # Fetch CI-related audit records
-        ci_audit_data = fetch_ci_audit_records(instance_url, username, password, limit)
+        if response.status_code != 200:
+            raise ServiceNowFetchError(f"{table} page at offset {offset} returned {response.status_code} - {response.text[:500]}")
         
-        # Fetch user profile audit records (title, department changes)
-        user_audit_data = fetch_user_audit_records(instance_url, username, password, limit // 2)
+        counter = [0]
+        page = _iter_page_records(response, table, offset, counter, transfer_stats)
+        try:
+            yield page
+            # Finish decoding anything the consumer did not read so the count is complete
+            for _ in page:
+                pass
+        finally:
+            page.close()
         
-        # Combine both datasets
-        combined_audit_data = ci_audit_data + user_audit_data
+        total_count = response.headers.get('X-Total-Count')
+        if transfer_stats is not None:
+            transfer_stats.record_page(counter[0], int(total_count) if total_count and total_count.isdigit() else None, offset == 0)
         
-        logger.info(f"Combined audit data: {len(ci_audit_data)} CI records + {len(user_audit_data)} user profile records = {len(combined_audit_data)} total")
-        return combined_audit_data
-            
+        # Security-trimmed pages can come back short, so prefer the server's total
+        # row count when deciding whether another page exists. Without a count
+        # (sysparm_no_count) only an empty page reliably marks the end.
+        offset += page_limit
+        if total_count is not None and total_count.isdigit():
+            if offset >= int(total_count):
+                return
+        elif params.get('sysparm_no_count') == 'true':
+            if counter[0] == 0:
+                return
+        elif counter[0] < page_limit:
+            return
+
+def iter_table_records(instance_url, username, password, table, params, limit=None, page_size=None, timeout=60, cancel_event=None, transfer_stats=None):
+    """Yield individual records from a ServiceNow table as they are decoded, page by page"""
+    for page in iter_table_pages(instance_url, username, password, table, params, limit, page_size, timeout, cancel_event, transfer_stats):
+        yield from page
+
+def fetch_ci_data(instance_url, username, password, limit=10000, cancel_event=None, query=None, compact=False, transfer_stats=None):
+    """
+    Yield CI records from ServiceNow page by page, optionally restricted by an
+    extra encoded query. A failed fetch is logged and raised to the consumer.
+    """
+    params = {
+        'sysparm_fields': 'sys_id,name,short_description,sys_class_name,sys_updated_on,assigned_to,assigned_to.user_name,assigned_to.name,assigned_to.sys_id',
+        'sysparm_display_value': 'all',
+        'sysparm_query': and_query('', query)
+    }
+    try:
+        yield from iter_table_records(
+            instance_url, username, password, 'cmdb_ci',
+            params=compact_params(params) if compact else params,
+            limit=limit,
+            timeout=60,
+            cancel_event=cancel_event,
+            transfer_stats=transfer_stats
+        )
     except Exception as e:
-        logger.error(f"Error fetching audit data: {str(e)}")
-        return []
+        logger.error(f"Failed to fetch CI data: {str(e)}")
+        raise
+
+def sys_id_ranges(partitions):
+    """
+    Split the sys_id keyspace into disjoint, contiguous ranges.
+    sys_ids are 32-character hex GUIDs, so splitting on the leading two hex digits
+    gives evenly sized ranges. Returns a list of (lower, upper) bounds where None
+    means unbounded.
+    """
+    partitions = max(1, min(int(partitions), 256))
+    bounds = [format(i * 256 // partitions, '02x') for i in range(1, partitions)]
+    lowers = [None] + bounds
+    uppers = bounds + [None]
+    return list(zip(lowers, uppers))
+
+def sys_id_range_query(query, lower, upper):
+    """Restrict an encoded query to sys_id values in [lower, upper)"""
+    conditions = [query] if query else []
+    if lower is not None:
+        conditions.append(f"sys_id>={lower}")
+    if upper is not None:
+        conditions.append(f"sys_id<{upper}")
+    return '^'.join(conditions)
+
+def fetch_table_partitioned(instance_url, username, password, table, params, partitions, workers=None, limit=None, timeout=60, cancel_event=None, transfer_stats=None):
+    """
+    Fetch a table as disjoint sys_id ranges on a bounded worker pool, yielding the
+    records in key order. Each range is paged in sys_id order and ranges are
+    yielded one after another, so the output is identical to a serial fetch of the
+    same query. A range fetched ahead of its turn is buffered until the ranges
+    before it are yielded, and is released as soon as it has been.
+    """
+    ranges = sys_id_ranges(partitions)
+    query = params.get('sysparm_query', '')
+    
+    def fetch_range(bounds):
+        lower, upper = bounds
+        range_params = dict(params, sysparm_query=sys_id_range_query(query, lower, upper))
+        return list(iter_table_records(instance_url, username, password, table, range_params, limit=limit, timeout=timeout, cancel_event=cancel_event, transfer_stats=transfer_stats))
+    
+    fetched = 0
+    with ThreadPoolExecutor(max_workers=workers or AUDIT_FETCH_WORKERS) as executor:
+        pending = deque(executor.submit(fetch_range, bounds) for bounds in ranges)
+        try:
+            while pending and (limit is None or fetched < limit):
+                records = pending.popleft().result()
+                if limit is not None:
+                    records = records[:limit - fetched]
+                fetched += len(records)
+                yield from records
+        finally:
+            for future in pending:
+                future.cancel()
+    
+    logger.info(f"Fetched {fetched} {table} records across {len(ranges)} sys_id ranges")
 
-def fetch_ci_audit_records(instance_url, username, password, limit=15000):
-    """Fetch CI-related audit records from ServiceNow"""
+def fetch_ci_audit_records(instance_url, username, password, limit=15000, partitions=None, cancel_event=None, query=None, compact=False, transfer_stats=None):
+    """
+    Yield CI-related audit records from ServiceNow page by page, optionally
+    restricted by an extra encoded query. A failed fetch is logged and raised.
+    """
+    params = {
+        'sysparm_fields': CI_AUDIT_FIELDS,
+        'sysparm_display_value': 'all',
+        'sysparm_query': and_query(CI_AUDIT_QUERY, query)
+    }
+    if compact:
+        params = compact_params(params)
+    partitions = partitions or AUDIT_FETCH_PARTITIONS
+    
     try:
-        url = f"{instance_url}/api/now/table/sys_audit"
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        }
-        
         # Get recent audit records for CI table changes
-        response = requests.get(
-            url,
-            auth=(username, password),
-            headers=headers,
-            params={
-                'sysparm_limit': limit,
-                'sysparm_fields': 'sys_created_on,tablename,fieldname,documentkey,user,user.user_name,user.name,user.sys_id,oldvalue,newvalue',
-                'sysparm_display_value': 'all',
-                'sysparm_query': 'tablename=cmdb_ci^ORtablename=cmdb_ci_server^ORtablename=cmdb_ci_computer^ORtablename=cmdb_ci_linux_server^ORtablename=cmdb_ci_win_server'
-            },
-            timeout=120
-        )
-        
-        if response.status_code == 200:
-            try:
-                json_data = response.json()
-                result = json_data.get('result', [])
-                if not isinstance(result, list):
-                    logger.error(f"CI audit data result is not a list: {type(result)} - {result}")
-                    return []
-                logger.info(f"Successfully fetched {len(result)} CI audit records")
-                return result
-            except (ValueError, KeyError) as e:
-                logger.error(f"Failed to parse CI audit data JSON: {str(e)} - Response: {response.text[:500]}")
-                return []
+        if partitions > 1:
+            yield from fetch_table_partitioned(instance_url, username, password, 'sys_audit', params, partitions, limit=limit, timeout=120, cancel_event=cancel_event, transfer_stats=transfer_stats)
         else:
-            logger.error(f"Failed to fetch CI audit data: {response.status_code} - {response.text[:500]}")
-            return []
-            
+            yield from iter_table_records(instance_url, username, password, 'sys_audit', params, limit=limit, timeout=120, cancel_event=cancel_event, transfer_stats=transfer_stats)
     except Exception as e:
-        logger.error(f"Error fetching CI audit data: {str(e)}")
-        return []
+        logger.error(f"Failed to fetch CI audit data: {str(e)}")
+        raise
+
+def lookback_condition(days):
+    """Encoded query condition selecting audit rows created in the last `days` days"""
+    return f"sys_created_on>=javascript:gs.daysAgoStart({int(days)})"
 
-def fetch_user_audit_records(instance_url, username, password, limit=10000):
-    """Fetch user profile audit records (title, department changes) from ServiceNow"""
+def owned_ci_ids(ci_data):
+    """
+    Collect the sys_ids of CIs that have an assigned owner - the only CIs whose
+    audit history the model looks at
+    """
+    ci_ids = set()
+    for ci in ci_data:
+        assigned_to = ci.get('assigned_to')
+        if isinstance(assigned_to, dict):
+            has_owner = assigned_to.get('value') or assigned_to.get('display_value') or ci.get('assigned_to.user_name')
+        else:
+            has_owner = assigned_to
+        ci_sys_id = ci.get('sys_id')
+        if isinstance(ci_sys_id, dict):
+            ci_sys_id = ci_sys_id.get('value', ci_sys_id.get('display_value', ''))
+        if has_owner and ci_sys_id:
+            ci_ids.add(str(ci_sys_id))
+    return ci_ids
+
+def plan_ci_audit_chunks(url, params, ci_ids, lookback_days=None, max_url_length=None):
+    """
+    Split the given CIs into documentkeyIN chunks for a sys_audit query.
+    Each chunk is sized so the full request URL, including the paging parameters
+    added later, stays under max_url_length. Returns (base query, list of sorted
+    sys_id lists); documentkey_query turns a chunk into its encoded query.
+    """
+    max_url_length = max_url_length or AUDIT_MAX_URL_LENGTH
+    query = params.get('sysparm_query', '')
+    if lookback_days:
+        query = and_query(query, lookback_condition(lookback_days))
+    
+    # Length of the request with an empty key list, with room for paging parameters
+    overhead_params = dict(params, sysparm_query=and_query(query, 'documentkeyIN') + '^ORDERBYsys_id',
+                           sysparm_limit='9' * 10, sysparm_offset='9' * 10)
+    overhead = len(url) + 1 + len(urlencode(overhead_params))
+    budget = max_url_length - overhead
+    
+    chunks = []
+    chunk = []
+    used = 0
+    for ci_id in sorted(ci_ids):
+        cost = len(urlencode({'': ci_id})) - 1 + (len(urlencode({'': ','})) - 1 if chunk else 0)
+        if chunk and used + cost > budget:
+            chunks.append(chunk)
+            chunk, used = [], 0
+            cost = len(urlencode({'': ci_id})) - 1
+        chunk.append(ci_id)
+        used += cost
+    if chunk:
+        chunks.append(chunk)
+    return query, chunks
+
+def documentkey_query(query, ci_ids):
+    """Restrict an encoded sys_audit query to records of the given CIs"""
+    return and_query(query, 'documentkeyIN' + ','.join(ci_ids))
+
+def plan_ci_audit_queries(url, params, ci_ids, lookback_days=None, max_url_length=None):
+    """Split a sys_audit query into documentkeyIN queries covering the given CIs (see plan_ci_audit_chunks)"""
+    query, chunks = plan_ci_audit_chunks(url, params, ci_ids, lookback_days, max_url_length)
+    return [documentkey_query(query, chunk) for chunk in chunks]
+
+def fetch_ci_audit_records_for_cis(instance_url, username, password, ci_ids, lookback_days=None, limit=15000, cancel_event=None, query=None, compact=False, transfer_stats=None):
+    """
+    Yield CI audit records for only the given CIs, optionally bounded to a lookback
+    window. The planned documentkeyIN chunks run concurrently and are merged back
+    into sys_id order as they are yielded. A failed fetch is logged and raised.
+    """
+    params = {
+        'sysparm_fields': CI_AUDIT_FIELDS,
+        'sysparm_display_value': 'all',
+        'sysparm_query': and_query(CI_AUDIT_QUERY, query)
+    }
+    if compact:
+        params = compact_params(params)
+    url = f"{instance_url}/api/now/table/sys_audit"
+    chunk_queries = plan_ci_audit_queries(url, params, ci_ids, lookback_days)
+    logger.info(f"Planned {len(chunk_queries)} sys_audit queries for {len(ci_ids)} owned CIs (lookback: {lookback_days or 'none'})")
+    
+    def fetch_chunk(chunk_query):
+        chunk_params = dict(params, sysparm_query=chunk_query)
+        return list(iter_table_records(instance_url, username, password, 'sys_audit', chunk_params, limit=limit, timeout=120, cancel_event=cancel_event, transfer_stats=transfer_stats))
+    
+    # Each chunk is already in sys_id order and chunks are disjoint by documentkey
+    def audit_sys_id(record):
+        sys_id = record.get('sys_id', '')
+        return sys_id.get('value', '') if isinstance(sys_id, dict) else sys_id
+    
     try:
-        url = f"{instance_url}/api/now/table/sys_audit"
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        }
+        with ThreadPoolExecutor(max_workers=AUDIT_FETCH_WORKERS) as executor:
+            chunks = list(executor.map(fetch_chunk, chunk_queries))
+    except Exception as e:
+        logger.error(f"Failed to fetch CI audit data: {str(e)}")
+        raise
+    yield from islice(heapq.merge(*chunks, key=audit_sys_id), limit)
+
+def _parse_aggregate_groups(payload):
+    """Flatten an Aggregate API group-by response body into (group values, stats) pairs"""
+    groups = []
+    for item in payload.get('result', []):
+        values = {group.get('field'): group.get('value', '') for group in item.get('groupby_fields', [])}
+        groups.append((values, item.get('stats', {})))
+    return groups
+
+def fetch_ci_audit_aggregates(instance_url, username, password, ci_ids, lookback_days=None, cancel_event=None, query=None, transfer_stats=None):
+    """
+    Fetch per-user activity on the given CIs from the Aggregate API instead of the
+    raw audit rows. Returns one row per (documentkey, user, fieldname) with the
+    record count, first and last sys_created_on and the count from the last
+    AUDIT_RECENT_DAYS days - the inputs the model's activity features need. A
+    stats call cannot count a subset of its rows, so the recent counts come from
+    a second grouped query per chunk. A failed fetch is logged and raised.
+    """
+    url = f"{instance_url}/api/now/stats/sys_audit"
+    group_by = 'documentkey,user,fieldname'
+    params = {
+        'sysparm_query': and_query(CI_AUDIT_QUERY, query),
+        'sysparm_group_by': group_by,
+        'sysparm_count': 'true',
+        'sysparm_min_fields': 'sys_created_on',
+        'sysparm_max_fields': 'sys_created_on',
+        'sysparm_display_value': 'false'
+    }
+    base_query, chunks = plan_ci_audit_chunks(url, params, ci_ids, lookback_days)
+    logger.info(f"Planned {len(chunks)} sys_audit aggregate queries for {len(ci_ids)} owned CIs (lookback: {lookback_days or 'none'})")
+    
+    def fetch_groups(chunk, recent):
+        if cancel_event is not None and cancel_event.is_set():
+            raise FetchCancelledError("sys_audit aggregate fetch cancelled")
+        chunk_query = documentkey_query(base_query, chunk)
+        chunk_params = dict(params, sysparm_query=chunk_query)
+        if recent:
+            chunk_params = {
+                'sysparm_query': and_query(chunk_query, f"sys_created_on>javascript:gs.daysAgo({AUDIT_RECENT_DAYS})"),
+                'sysparm_group_by': group_by,
+                'sysparm_count': 'true',
+                'sysparm_display_value': 'false'
+            }
+        response = servicenow.get(instance_url, username, password, url, headers=TABLE_API_HEADERS, params=chunk_params, timeout=120, stream=True)
+        try:
+            if response.status_code != 200:
+                raise ServiceNowFetchError(f"sys_audit aggregate request failed with status {response.status_code}: {response.text[:500]}")
+            payload = json.loads(b''.join(iter_body(response, STREAM_CHUNK_SIZE, transfer_stats)))
+        finally:
+            response.close()
+        groups = _parse_aggregate_groups(payload)
         
-        # First, let's get a broader set of sys_user audit records to see what's available
-        test_response = requests.get(
-            url,
-            auth=(username, password),
-            headers=headers,
-            params={
-                'sysparm_limit': 100,
-                'sysparm_fields': 'tablename,fieldname,documentkey',
-                'sysparm_query': 'tablename=sys_user'
-            },
-            timeout=30
+        # A response that fills the row limit may have been cut short; chunks are
+        # disjoint by documentkey, so the halves' groups simply add up
+        if len(groups) >= AUDIT_AGGREGATE_MAX_GROUPS:
+            if len(chunk) == 1:
+                raise ServiceNowFetchError(f"sys_audit aggregate for CI {chunk[0]} reached the {AUDIT_AGGREGATE_MAX_GROUPS} group limit")
+            middle = len(chunk) // 2
+            return fetch_groups(chunk[:middle], recent) + fetch_groups(chunk[middle:], recent)
+        return groups
+    
+    try:
+        # Totals and the recent-activity counts for every chunk run side by side
+        with ThreadPoolExecutor(max_workers=AUDIT_FETCH_WORKERS) as executor:
+            totals = executor.map(lambda chunk: fetch_groups(chunk, False), chunks)
+            recents = executor.map(lambda chunk: fetch_groups(chunk, True), chunks)
+            totals, recents = list(totals), list(recents)
+    except Exception as e:
+        logger.error(f"Failed to fetch CI audit aggregates: {str(e)}")
+        raise
+    
+    def group_key(values):
+        return (values.get('documentkey', ''), values.get('user', ''), values.get('fieldname', ''))
+    
+    recent_counts = {}
+    for groups in recents:
+        for values, stats in groups:
+            recent_counts[group_key(values)] = int(stats.get('count', 0))
+    
+    rows = []
+    for groups in totals:
+        for values, stats in groups:
+            documentkey, user, fieldname = group_key(values)
+            rows.append({
+                'documentkey': documentkey,
+                'user': user,
+                'fieldname': fieldname,
+                'count': int(stats.get('count', 0)),
+                'first_activity': stats.get('min', {}).get('sys_created_on', ''),
+                'last_activity': stats.get('max', {}).get('sys_created_on', ''),
+                'recent_count': recent_counts.get((documentkey, user, fieldname), 0)
+            })
+    logger.info(f"Successfully fetched {len(rows)} CI audit activity groups")
+    return rows
+
+def fetch_user_audit_records(instance_url, username, password, limit=10000, cancel_event=None, query=None, compact=False, transfer_stats=None):
+    """
+    Yield user profile audit records (title, department changes) from ServiceNow
+    page by page, each marked as a profile change. A failed fetch is logged and
+    raised to the consumer.
+    """
+    # Cast a wide net to capture all profile change fields observed in the ServiceNow UI
+    params = {
+        'sysparm_fields': CI_AUDIT_FIELDS,
+        'sysparm_display_value': 'all',
+        'sysparm_query': and_query('tablename=sys_user^fieldnameINtitle,department,manager,active,job_title,u_job_title,cost_center,location,company,u_account_type,u_team_structure,u_compliance_certified,u_additional_responsibilities,u_vendor_status,u_work_arrangement,u_coverage_status,u_employee_type,building,employee_number,u_leave_type,skills,u_acquisition_date,vip,u_specialization,u_on_call,locked_out,last_login_time,u_focus_area,u_methodology,u_service_model,u_additional_servers^sys_created_onONLast 90 days@javascript:gs.daysAgoStart(90)@javascript:gs.daysAgoEnd(0)', query)
+    }
+    
+    def value(record, field):
+        value = record.get(field, '')
+        return value.get('value', value.get('display_value', '')) if isinstance(value, dict) else value
+    
+    field_breakdown = {}
+    table_counts = {}
+    try:
+        for i, record in enumerate(iter_table_records(
+            instance_url, username, password, 'sys_audit',
+            params=compact_params(params) if compact else params,
+            limit=limit,
+            timeout=120,
+            cancel_event=cancel_event,
+            transfer_stats=transfer_stats
+        )):
+            # Add a marker to distinguish user profile changes
+            record['audit_type'] = 'user_profile_change'
+            field = value(record, 'fieldname')
+            field_breakdown[field] = field_breakdown.get(field, 0) + 1
+            table = value(record, 'tablename')
+            table_counts[table] = table_counts.get(table, 0) + 1
+            if i < 5 and sample_log.isEnabledFor(logging.DEBUG):
+                sample_log.debug("User profile audit record %d: tablename=%s, fieldname=%s, documentkey=%s, oldvalue=%s, newvalue=%s, created=%s",
+                                 i, table, field, value(record, 'documentkey'), record.get('oldvalue'),
+                                 record.get('newvalue'), record.get('sys_created_on'))
+            yield record
+    except Exception as e:
+        logger.error(f"Failed to fetch user audit data: {str(e)}")
+        raise
+    
+    logger.info(f"Successfully fetched {sum(field_breakdown.values())} user profile audit records")
+    logger.info(f"Profile changes breakdown by field: {field_breakdown}")
+    # Verify the query only matched sys_user records
+    if table_counts and (len(table_counts) > 1 or 'sys_user' not in table_counts):
+        logger.warning(f"Expected only sys_user records, but got: {table_counts}")
+
+def fetch_user_data(instance_url, username, password, limit=5000, cancel_event=None, query=None, compact=False, transfer_stats=None):
+    """
+    Yield user records from ServiceNow page by page, optionally restricted by an
+    extra encoded query. A failed fetch is logged and raised to the consumer.
+    """
+    params = {
+        'sysparm_fields': 'sys_id,user_name,name,email,active,sys_created_on,sys_updated_on,department',
+        'sysparm_query': and_query('', query)
+    }
+    try:
+        yield from iter_table_records(
+            instance_url, username, password, 'sys_user',
+            params=compact_params(params) if compact else params,
+            limit=limit,
+            timeout=60,
+            cancel_event=cancel_event,
+            transfer_stats=transfer_stats
         )
+    except Exception as e:
+        logger.error(f"Failed to fetch user data: {str(e)}")
+        raise
+
+def _missing_required_dataset(datasets):
+    """Check whether a finished fetch has already made the scan impossible"""
+    for name in ('ci_data', 'user_data'):
+        if name in datasets and not datasets[name]:
+            return name
+    ci_audit = 'ci_activity_data' if 'ci_activity_data' in datasets else 'ci_audit_data'
+    if ci_audit in datasets and 'user_audit_data' in datasets:
+        if not datasets[ci_audit] and not datasets['user_audit_data']:
+            return 'audit_data'
+    return None
+
+def failed_fetches(fetch_stats):
+    """Names of the datasets whose fetch failed or was cancelled"""
+    return [
+        name for name, stats in fetch_stats.items()
+        if name != 'transfer' and (stats.get('error') or stats.get('cancelled'))
+    ]
+
+def fetch_scan_datasets(instance_url, username, password, queries=None, cancel_on_empty=True, audit_ci_filter=False, audit_lookback_days=None, audit_mode='raw', compact=False, progress=None):
+    """
+    Fetch the CI, CI audit, user audit and user datasets concurrently.
+    The fetchers stream their records page by page and each table is collected
+    here, the point from which the scan holds it: it is checked for emptiness,
+    snapshotted and indexed by the model. Each fetch is timed and isolated: a
+    failure yields an empty list plus an error entry instead of raising. As soon as a dataset the scan cannot do without comes
+    back empty, the remaining fetches are cancelled at their next page boundary.
+    queries optionally maps a dataset name to an extra encoded query condition.
+    With audit_ci_filter the CI audit fetch waits for the CI list and only requests
+    history for owned CIs. In 'aggregate' audit_mode the raw CI audit rows are
+    replaced by 'ci_activity_data', per-user activity groups for the owned CIs
+    from the Aggregate API. With compact, value-only payloads are requested (see
+    resolve_compact_datasets). progress, a ScanProgress, is told about every page
+    and finished dataset. Returns (datasets, fetch_stats); each dataset's stats
+    include the bytes received on the wire and after decompression.
+    """
+    queries = queries or {}
+    cancel_event = threading.Event()
+    submitted = {}
+    
+    def on_page(name):
+        return lambda stats: progress.table_page(name, stats.pages, stats.records, stats.total_count)
+    
+    transfer = {
+        name: TransferStats(on_page(name) if progress is not None else None)
+        for name in ('ci_data', 'ci_audit_data', 'ci_activity_data', 'user_audit_data', 'user_data')
+    }
+    
+    def fetch_ci_audit():
+        query = queries.get('ci_audit_data')
+        if audit_ci_filter:
+            ci_ids = owned_ci_ids(submitted['ci_data'].result()[0])
+            return fetch_ci_audit_records_for_cis(instance_url, username, password, ci_ids, audit_lookback_days, limit=200000000, cancel_event=cancel_event, query=query, compact=compact, transfer_stats=transfer['ci_audit_data'])
+        if audit_lookback_days:
+            query = and_query(query or '', lookback_condition(audit_lookback_days))
+        return fetch_ci_audit_records(instance_url, username, password, limit=200000000, cancel_event=cancel_event, query=query, compact=compact, transfer_stats=transfer['ci_audit_data'])
+    
+    def fetch_ci_activity():
+        ci_ids = owned_ci_ids(submitted['ci_data'].result()[0])
+        return fetch_ci_audit_aggregates(instance_url, username, password, ci_ids, audit_lookback_days, cancel_event=cancel_event, query=queries.get('ci_audit_data'), transfer_stats=transfer['ci_activity_data'])
+    
+    fetches = {
+        'ci_data': lambda: fetch_ci_data(instance_url, username, password, limit=100000000, cancel_event=cancel_event, query=queries.get('ci_data'), compact=compact, transfer_stats=transfer['ci_data']),
+        'ci_audit_data': fetch_ci_audit,
+        'user_audit_data': lambda: fetch_user_audit_records(instance_url, username, password, limit=100000000, cancel_event=cancel_event, query=queries.get('user_audit_data'), compact=compact, transfer_stats=transfer['user_audit_data']),
+        'user_data': lambda: fetch_user_data(instance_url, username, password, limit=500000, cancel_event=cancel_event, query=queries.get('user_data'), compact=compact, transfer_stats=transfer['user_data'])
+    }
+    if audit_mode == 'aggregate':
+        del fetches['ci_audit_data']
+        fetches['ci_activity_data'] = fetch_ci_activity
+    if progress is not None:
+        progress.start_fetch(fetches)
+    
+    def timed_fetch(fetch):
+        started = time.perf_counter()
+        error = None
+        try:
+            records = fetch()
+            if not isinstance(records, list):
+                records = list(records)
+        except FetchCancelledError:
+            records = []
+        except Exception as e:
+            records = []
+            error = str(e)
+        return records, time.perf_counter() - started, error
+    
+    datasets = {}
+    fetch_stats = {}
+    with ThreadPoolExecutor(max_workers=len(fetches)) as executor:
+        # CIs are submitted first so a filtered audit fetch can wait on them
+        for name, fetch in fetches.items():
+            submitted[name] = executor.submit(timed_fetch, fetch)
+        futures = {future: name for name, future in submitted.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            records, elapsed, error = future.result()
+            datasets[name] = records
+            fetch_stats[name] = {
+                'records': len(records),
+                'seconds': round(elapsed, 3),
+                'cancelled': not records and cancel_event.is_set(),
+                'error': error,
+                'wire_bytes': transfer[name].wire_bytes,
+                'decoded_bytes': transfer[name].decoded_bytes
+            }
+            logger.info(f"Fetched {name}: {len(records)} records in {elapsed:.2f}s")
+            if progress is not None:
+                progress.table_fetched(name, len(records))
+            
+            missing = _missing_required_dataset(datasets) if cancel_on_empty else None
+            if missing and not cancel_event.is_set():
+                logger.warning(f"No {missing} fetched, cancelling remaining fetches")
+                cancel_event.set()
+    
+    total = TransferStats()
+    for name in fetches:
+        total.merge(transfer[name])
+    fetch_stats['transfer'] = total.as_dict()
+    return datasets, fetch_stats
+
+def sync_scan_datasets(instance_url, username, password, compact=False, progress=None):
+    """
+    Bring the local copy of an instance up to date and return the merged datasets.
+    The first sync (and a periodic refresh) downloads everything; later syncs only
+    fetch rows past each high-water mark. Returns (datasets, fetch_stats, sync_info).
+    """
+    instance_url = instance_url.rstrip('/')
+    with sync_store.lock(instance_url, username):
+        state = sync_store.load(instance_url, username)
+        full = needs_full_refresh(state)
+        queries = None if full else delta_queries(state)
         
-        if test_response.status_code == 200:
-            test_data = test_response.json().get('result', [])
-            field_counts = {}
-            for record in test_data:
-                field = record.get('fieldname', {})
-                if isinstance(field, dict):
-                    field = field.get('value', field.get('display_value', ''))
-                field_counts[field] = field_counts.get(field, 0) + 1
-            logger.info(f"Available sys_user audit fields (sample of 100): {field_counts}")
+        datasets, fetch_stats = fetch_scan_datasets(instance_url, username, password, queries=queries, cancel_on_empty=full, compact=compact, progress=progress)
+        fetched_counts = {name: len(records) for name, records in datasets.items()}
         
-        # Get user profile change records - cast a wider net to capture all profile changes
-        # Based on the ServiceNow UI, we can see many more field types than just title/department
-        response = requests.get(
-            url,
-            auth=(username, password),
-            headers=headers,
-            params={
-                'sysparm_limit': limit,
-                'sysparm_fields': 'sys_created_on,tablename,fieldname,documentkey,user,user.user_name,user.name,user.sys_id,oldvalue,newvalue',
-                'sysparm_display_value': 'all',
-                # Expanded query to include more profile change fields observed in the ServiceNow UI
-                'sysparm_query': 'tablename=sys_user^fieldnameINtitle,department,manager,active,job_title,u_job_title,cost_center,location,company,u_account_type,u_team_structure,u_compliance_certified,u_additional_responsibilities,u_vendor_status,u_work_arrangement,u_coverage_status,u_employee_type,building,employee_number,u_leave_type,skills,u_acquisition_date,vip,u_specialization,u_on_call,locked_out,last_login_time,u_focus_area,u_methodology,u_service_model,u_additional_servers^sys_created_onONLast 90 days@javascript:gs.daysAgoStart(90)@javascript:gs.daysAgoEnd(0)'
-            },
-            timeout=120
-        )
+        # Don't merge a failed or cancelled fetch into the copy: a full sync would replace
+        # the table with nothing and a delta would advance past rows it never saw
+        failed = failed_fetches(fetch_stats)
+        if failed or (full and _missing_required_dataset(datasets)):
+            logger.warning(f"Not saving the sync of {instance_url}: {', '.join(failed) or 'a required dataset'} fetch did not complete")
+            sync_info = {'mode': 'full' if full else 'delta', 'fetched': fetched_counts, 'saved': False, 'failed': failed}
+            # Scan the unchanged local copy rather than a partial download
+            return (materialize(state) if state else datasets), fetch_stats, sync_info
         
-        if response.status_code == 200:
-            try:
-                json_data = response.json()
-                result = json_data.get('result', [])
-                if not isinstance(result, list):
-                    logger.error(f"User audit data result is not a list: {type(result)} - {result}")
-                    return []
-                
-                # Add a marker to distinguish user profile changes
-                for record in result:
-                    record['audit_type'] = 'user_profile_change'
-                
-                logger.info(f"Successfully fetched {len(result)} user profile audit records")
-                
-                # Debug: Log sample of user profile changes
-                if result:
-                    logger.info("Sample user profile audit records:")
-                    for i, record in enumerate(result[:5]):  # Show first 5
-                        logger.info(f"  Record {i}: tablename={record.get('tablename')}, fieldname={record.get('fieldname')}, "
-                                  f"documentkey={record.get('documentkey')}, oldvalue={record.get('oldvalue')}, "
-                                  f"newvalue={record.get('newvalue')}")
-                
-                # Count by field type
-                field_breakdown = {}
-                for r in result:
-                    field = r.get('fieldname')
-                    if isinstance(field, dict):
-                        field = field.get('value', field.get('display_value', ''))
-                    field_breakdown[field] = field_breakdown.get(field, 0) + 1
-                
-                logger.info(f"Profile changes breakdown by field: {field_breakdown}")
-                
-                # Debug: Show all records if there are few
-                if len(result) <= 50:
-                    logger.info("All user profile audit records (since there are few):")
-                    for i, record in enumerate(result):
-                        doc_key = record.get('documentkey', {})
-                        if isinstance(doc_key, dict):
-                            doc_key_val = doc_key.get('value', doc_key.get('display_value', ''))
-                        else:
-                            doc_key_val = doc_key
-                        
-                        # Get table name to verify filtering
-                        table_name = record.get('tablename', {})
-                        if isinstance(table_name, dict):
-                            table_name_val = table_name.get('value', table_name.get('display_value', ''))
-                        else:
-                            table_name_val = table_name
-                        
-                        logger.info(f"  Record {i}: tablename={table_name_val}, fieldname={record.get('fieldname')}, "
-                                  f"documentkey={doc_key_val}, "
-                                  f"oldvalue={record.get('oldvalue')}, "
-                                  f"newvalue={record.get('newvalue')}, "
-                                  f"created={record.get('sys_created_on')}")
-                
-                # Additional verification - count by table name to ensure we only got sys_user
-                table_counts = {}
-                for r in result:
-                    table = r.get('tablename')
-                    if isinstance(table, dict):
-                        table = table.get('value', table.get('display_value', ''))
-                    table_counts[table] = table_counts.get(table, 0) + 1
-                
-                logger.info(f"Records by table name: {table_counts}")
-                if len(table_counts) > 1 or 'sys_user' not in table_counts:
-                    logger.warning(f"Expected only sys_user records, but got: {table_counts}")
-                
-                return result
-            except (ValueError, KeyError) as e:
-                logger.error(f"Failed to parse user audit data JSON: {str(e)} - Response: {response.text[:500]}")
-                return []
-        else:
-            logger.error(f"Failed to fetch user audit data: {response.status_code} - {response.text[:500]}")
-            return []
-            
-    except Exception as e:
-        logger.error(f"Error fetching user audit data: {str(e)}")
-        return []
+        state = merge_delta(state, datasets, full)
+        sync_store.save(instance_url, username, state)
+        merged = materialize(state)
+    
+    sync_info = {
+        'mode': 'full' if full else 'delta',
+        'fetched': fetched_counts,
+        'local_counts': {name: len(records) for name, records in merged.items()},
+        'watermarks': state['watermarks'],
+        'saved': True
+    }
+    logger.info(f"Sync complete ({sync_info['mode']}): fetched {fetched_counts}, local copy {sync_info['local_counts']}")
+    return merged, fetch_stats, sync_info
 
-def fetch_user_data(instance_url, username, password, limit=5000):
-    """Fetch user data from ServiceNow"""
+def fetch_class_labels(instance_url, username, password, class_names):
+    """Fetch the display labels of CMDB classes from sys_db_object, keyed by table name"""
+    if not class_names:
+        return {}
     try:
-        url = f"{instance_url}/api/now/table/sys_user"
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        }
-        
-        response = requests.get(
-            url,
-            auth=(username, password),
-            headers=headers,
+        records = iter_table_records(
+            instance_url, username, password, 'sys_db_object',
             params={
-                'sysparm_limit': limit,
-                'sysparm_fields': 'sys_id,user_name,name,email,active,sys_created_on,department'
+                'sysparm_fields': 'name,label',
+                'sysparm_query': 'nameIN' + ','.join(class_names),
+                'sysparm_exclude_reference_link': 'true'
             },
             timeout=60
         )
-        
-        if response.status_code == 200:
-            try:
-                json_data = response.json()
-                result = json_data.get('result', [])
-                if not isinstance(result, list):
-                    logger.error(f"User data result is not a list: {type(result)} - {result}")
-                    return []
-                logger.info(f"Successfully fetched {len(result)} user records")
-                return result
-            except (ValueError, KeyError) as e:
-                logger.error(f"Failed to parse user data JSON: {str(e)} - Response: {response.text[:500]}")
-                return []
-        else:
-            logger.error(f"Failed to fetch user data: {response.status_code} - {response.text[:500]}")
-            return []
-            
+        return {r.get('name', ''): r.get('label', '') for r in records if r.get('name')}
     except Exception as e:
-        logger.error(f"Error fetching user data: {str(e)}")
-        return []
+        logger.warning(f"Could not fetch class labels, falling back to class names: {str(e)}")
+        return {}
+
+def resolve_compact_datasets(instance_url, username, password, datasets):
+    """Rebuild display values for value-only records from the fetched user table and class labels"""
+    class_labels = fetch_class_labels(instance_url, username, password, ci_class_names(datasets.get('ci_data', [])))
+    return expand_compact_datasets(datasets, class_labels)
+
+def analyze_cis_with_model(ci_data, audit_data, user_data, activity_data=None, timings=None, progress=None):
+    """Analyze CIs using the ML model and return stale CI list (see iter_stale_cis_with_model)"""
+    return list(iter_stale_cis_with_model(ci_data, audit_data, user_data, activity_data, timings, progress))
 
-def analyze_cis_with_model(ci_data, audit_data, user_data):
-    """Analyze CIs using the ML model and return stale CI list"""
+def iter_stale_cis_with_model(ci_data, audit_data, user_data, activity_data=None, timings=None, progress=None):
+    """
+    Analyze CIs using the ML model, yielding each stale CI as soon as it is scored.
+    activity_data optionally holds Aggregate API activity groups that replace the raw CI audit rows.
+    If a timings dict is given, seconds spent per stage are recorded in it. progress, a
+    ScanProgress, is told how many records were normalized and how many CIs are scored.
+    """
+    started = time.perf_counter()
     
     # Validate data types before creating DataFrames
     logger.info(f"Data validation - CI data type: {type(ci_data)}, length: {len(ci_data) if isinstance(ci_data, list) else 'N/A'}")
@@ -581,7 +1355,7 @@ def analyze_cis_with_model(ci_data, audit_data, user_data):
     
     # Log sample of transformed data for debugging
     if audit_data:
-        logger.info(f"Sample transformed audit data: {audit_data[0]}")
+        sample_log.debug("Sample transformed audit data: %s", audit_data[0])
         # Count how many were converted from strings
         string_converted = sum(1 for item in audit_data if item.get('data_type') == 'string_converted')
         if string_converted > 0:
@@ -609,28 +1383,21 @@ def analyze_cis_with_model(ci_data, audit_data, user_data):
         logger.error(f"Error creating user DataFrame: {str(e)}")
         raise ValueError(f"Failed to create user DataFrame: {str(e)}")
     
-    # Log a sample CI for debugging
-    if len(ci_data) > 0:
+    # Log a sample CI and user for debugging
+    if len(ci_data) > 0 and sample_log.isEnabledFor(logging.DEBUG):
         sample_ci = ci_data[0]
-        logger.info(f"Sample CI keys: {list(sample_ci.keys())}")
-        logger.info(f"Sample CI name: {sample_ci.get('name', 'N/A')}")
+        sample_log.debug("Sample CI keys: %s", list(sample_ci.keys()))
+        sample_log.debug("Sample CI name: %s", sample_ci.get('name', 'N/A'))
         if 'assigned_to' in sample_ci:
-            logger.info(f"Sample CI assigned_to structure: {sample_ci['assigned_to']}")
-            logger.info(f"Sample CI assigned_to type: {type(sample_ci['assigned_to'])}")
+            sample_log.debug("Sample CI assigned_to structure: %s (type: %s)", sample_ci['assigned_to'], type(sample_ci['assigned_to']))
         else:
-            logger.info("No assigned_to field found in sample CI")
-    
-    # Log sample audit data
-    if len(audit_data) > 0:
-        logger.info(f"Sample audit record: {audit_data[0]}")
+            sample_log.debug("No assigned_to field found in sample CI")
         
-    # Log sample user data
-    if len(user_data) > 0:
+    if len(user_data) > 0 and sample_log.isEnabledFor(logging.DEBUG):
         sample_user = user_data[0]
-        logger.info(f"Sample user keys: {list(sample_user.keys())}")
-        logger.info(f"Sample user name: {sample_user.get('name', 'N/A')}")
-        logger.info(f"Sample user user_name: {sample_user.get('user_name', 'N/A')}")
-        logger.info(f"Sample user sys_id: {sample_user.get('sys_id', 'N/A')}")
+        sample_log.debug("Sample user keys: %s", list(sample_user.keys()))
+        sample_log.debug("Sample user name: %s, user_name: %s, sys_id: %s", sample_user.get('name', 'N/A'),
+                         sample_user.get('user_name', 'N/A'), sample_user.get('sys_id', 'N/A'))
     
     # Create labels DataFrame from CI data
     labels_data = []
@@ -704,23 +1471,11 @@ def analyze_cis_with_model(ci_data, audit_data, user_data):
             final_display_name = assigned_owner_display_name or assigned_owner
             ci_owner_display_names[ci_sys_id] = final_display_name
             
-            # Debug log for first few CIs
-            if len(labels_data) <= 3:
-                logger.info(f"CI {ci_sys_id}: assigned_owner='{assigned_owner}', display_name='{final_display_name}'")
+            sample_log.debug("CI %s: assigned_owner='%s', display_name='%s'", ci_sys_id, assigned_owner, final_display_name)
             
     labels_df = pd.DataFrame(labels_data)
     
     logger.info(f"CIs with assigned owners: {len(labels_df)} out of {len(ci_data)}")
-    if len(labels_df) > 0:
-        logger.info(f"Sample assigned owner: {labels_df.iloc[0].to_dict()}")
-    
-    # Debug the ci_owner_display_names mapping
-    logger.info(f"ci_owner_display_names mapping has {len(ci_owner_display_names)} entries")
-    if ci_owner_display_names:
-        # Show first few mappings
-        sample_mappings = list(ci_owner_display_names.items())[:3]
-        for ci_id, display_name in sample_mappings:
-            logger.info(f"CI {ci_id} -> '{display_name}'")
     
     if len(labels_df) == 0:
         logger.warning("No CIs with assigned owners found")
@@ -741,13 +1496,26 @@ def analyze_cis_with_model(ci_data, audit_data, user_data):
     
     logger.info(f"Analyzing {len(labels_df)} CIs with assigned owners...")
     
+    if timings is not None:
+        timings['dataframe_build'] = time.perf_counter() - started
+    
+    on_scored = None
+    if progress is not None:
+        progress.normalized(len(ci_data) + len(audit_data) + len(user_data) + len(activity_data or []))
+        progress.set_stage('scoring', progress.percent)
+        on_scored = progress.scored
+    
     # Get stale CI list from model
-    stale_ci_list = model.get_stale_ci_list(labels_df, audit_df, user_df, ci_df, ci_owner_display_names)
+    activity_by_ci = model.build_activity_summaries(activity_data) if activity_data is not None else None
+    stale_count = 0
+    for stale_ci in model.iter_stale_cis(labels_df, audit_df, user_df, ci_df, ci_owner_display_names, activity_by_ci, timings=timings, progress=on_scored, batch=MODEL_PREDICT_BATCH, workers=MODEL_SCORING_WORKERS):
+        stale_count += 1
+        yield stale_ci
     
-    logger.info(f"Found {len(stale_ci_list)} stale CIs")
+    logger.info(f"Found {stale_count} stale CIs")
     
     # If no stale CIs found, let's debug the first few CIs
-    if len(stale_ci_list) == 0 and len(labels_df) > 0:
+    if stale_count == 0 and len(labels_df) > 0:
         logger.info("No stale CIs found. Debugging first CI...")
         first_ci = labels_df.iloc[0]
         ci_id = first_ci['ci_id']
@@ -772,113 +1540,117 @@ def analyze_cis_with_model(ci_data, audit_data, user_data):
         
         test_result = model.predict_single(test_ci_data)
         logger.info(f"Test prediction for first CI: {test_result}")
-    
-    return stale_ci_list
 
 def group_cis_by_recommended_owners(stale_ci_list):
     """
     Group stale CIs by their recommended owners for bulk assignment analysis
     """
     grouped = {}
-    
     for ci in stale_ci_list:
-        recommended_owners = ci.get('recommended_owners', [])
+        add_to_owner_groups(grouped, ci)
+    return owner_group_list(grouped)
+
+def add_to_owner_groups(grouped, ci):
+    """Add one stale CI to the groups keyed by its top recommended owner"""
+    recommended_owners = ci.get('recommended_owners', [])
+    
+    # If CI has recommended owners, group by the top recommendation
+    if recommended_owners and len(recommended_owners) > 0:
+        top_recommendation = recommended_owners[0]  # Get the best recommendation
+        username = top_recommendation.get('username', 'Unknown')
         
-        # If CI has recommended owners, group by the top recommendation
-        if recommended_owners and len(recommended_owners) > 0:
-            top_recommendation = recommended_owners[0]  # Get the best recommendation
-            username = top_recommendation.get('username', 'Unknown')
-            
-            if username not in grouped:
-                grouped[username] = {
-                    'recommended_owner': {
-                        'username': username,
-                        'display_name': top_recommendation.get('display_name', username),
-                        'department': top_recommendation.get('department', 'Unknown'),
-                        'avg_score': 0,
-                        'total_activity_count': 0
-                    },
-                    'cis_to_assign': [],
-                    'total_cis': 0,
-                    'risk_breakdown': {
-                        'Critical': 0,
-                        'High': 0,
-                        'Medium': 0,
-                        'Low': 0
-                    },
-                    'avg_confidence': 0
-                }
-            
-            # Add CI to this owner's group
-            grouped[username]['cis_to_assign'].append({
-                'ci_id': ci.get('ci_id'),
-                'ci_name': ci.get('ci_name'),
-                'ci_class': ci.get('ci_class'),
-                'current_owner': ci.get('current_owner'),
-                'confidence': ci.get('confidence'),
-                'risk_level': ci.get('risk_level'),
-                'staleness_reasons': ci.get('staleness_reasons', [])
-            })
-            
-            # Update aggregated statistics
-            grouped[username]['total_cis'] += 1
-            grouped[username]['risk_breakdown'][ci.get('risk_level', 'Low')] += 1
-            
-            # Update averages
-            current_total = grouped[username]['total_cis']
-            current_avg_confidence = grouped[username]['avg_confidence']
-            grouped[username]['avg_confidence'] = (
-                (current_avg_confidence * (current_total - 1) + ci.get('confidence', 0)) / current_total
-            )
-            
-            # Update owner stats
-            current_avg_score = grouped[username]['recommended_owner']['avg_score']
-            grouped[username]['recommended_owner']['avg_score'] = (
-                (current_avg_score * (current_total - 1) + top_recommendation.get('score', 0)) / current_total
-            )
-            grouped[username]['recommended_owner']['total_activity_count'] += top_recommendation.get('activity_count', 0)
+        if username not in grouped:
+            grouped[username] = {
+                'recommended_owner': {
+                    'username': username,
+                    'display_name': top_recommendation.get('display_name', username),
+                    'department': top_recommendation.get('department', 'Unknown'),
+                    'avg_score': 0,
+                    'total_activity_count': 0
+                },
+                'cis_to_assign': [],
+                'total_cis': 0,
+                'risk_breakdown': {
+                    'Critical': 0,
+                    'High': 0,
+                    'Medium': 0,
+                    'Low': 0
+                },
+                'avg_confidence': 0
+            }
         
-        else:
-            # Handle CIs with no recommendations
-            if 'No Recommendation' not in grouped:
-                grouped['No Recommendation'] = {
-                    'recommended_owner': {
-                        'username': 'No Recommendation',
-                        'display_name': 'No Suitable Owner Found',
-                        'department': 'Manual Review Required',
-                        'avg_score': 0,
-                        'total_activity_count': 0
-                    },
-                    'cis_to_assign': [],
-                    'total_cis': 0,
-                    'risk_breakdown': {
-                        'Critical': 0,
-                        'High': 0,
-                        'Medium': 0,
-                        'Low': 0
-                    },
-                    'avg_confidence': 0
-                }
-            
-            grouped['No Recommendation']['cis_to_assign'].append({
-                'ci_id': ci.get('ci_id'),
-                'ci_name': ci.get('ci_name'),
-                'ci_class': ci.get('ci_class'),
-                'current_owner': ci.get('current_owner'),
-                'confidence': ci.get('confidence'),
-                'risk_level': ci.get('risk_level'),
-                'staleness_reasons': ci.get('staleness_reasons', [])
-            })
-            
-            grouped['No Recommendation']['total_cis'] += 1
-            grouped['No Recommendation']['risk_breakdown'][ci.get('risk_level', 'Low')] += 1
-            
-            current_total = grouped['No Recommendation']['total_cis']
-            current_avg_confidence = grouped['No Recommendation']['avg_confidence']
-            grouped['No Recommendation']['avg_confidence'] = (
-                (current_avg_confidence * (current_total - 1) + ci.get('confidence', 0)) / current_total
-            )
+        # Add CI to this owner's group
+        grouped[username]['cis_to_assign'].append({
+            'ci_id': ci.get('ci_id'),
+            'ci_name': ci.get('ci_name'),
+            'ci_class': ci.get('ci_class'),
+            'current_owner': ci.get('current_owner'),
+            'confidence': ci.get('confidence'),
+            'risk_level': ci.get('risk_level'),
+            'staleness_reasons': ci.get('staleness_reasons', [])
+        })
+        
+        # Update aggregated statistics
+        grouped[username]['total_cis'] += 1
+        grouped[username]['risk_breakdown'][ci.get('risk_level', 'Low')] += 1
+        
+        # Update averages
+        current_total = grouped[username]['total_cis']
+        current_avg_confidence = grouped[username]['avg_confidence']
+        grouped[username]['avg_confidence'] = (
+            (current_avg_confidence * (current_total - 1) + ci.get('confidence', 0)) / current_total
+        )
+        
+        # Update owner stats
+        current_avg_score = grouped[username]['recommended_owner']['avg_score']
+        grouped[username]['recommended_owner']['avg_score'] = (
+            (current_avg_score * (current_total - 1) + top_recommendation.get('score', 0)) / current_total
+        )
+        grouped[username]['recommended_owner']['total_activity_count'] += top_recommendation.get('activity_count', 0)
     
+    else:
+        # Handle CIs with no recommendations
+        if 'No Recommendation' not in grouped:
+            grouped['No Recommendation'] = {
+                'recommended_owner': {
+                    'username': 'No Recommendation',
+                    'display_name': 'No Suitable Owner Found',
+                    'department': 'Manual Review Required',
+                    'avg_score': 0,
+                    'total_activity_count': 0
+                },
+                'cis_to_assign': [],
+                'total_cis': 0,
+                'risk_breakdown': {
+                    'Critical': 0,
+                    'High': 0,
+                    'Medium': 0,
+                    'Low': 0
+                },
+                'avg_confidence': 0
+            }
+        
+        grouped['No Recommendation']['cis_to_assign'].append({
+            'ci_id': ci.get('ci_id'),
+            'ci_name': ci.get('ci_name'),
+            'ci_class': ci.get('ci_class'),
+            'current_owner': ci.get('current_owner'),
+            'confidence': ci.get('confidence'),
+            'risk_level': ci.get('risk_level'),
+            'staleness_reasons': ci.get('staleness_reasons', [])
+        })
+        
+        grouped['No Recommendation']['total_cis'] += 1
+        grouped['No Recommendation']['risk_breakdown'][ci.get('risk_level', 'Low')] += 1
+        
+        current_total = grouped['No Recommendation']['total_cis']
+        current_avg_confidence = grouped['No Recommendation']['avg_confidence']
+        grouped['No Recommendation']['avg_confidence'] = (
+            (current_avg_confidence * (current_total - 1) + ci.get('confidence', 0)) / current_total
+        )
+
+def owner_group_list(grouped):
+    """Turn the groups built by add_to_owner_groups into the sorted grouped_by_owners list"""
     # Convert to list and sort by total CIs (most CIs first)
     grouped_list = []
     for username, data in grouped.items():
@@ -910,7 +1682,6 @@ def reload_model():
 @app.route('/assign-ci-owner', methods=['POST'])
 def assign_ci_owner():
     """Assign a CI to a new owner by updating the assigned_to field"""
-    session = create_session()
     try:
         data = request.get_json()
         instance_url = data.get('instance_url')
@@ -925,9 +1696,9 @@ def assign_ci_owner():
         # First, get the current owner information with expanded reference fields
         ci_url = f"{instance_url}/api/now/table/cmdb_ci/{ci_id}"
         try:
-            ci_response = session.get(
+            ci_response = servicenow.get(
+                instance_url, username, password,
                 ci_url,
-                auth=(username, password),
                 headers={'Accept': 'application/json'},
                 params={
                     'sysparm_fields': 'assigned_to,name,sys_class_name,assigned_to.user_name,assigned_to.name',
@@ -973,9 +1744,9 @@ def assign_ci_owner():
         # Get the new owner's information
         user_url = f"{instance_url}/api/now/table/sys_user"
         try:
-            user_response = session.get(
+            user_response = servicenow.get(
+                instance_url, username, password,
                 user_url,
-                auth=(username, password),
                 headers={'Accept': 'application/json'},
                 params={
                     'sysparm_query': f'user_name={new_owner_username}',
@@ -1014,9 +1785,9 @@ def assign_ci_owner():
                 'assigned_to': user_sys_id  # Use sys_id for assignment
             }
             
-            update_response = session.patch(
+            update_response = servicenow.patch(
+                instance_url, username, password,
                 ci_url,
-                auth=(username, password),
                 headers={
                     'Accept': 'application/json',
                     'Content-Type': 'application/json'
@@ -1026,6 +1797,9 @@ def assign_ci_owner():
             )
             
             if update_response.status_code == 200:
+                # Cached scan data no longer reflects the instance
+                snapshot_store.invalidate(instance_url)
+                
                 # Store the assignment in history with complete owner information
                 assignment_record = {
                     'id': len(assignment_history),
@@ -1076,8 +1850,6 @@ def assign_ci_owner():
         error_msg = f"Unexpected error in assign_ci_owner: {str(e)}"
         logger.error(error_msg, exc_info=True)
         return jsonify({'error': error_msg}), 500
-    finally:
-        session.close()
 
 @app.route('/assignment-history', methods=['GET'])
 def get_assignment_history():
@@ -1096,7 +1868,6 @@ def get_assignment_history():
 @app.route('/undo-assignment', methods=['POST'])
 def undo_assignment():
     """Undo a CI assignment by reverting to the previous owner"""
-    session = create_session()
     try:
         data = request.get_json()
         instance_url = data.get('instance_url', '').rstrip('/')  # Normalize URL by removing trailing slash
@@ -1133,9 +1904,9 @@ def undo_assignment():
         ci_url = f"{instance_url}/api/now/table/cmdb_ci/{assignment['ci_id']}"
         try:
             # Get current CI state
-            ci_response = session.get(
+            ci_response = servicenow.get(
+                instance_url, username, password,
                 ci_url,
-                auth=(username, password),
                 headers={'Accept': 'application/json'},
                 params={
                     'sysparm_fields': 'assigned_to,name,sys_class_name,assigned_to.user_name,assigned_to.name',
@@ -1160,9 +1931,9 @@ def undo_assignment():
             }
             
             # Attempt to update the CI
-            update_response = session.patch(
+            update_response = servicenow.patch(
+                instance_url, username, password,
                 ci_url,
-                auth=(username, password),
                 headers={
                     'Accept': 'application/json',
                     'Content-Type': 'application/json'
@@ -1172,10 +1943,13 @@ def undo_assignment():
             )
             
             if update_response.status_code == 200:
+                # Cached scan data no longer reflects the instance
+                snapshot_store.invalidate(instance_url)
+                
                 # Verify the update was successful
-                verify_response = session.get(
+                verify_response = servicenow.get(
+                    instance_url, username, password,
                     ci_url,
-                    auth=(username, password),
                     headers={'Accept': 'application/json'},
                     params={
                         'sysparm_fields': 'assigned_to,name,sys_class_name,assigned_to.user_name,assigned_to.name',
@@ -1227,8 +2001,6 @@ def undo_assignment():
         error_msg = f"Unexpected error in undo_assignment: {str(e)}"
         logger.error(error_msg, exc_info=True)
         return jsonify({'error': error_msg}), 500
-    finally:
-        session.close()
 
 if __name__ == '__main__':
     import os
@@ -1240,4 +2012,5 @@ if __name__ == '__main__':
     print(f"Health check: http://0.0.0.0:{port}/health")
     print("Test connection: POST /test-connection")
     print("Scan for stale ownership: POST /scan-stale-ownership")
+    print("Background scan: POST /scan-jobs, then GET /scan-jobs/<job_id>")
     app.run(debug=debug, host='0.0.0.0', port=port)
\ No newline at end of file
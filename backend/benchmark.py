@@ -0,0 +1,300 @@
+"""
+Scale benchmark for the analysis pipeline.
+
+Generates synthetic CI, audit and user inputs (see synthetic_data.py), renders
+them the way the ServiceNow fetches return them, and times
+analyze_cis_with_model -> get_stale_ci_list -> predict_batch plus the owner
+grouping. Each case runs in its own process so peak RSS is per case.
+
+    python benchmark.py --sizes 1000,10000,100000 --ratios 1,10,50 --output benchmark_results.json
+
+Without --sizes/--ratios a quick 1k-10k CI grid runs; --full runs 1k to 1M CIs at
+audit-to-CI ratios of 1, 10, 50 and 200.
+
+Results are written as JSON (one entry per case with wall time, peak RSS and
+per-stage seconds) so runs from different versions can be compared.
+
+With --rules only the staleness rules are timed, over synthetic feature sets:
+the compiled rules per CI and per batch against eval() of each condition, the
+way the rules used to be applied, reported per 100k CIs.
+
+    python benchmark.py --rules --sizes 100000
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# A quick grid by default; --full runs the whole 1k-1M CI, 1-200 audit ratio grid
+DEFAULT_SIZES = '1000,10000'
+DEFAULT_RATIOS = '1,10'
+FULL_SIZES = '1000,10000,100000,1000000'
+FULL_RATIOS = '1,10,50,200'
+# Cases above this many generated audit rows are skipped rather than run out of memory
+DEFAULT_MAX_AUDIT_ROWS = 20000000
+
+STAGES = ('dataframe_build', 'lookup_build', 'prediction', 'grouping')
+
+RULE_BENCHMARK_OWNERS = ('john.smith', 'maria.garcia', 'vendor.acme', 'it.external', 'sam.lee.contractor', 'team.generic', 'admin.generic')
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def _reset_peak_rss():
+    """Reset the kernel's peak RSS counter so it covers only the analysis (Linux only)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _current_peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def build_inputs(ci_count, audit_ratio, seed):
+    """Render a synthetic instance as the ci_data, audit_data and user_data lists a scan fetches"""
+    import app
+    from compact_payload import compact_params
+    from mock_servicenow import MockInstance
+    from synthetic_data import generate_instance
+
+    instance = generate_instance(ci_count, audit_ratio=audit_ratio, seed=seed)
+    mock = MockInstance(instance)
+
+    def render(table, fields, query, display_value='all'):
+        return [mock.render(table, row, fields.split(','), display_value=display_value) for row in mock.select(table, query)]
+
+    ci_fields = 'sys_id,name,short_description,sys_class_name,sys_updated_on,assigned_to,assigned_to.user_name,assigned_to.name,assigned_to.sys_id'
+    ci_data = render('cmdb_ci', ci_fields, '')
+    audit_data = render('sys_audit', app.CI_AUDIT_FIELDS, app.CI_AUDIT_QUERY)
+    user_audit = render('sys_audit', app.CI_AUDIT_FIELDS, 'tablename=sys_user^fieldnameINtitle,department,manager,active')
+    for record in user_audit:
+        record['audit_type'] = 'user_profile_change'
+    audit_data.extend(user_audit)
+    user_fields = compact_params({'sysparm_fields': 'sys_id,user_name,name,email,active,sys_created_on,sys_updated_on,department'})['sysparm_fields']
+    user_data = render('sys_user', user_fields, '', display_value='false')
+    return ci_data, audit_data, user_data
+
+
+def run_case(ci_count, audit_ratio, seed):
+    """Run one benchmark case in this process and return its result entry"""
+    import app
+    from trace_logging import trace_loggers
+
+    # Time scoring with hot-path tracing off, whatever LOG_LEVEL switches on
+    for trace_log in trace_loggers():
+        trace_log.setLevel(logging.WARNING)
+
+    generate_started = time.perf_counter()
+    ci_data, audit_data, user_data = build_inputs(ci_count, audit_ratio, seed)
+    generate_seconds = time.perf_counter() - generate_started
+    input_rss_mb = _peak_rss_mb()
+    rss_reset = _reset_peak_rss()
+
+    timings = {}
+    started = time.perf_counter()
+    stale_ci_list = app.analyze_cis_with_model(ci_data, audit_data, user_data, timings=timings)
+    grouping_started = time.perf_counter()
+    grouped = app.group_cis_by_recommended_owners(stale_ci_list)
+    timings['grouping'] = time.perf_counter() - grouping_started
+    wall_seconds = time.perf_counter() - started
+
+    return {
+        'ci_count': ci_count,
+        'audit_ratio': audit_ratio,
+        'seed': seed,
+        'audit_records': len(audit_data),
+        'users': len(user_data),
+        'stale_cis': len(stale_ci_list),
+        'recommended_owners': len(grouped),
+        'input_generation_seconds': round(generate_seconds, 3),
+        'wall_seconds': round(wall_seconds, 3),
+        'stage_seconds': {stage: round(timings.get(stage, 0.0), 3) for stage in STAGES},
+        'prediction_us_per_ci': round(timings.get('prediction', 0.0) / max(ci_count, 1) * 1e6, 1),
+        'peak_rss_mb': _peak_rss_mb(),
+        'input_rss_mb': input_rss_mb,
+        'analysis_peak_rss_mb': _current_peak_rss_mb() if rss_reset else None
+    }
+
+
+def _synthetic_features(count, seed):
+    """Feature dicts with the names and value ranges the rules test"""
+    rng = random.Random(seed)
+    features = []
+    for _ in range(count):
+        total = rng.randint(0, 60)
+        owner = rng.randint(0, total)
+        top_other = rng.randint(0, total - owner)
+        features.append({
+            'owner_name': rng.choice(RULE_BENCHMARK_OWNERS),
+            'total_activity_count': total,
+            'owner_activity_count': owner,
+            'owner_activity_ratio': owner / total if total else 0,
+            'days_since_owner_activity': rng.choice((rng.randint(0, 400), 999)),
+            'other_users_count': rng.randint(0, 5) if total > owner else 0,
+            'top_other_user_ratio': top_other / total if total else 0,
+            'recent_other_activities': rng.randint(0, 10),
+            'owner_active': rng.random() > 0.1,
+            'title_changes_count': rng.randint(0, 3),
+            'department_changes_count': rng.randint(0, 2),
+            'owner_profile_changes_count': rng.randint(0, 3),
+            'owner_role_changes': rng.randint(0, 2),
+            'owner_title_changed': rng.random() < 0.2,
+            'owner_dept_changed': rng.random() < 0.2,
+            'assigned_group_active': True,
+            'non_owner_ownership_changes': rng.randint(0, 2)
+        })
+    return features
+
+
+def _eval_rules(rules, features):
+    """The rules applied with eval() per condition, as before they were compiled"""
+    triggered = []
+    for name, rule in rules.items():
+        try:
+            if all(eval(condition, {'__builtins__': {}}, features.copy()) for condition in rule['conditions']):
+                triggered.append(name)
+        except Exception:
+            pass
+    return triggered
+
+
+def run_rules_case(ci_count, seed):
+    """Time rule evaluation alone over ci_count synthetic feature sets"""
+    from create_model import PREDICT_BATCH_SIZE, RuleBasedStalenessDetector
+
+    model = RuleBasedStalenessDetector()
+    features = _synthetic_features(ci_count, seed)
+    per_100k = 100000 / max(ci_count, 1)
+
+    started = time.perf_counter()
+    evaluated = [_eval_rules(model.rules, f) for f in features]
+    eval_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    compiled = [model.rule_set.triggered(f) for f in features]
+    compiled_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched = []
+    for chunk_start in range(0, ci_count, PREDICT_BATCH_SIZE):
+        batched.extend(model.rule_set.triggered_batch(features[chunk_start:chunk_start + PREDICT_BATCH_SIZE]))
+    batch_seconds = time.perf_counter() - started
+
+    return {
+        'ci_count': ci_count,
+        'seed': seed,
+        'rules': len(model.rules),
+        'triggered': sum(len(names) for names in batched),
+        'results_match': evaluated == compiled == batched,
+        'eval_seconds_per_100k': round(eval_seconds * per_100k, 3),
+        'compiled_seconds_per_100k': round(compiled_seconds * per_100k, 3),
+        'batch_seconds_per_100k': round(batch_seconds * per_100k, 3)
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the staleness analysis at increasing scale')
+    parser.add_argument('--sizes', help=f'Comma-separated CI counts (default {DEFAULT_SIZES}, with --full {FULL_SIZES})')
+    parser.add_argument('--ratios', help=f'Comma-separated audit-to-CI ratios (default {DEFAULT_RATIOS}, with --full {FULL_RATIOS})')
+    parser.add_argument('--full', action='store_true', help='Run the full scale grid instead of the quick default one')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-audit-rows', type=int, default=DEFAULT_MAX_AUDIT_ROWS,
+                        help='Skip cases that would generate more audit rows than this')
+    parser.add_argument('--timeout', type=int, default=None, help='Per-case timeout in seconds')
+    parser.add_argument('--output', default='benchmark_results.json', help='Where to write the JSON results')
+    parser.add_argument('--rules', action='store_true', help='Time only the rule evaluation, per 100k CIs')
+    parser.add_argument('--case', nargs=2, metavar=('CIS', 'RATIO'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.sizes = args.sizes or (FULL_SIZES if args.full else DEFAULT_SIZES)
+    args.ratios = args.ratios or (FULL_RATIOS if args.full else DEFAULT_RATIOS)
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.case:
+        # Child process: run a single case and report it on stdout
+        result = run_case(int(args.case[0]), float(args.case[1]), args.seed)
+        sys.stdout.write(json.dumps(result) + '\n')
+        return
+
+    cases = []
+    if args.rules:
+        for ci_count in [int(s) for s in args.sizes.split(',') if s]:
+            result = run_rules_case(ci_count, args.seed)
+            print(f"ok    {ci_count:>9} CIs: rules per 100k CIs eval={result['eval_seconds_per_100k']:.2f}s "
+                  f"compiled={result['compiled_seconds_per_100k']:.2f}s batch={result['batch_seconds_per_100k']:.2f}s"
+                  f"{'' if result['results_match'] else ' (RESULTS DIFFER)'}")
+            cases.append(result)
+    for ci_count in [int(s) for s in args.sizes.split(',') if not args.rules and s]:
+        for ratio in [float(r) for r in args.ratios.split(',') if r]:
+            if ci_count * ratio > args.max_audit_rows:
+                print(f"skip  {ci_count:>9} CIs x {ratio:>5g}: more than {args.max_audit_rows} audit rows")
+                cases.append({'ci_count': ci_count, 'audit_ratio': ratio, 'skipped': 'max_audit_rows'})
+                continue
+            command = [sys.executable, os.path.abspath(__file__), '--case', str(ci_count), str(ratio), '--seed', str(args.seed)]
+            try:
+                completed = subprocess.run(command, capture_output=True, text=True, timeout=args.timeout,
+                                           cwd=os.path.dirname(os.path.abspath(__file__)))
+            except subprocess.TimeoutExpired:
+                print(f"fail  {ci_count:>9} CIs x {ratio:>5g}: timed out after {args.timeout}s")
+                cases.append({'ci_count': ci_count, 'audit_ratio': ratio, 'error': 'timeout'})
+                continue
+            lines = completed.stdout.strip().splitlines()
+            if completed.returncode != 0 or not lines:
+                error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"exit code {completed.returncode}"
+                print(f"fail  {ci_count:>9} CIs x {ratio:>5g}: {error}")
+                cases.append({'ci_count': ci_count, 'audit_ratio': ratio, 'error': error})
+                continue
+            result = json.loads(lines[-1])
+            stages = ' '.join(f"{stage}={seconds:.2f}s" for stage, seconds in result['stage_seconds'].items())
+            print(f"ok    {ci_count:>9} CIs x {ratio:>5g}: {result['wall_seconds']:.2f}s, "
+                  f"peak {result['peak_rss_mb']:.0f} MB, {stages}")
+            cases.append(result)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': args.seed,
+        'cases': cases
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(cases)} results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
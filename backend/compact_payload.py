@@ -0,0 +1,111 @@
+"""
+Value-only ("compact") ServiceNow payloads.
+
+By default CIs and audit records are requested with sysparm_display_value=all
+and dot-walked user fields, so every reference arrives as a
+{display_value, value, link} object and the same user names are repeated on
+every audit row. In compact mode only raw values are requested, and the
+display-side fields are rebuilt locally from the user table (plus class labels
+from sys_db_object), so the rest of the pipeline sees the same records.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+COMPACT_PAYLOAD_PARAMS = {
+    'sysparm_display_value': 'false',
+    'sysparm_exclude_reference_link': 'true',
+    'sysparm_no_count': 'true'
+}
+
+CI_FIELDS = ('sys_id', 'name', 'short_description', 'sys_class_name', 'sys_updated_on', 'assigned_to')
+AUDIT_FIELDS = ('sys_id', 'sys_created_on', 'tablename', 'fieldname', 'documentkey', 'user', 'oldvalue', 'newvalue')
+
+
+def compact_params(params):
+    """Turn Table API params into their value-only form, dropping dot-walked fields"""
+    fields = params.get('sysparm_fields')
+    compact = dict(params, **COMPACT_PAYLOAD_PARAMS)
+    if fields:
+        compact['sysparm_fields'] = ','.join(f for f in fields.split(',') if '.' not in f)
+    return compact
+
+
+def _both(value):
+    return {'display_value': value, 'value': value}
+
+
+def _is_compact(record):
+    # A record is fetched either compact or with display values, never mixed
+    return not isinstance(record.get('sys_id'), dict)
+
+
+def _user_fields(prefix, user):
+    user = user or {}
+    return {
+        f'{prefix}.user_name': _both(user.get('user_name', '')),
+        f'{prefix}.name': _both(user.get('name', '')),
+        f'{prefix}.sys_id': _both(user.get('sys_id', ''))
+    }
+
+
+def expand_ci_record(record, users_by_sys_id, class_labels):
+    """Rebuild the display_value=all form of a compact CI record"""
+    expanded = {field: _both(record.get(field, '')) for field in CI_FIELDS}
+
+    class_name = record.get('sys_class_name', '')
+    expanded['sys_class_name'] = {'display_value': class_labels.get(class_name, class_name), 'value': class_name}
+
+    owner_sys_id = record.get('assigned_to', '')
+    owner = users_by_sys_id.get(owner_sys_id) if owner_sys_id else None
+    expanded['assigned_to'] = {'display_value': owner.get('name', '') if owner else '', 'value': owner_sys_id}
+    expanded.update(_user_fields('assigned_to', owner))
+    return expanded
+
+
+def expand_audit_record(record, users_by_name, users_by_sys_id):
+    """Rebuild the display_value=all form of a compact sys_audit record"""
+    expanded = dict(record)
+    expanded.update({field: _both(record.get(field, '')) for field in AUDIT_FIELDS})
+
+    # sys_audit.user holds the user name of whoever made the change
+    user = record.get('user', '')
+    expanded.update(_user_fields('user', users_by_name.get(user) or users_by_sys_id.get(user)))
+    return expanded
+
+
+def ci_class_names(ci_data):
+    """Distinct sys_class_name values among compact CI records"""
+    return sorted({r.get('sys_class_name') for r in ci_data if _is_compact(r) and r.get('sys_class_name')})
+
+
+def expand_compact_datasets(datasets, class_labels=None):
+    """
+    Resolve display names for compact CI and audit records with a single join
+    against the fetched user table. Records that were fetched with display
+    values (e.g. older rows in a delta sync copy) are passed through unchanged.
+    """
+    class_labels = class_labels or {}
+    users_by_sys_id = {}
+    users_by_name = {}
+    for user in datasets.get('user_data', []):
+        if user.get('sys_id'):
+            users_by_sys_id[user['sys_id']] = user
+        if user.get('user_name'):
+            users_by_name[user['user_name']] = user
+
+    expanded = dict(datasets)
+    if 'ci_data' in datasets:
+        expanded['ci_data'] = [
+            expand_ci_record(r, users_by_sys_id, class_labels) if _is_compact(r) else r
+            for r in datasets['ci_data']
+        ]
+    for name in ('ci_audit_data', 'user_audit_data'):
+        if name in datasets:
+            expanded[name] = [
+                expand_audit_record(r, users_by_name, users_by_sys_id) if _is_compact(r) else r
+                for r in datasets[name]
+            ]
+    logger.info(f"Resolved display names for compact records against {len(users_by_sys_id)} users")
+    return expanded
@@ -1,17 +1,80 @@
+import logging
 import pandas as pd
 import numpy as np
 import pickle
+import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple, Optional
 
+from identity_index import IdentityIndex
+from profile_index import ProfileChangeIndex
+from rule_engine import RuleSet
+from sharded_scoring import iter_sharded
+from trace_logging import trace_logger
+
+logger = logging.getLogger(__name__)
+# Hot-path categories, sampled and rate limited (see trace_logging)
+lookup_log = trace_logger(f'{__name__}.lookup')
+ci_log = trace_logger(f'{__name__}.ci')
+recommendation_log = trace_logger(f'{__name__}.recommendation')
+
+# How many CIs get_stale_ci_list scores between progress callbacks
+PROGRESS_INTERVAL = 250
+# CIs scored together by one predict_batch call; bounds the delay before the first stale CI is yielded
+PREDICT_BATCH_SIZE = 5000
+# Scans with fewer CIs are scored in-process even with several workers; starting the pool would cost more
+SHARDED_MIN_CIS = 10000
+# Audit record field the scan stores sys_created_on in, parsed to epoch microseconds
+CREATED_EPOCH_FIELD = 'sys_created_epoch_us'
+# Distinct date strings _parse_date remembers before starting over
+DATE_MEMO_SIZE = 100000
+
+EPOCH = datetime(1970, 1, 1)
+# date string -> datetime, shared by every detector in the process
+_parsed_dates = {}
+
+
+def to_epoch_us(value: datetime) -> int:
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_epoch_us(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+
+def _score_shard(context: Dict, items: List[Tuple[int, Dict]]) -> List[Tuple[int, Optional[Dict]]]:
+    """Scores one shard of a sharded scan in a worker process (see iter_stale_cis)"""
+    return context['model']._score_labels(context, items)
+
+
 class RuleBasedStalenessDetector:
     """
     Pickle-serializable version of the staleness detector
     """
 
+    # ServiceNow date formats _parse_date tries, in order
+    DATE_FORMATS = (
+        '%Y-%m-%d %H:%M:%S',
+        '%Y-%m-%dT%H:%M:%S',
+        '%Y-%m-%d',
+        '%m/%d/%Y %H:%M:%S',
+        '%m/%d/%Y'
+    )
+
     def __init__(self):
         self.rules = self._define_detection_rules()
         self.scenario_patterns = self._define_scenario_patterns()
+        self.rule_set = RuleSet(self.rules)
+
+    def __getstate__(self):
+        # The compiled rules aren't picklable; they are rebuilt from self.rules on load
+        state = self.__dict__.copy()
+        state.pop('rule_set', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.rule_set = RuleSet(self.rules)
 
     def _define_detection_rules(self):
         """Define rules based on the document patterns"""
@@ -203,107 +266,380 @@ class RuleBasedStalenessDetector:
         Input format expected from ServiceNow data
         """
         try:
+            # Every age the features and recommendation measure is taken from one reference time
+            if not ci_data.get('scan_time'):
+                ci_data = dict(ci_data, scan_time=datetime.now())
+            
+            # Without user profile records the feature and recommendation passes see the
+            # same audit records, so summarize them once and share the summary
+            audit_records = ci_data.get('audit_records', [])
+            if (ci_data.get('activity_summary') is None and audit_records
+                    and all(r.get('audit_type') != 'user_profile_change' for r in audit_records)):
+                ci_data = dict(ci_data, activity_summary=self._summarize_audit_activity(
+                    audit_records, ci_data['scan_time'] - timedelta(days=30)))
+            
             # Extract features from ServiceNow data
             features = self._extract_features_from_servicenow_data(ci_data)
+            return self._score_features(ci_data, features)
+
+        except Exception as e:
+            return self._failed_prediction(e)
+
+    def predict_batch(self, ci_data_list: List[Dict]) -> List[Dict]:
+        """
+        Predict staleness for many CIs at once, taking the same input per CI as
+        predict_single and returning the same results. The activity features are
+        computed for the whole batch from one table of (CI, user) activity built with
+        grouped operations, rather than by walking each CI's audit records.
+        """
+        now = datetime.now()
+        ci_data_list = [ci_data if ci_data.get('scan_time') else dict(ci_data, scan_time=now) for ci_data in ci_data_list]
+        batched = [i for i, ci_data in enumerate(ci_data_list) if self._batchable(ci_data)]
+        activity, summaries = self._batch_activity(ci_data_list, batched)
+        computed = self._batch_activity_features(ci_data_list, batched, activity)
+        
+        results = [None] * len(ci_data_list)
+        scored = []
+        for i, ci_data in enumerate(ci_data_list):
+            if i not in computed:
+                results[i] = self.predict_single(ci_data)
+                continue
+            features, owner_sys_id, role_changes, ownership_changes = computed[i]
+            try:
+                ci_data = dict(ci_data, activity_summary=summaries[i])
+                features.update(self._profile_change_features(ci_data, summaries[i], features['owner_name'], owner_sys_id))
+                features['owner_role_changes'] = role_changes
+                features['owner_title_changed'] = any(c['field'] == 'title' for c in features['owner_profile_changes_details'])
+                features['owner_dept_changed'] = any(c['field'] == 'department' for c in features['owner_profile_changes_details'])
+                features['assigned_group_active'] = True
+                features['non_owner_ownership_changes'] = ownership_changes
+                scored.append((i, ci_data, features))
+            except Exception as e:
+                results[i] = self._failed_prediction(e)
+        
+        # Rule conditions are evaluated as masks over the features of the whole batch
+        triggered = self.rule_set.triggered_batch([features for _, _, features in scored])
+        for (i, ci_data, features), rule_names in zip(scored, triggered):
+            try:
+                results[i] = self._score_features(ci_data, features, rule_names)
+            except Exception as e:
+                results[i] = self._failed_prediction(e)
+        return results
+
+    def _batchable(self, ci_data: Dict) -> bool:
+        """
+        Whether predict_batch can compute a CI's activity features in bulk. CIs that
+        carry a recommendation in advance, mix user profile records into their audit
+        records or have users, field names or summary values of unexpected types go through
+        predict_single.
+        """
+        if ci_data.get('new_owner_recommendation'):
+            return False
+        activity_summary = ci_data.get('activity_summary')
+        if activity_summary is not None:
+            return all(type(user) is str and isinstance(activity.get('last_activity'), datetime)
+                       and type(activity.get('count')) is int and type(activity.get('recent_count')) is int
+                       for user, activity in activity_summary.items())
+        return all(type(r.get('user', '')) is str and type(r.get('fieldname', '')) is str
+                   and r.get('audit_type') != 'user_profile_change'
+                   for r in ci_data.get('audit_records', []))
+
+    def _batch_activity(self, ci_data_list: List[Dict], batched: List[int]):
+        """
+        Returns the per-CI activity summaries _summarize_audit_activity would build
+        (which the recommender reads), and the activity table: arrays with one entry
+        per (CI, user) holding the CI, user, the user's position among the CI's users,
+        record count, last activity (epoch microseconds), records in the last 30 days
+        and role/ownership field change counts.
+        """
+        summaries = {}
+        supplied = []
+        cis, users, fieldnames, epochs, created = [], [], [], [], []
+        for i in batched:
+            ci_data = ci_data_list[i]
+            if ci_data.get('activity_summary') is not None:
+                summaries[i] = ci_data['activity_summary']
+                supplied.append(i)
+                continue
+            summaries[i] = {}
+            for record in ci_data.get('audit_records', []):
+                cis.append(i)
+                users.append(record.get('user', ''))
+                fieldnames.append(record.get('fieldname', ''))
+                epochs.append(record.get(CREATED_EPOCH_FIELD))
+                created.append(record.get('sys_created_on', ''))
+
+        table = {name: [] for name in ('ci', 'user', 'order', 'count', 'last', 'recent', 'role_changes', 'ownership_changes')}
+        if cis:
+            # Group codes number the (CI, user) pairs in order of first appearance; the
+            # records arrive CI by CI, so each CI's groups are contiguous and ascending
+            ci_codes = np.array(cis, dtype=np.int64)
+            user_codes, user_names = pd.factorize(pd.Series(users, dtype=object))
+            groups, group_keys = pd.factorize(ci_codes * len(user_names) + user_codes)
+            group_ci = group_keys // len(user_names)
+            group_user = user_names[group_keys % len(user_names)]
+            # Records the scan didn't ingest have no parsed date yet
+            unparsed = [k for k, epoch in enumerate(epochs) if epoch is None]
+            for k, epoch in zip(unparsed, self._parse_epochs([created[k] for k in unparsed]).tolist()):
+                epochs[k] = epoch
+            dates = np.array(epochs, dtype=np.int64)
+            recent_cutoffs = np.zeros(len(ci_data_list), dtype=np.int64)
+            for i in batched:
+                recent_cutoffs[i] = to_epoch_us(ci_data_list[i]['scan_time'] - timedelta(days=30))
+            recent = dates > recent_cutoffs[ci_codes]
             
-            # Get recommendation for new owner FIRST
-            new_owner_recommendation = self._recommend_new_owner_from_data(ci_data)
+            first = np.full(len(group_keys), np.iinfo(np.int64).max)
+            last = np.full(len(group_keys), np.iinfo(np.int64).min)
+            np.minimum.at(first, groups, dates)
+            np.maximum.at(last, groups, dates)
+            count = np.bincount(groups)
+            recent_count = np.bincount(groups, weights=recent).astype(np.int64)
             
-            # Now do a second pass to check profile changes for recommended owners
-            if new_owner_recommendation and ci_data.get('all_user_audit_records'):
-                recommended_sys_ids = set()
-                for rec in (new_owner_recommendation if isinstance(new_owner_recommendation, list) else [new_owner_recommendation]):
-                    if rec.get('user_sys_id'):
-                        recommended_sys_ids.add(rec.get('user_sys_id'))
-                
-                if recommended_sys_ids:
-                    # Check if any recommended owners have profile changes
-                    for record in ci_data.get('all_user_audit_records', []):
-                        documentkey = record.get('documentkey', '')
-                        if documentkey in recommended_sys_ids:
-                            fieldname = record.get('fieldname', '')
-                            if fieldname in ['title', 'department']:
-                                # Add to features if not already counted
-                                print(f"DEBUG: Found profile change for recommended owner - field: {fieldname}, sys_id: {documentkey}")
+            field_codes, field_names = pd.factorize(pd.Series(fieldnames, dtype=object))
+            pairs, pair_keys = pd.factorize(groups * len(field_names) + field_codes)
+            fields = [{} for _ in range(len(group_keys))]
+            for group, field, field_count in zip((pair_keys // len(field_names)).tolist(),
+                                                 field_names[pair_keys % len(field_names)].tolist(),
+                                                 np.bincount(pairs).tolist()):
+                fields[group][field] = field_count
+            
+            for group, (ci, user, user_count, first_activity, last_activity, user_recent) in enumerate(zip(
+                    group_ci.tolist(), group_user.tolist(), count.tolist(), self._to_datetimes(first),
+                    self._to_datetimes(last), recent_count.tolist())):
+                summaries[ci][user] = {
+                    'count': user_count,
+                    'fields': fields[group],
+                    'first_activity': first_activity,
+                    'last_activity': last_activity,
+                    'recent_count': user_recent
+                }
             
-            # Apply rules
-            triggered_rules = []
-            total_confidence = 0
+            role_fields = np.isin(field_names, ('title', 'role', 'department'))[field_codes]
+            ownership_fields = np.isin(field_names, ('assigned_to', 'managed_by', 'support_group'))[field_codes]
+            table['ci'].append(group_ci)
+            table['user'].append(group_user)
+            table['order'].append(np.arange(len(group_ci)) - np.searchsorted(group_ci, group_ci))
+            table['count'].append(count)
+            table['last'].append(last)
+            table['recent'].append(recent_count)
+            table['role_changes'].append(np.bincount(groups, weights=role_fields, minlength=len(group_keys)).astype(np.int64))
+            table['ownership_changes'].append(np.bincount(groups, weights=ownership_fields, minlength=len(group_keys)).astype(np.int64))
 
-            for rule_name, rule_def in self.rules.items():
-                if self._evaluate_rule(features, rule_def['conditions']):
-                    triggered_rules.append({
-                        'rule': rule_name,
-                        'description': rule_def['description'],
-                        'confidence': rule_def['confidence'],
-                        'scenarios': rule_def['scenarios']
-                    })
-                    total_confidence = max(total_confidence, rule_def['confidence'])
-
-            # Add specific title/department change reasons with details
-            if features.get('owner_profile_changes_details'):
-                for change in features['owner_profile_changes_details']:
-                    if change['field'] == 'title':
-                        triggered_rules.append({
-                            'rule': 'owner_title_change_detected',
-                            'description': f"Owner's title changed from '{change['old_value']}' to '{change['new_value']}' on {change['change_date']}",
-                            'confidence': 0.85,
-                            'scenarios': ['profile_change']
-                        })
-                        total_confidence = max(total_confidence, 0.85)
-                    elif change['field'] == 'department':
-                        triggered_rules.append({
-                            'rule': 'owner_department_change_detected',
-                            'description': f"Owner's department changed from '{change['old_value']}' to '{change['new_value']}' on {change['change_date']}",
-                            'confidence': 0.85,
-                            'scenarios': ['profile_change']
-                        })
-                        total_confidence = max(total_confidence, 0.85)
+        rows = []
+        for i in supplied:
+            for order, (user, activity) in enumerate(summaries[i].items()):
+                fields = activity['fields']
+                rows.append((i, user, order, activity['count'], to_epoch_us(activity['last_activity']),
+                             activity['recent_count'],
+                             sum(fields.get(field, 0) for field in ('title', 'role', 'department')),
+                             sum(fields.get(field, 0) for field in ('assigned_to', 'managed_by', 'support_group'))))
+        for name, column in zip(table, zip(*rows) if rows else [[] for _ in table]):
+            table[name].append(np.array(column, dtype=object if name == 'user' else np.int64))
+        activity = {name: np.concatenate(parts) for name, parts in table.items()}
+        return activity, summaries
+
+    @staticmethod
+    def _to_datetimes(values: np.ndarray) -> List[datetime]:
+        """Python datetimes for epoch microseconds"""
+        return values.astype('datetime64[us]').tolist()
+
+    def _batch_activity_features(self, ci_data_list: List[Dict], batched: List[int], activity: Dict) -> Dict:
+        """
+        The activity features of every batched CI, from the activity table.
+        Returns {index: (features, owner sys_id, owner role changes, non-owner ownership changes)};
+        the features stop at owner_active, where predict_batch adds the profile features.
+        """
+        owners = {i: ci_data_list[i].get('assigned_owner', '') for i in batched}
+        owner_sys_ids = {i: self._owner_sys_id(ci_data_list[i]) for i in batched}
+        ci, users = activity['ci'], activity['user']
+        
+        identities = {i: self._identity_index(ci_data_list[i]) for i in batched}
+        is_owner = np.zeros(len(ci), dtype=bool)
+        is_assigned = np.zeros(len(ci), dtype=bool)
+        for row, (i, user) in enumerate(zip(ci.tolist(), users.tolist())):
+            is_owner[row] = identities[i].resolves_to_owner(user, owners[i], owner_sys_ids[i])
+            is_assigned[row] = user == owners[i]
+        is_other = ~is_assigned & (users != '')
+        
+        def per_ci(values):
+            return np.bincount(ci, weights=values, minlength=len(ci_data_list)).astype(np.int64).tolist()
+        
+        count = activity['count']
+        ci_activity = per_ci(count)
+        owner_activity = per_ci(np.where(is_owner, count, 0))
+        owner_last = np.full(len(ci_data_list), np.iinfo(np.int64).min)
+        np.maximum.at(owner_last, ci[is_owner], activity['last'][is_owner])
+        owner_last = self._to_datetimes(np.where(owner_last == np.iinfo(np.int64).min, 0, owner_last))
+        other_users = per_ci(is_other)
+        recent_other = per_ci(np.where(is_assigned, 0, activity['recent']))
+        role_changes = per_ci(np.where(is_assigned, activity['role_changes'], 0))
+        ownership_changes = per_ci(np.where(is_assigned, 0, activity['ownership_changes']))
+        # Busiest other user; ties go to the one seen first, as max() over the summary does
+        others = np.flatnonzero(is_other)
+        others = others[np.lexsort((activity['order'][others], -count[others], ci[others]))]
+        top_cis, top_positions = np.unique(ci[others], return_index=True)
+        top_other = dict(zip(top_cis.tolist(), others[top_positions].tolist()))
+
+        computed = {}
+        for i in batched:
+            ci_data = ci_data_list[i]
+            audit_records = ci_data.get('audit_records', [])
+            ci_activity_count = ci_activity[i]
+            owner_activity_count = owner_activity[i]
+            features = {'owner_name': owners[i]}
+            features['total_activity_count'] = len(audit_records) if audit_records else ci_activity_count
+            features['owner_activity_count'] = owner_activity_count
+            features['owner_activity_ratio'] = owner_activity_count / ci_activity_count if ci_activity_count > 0 else 0
+            features['days_since_owner_activity'] = (ci_data['scan_time'] - owner_last[i]).days if owner_activity_count else 999
+            features['other_users_count'] = other_users[i]
+            if i in top_other:
+                if ci_activity_count == 0:
+                    # predict_single fails dividing by this; let it report the same error
+                    continue
+                top_count = int(count[top_other[i]])
+                features['top_other_user'] = users[top_other[i]]
+                features['top_other_user_count'] = top_count
+                features['top_other_user_ratio'] = top_count / ci_activity_count
+            else:
+                features['top_other_user'] = None
+                features['top_other_user_count'] = 0
+                features['top_other_user_ratio'] = 0
+            features['recent_other_activities'] = recent_other[i]
+            features['owner_active'] = ci_data.get('user_info', {}).get('active', True)
+            computed[i] = (features, owner_sys_ids[i], role_changes[i], ownership_changes[i])
+        return computed
+
+    def _parse_epochs(self, values: List) -> np.ndarray:
+        """
+        _parse_date over many values, as epoch microseconds. Each distinct value is
+        parsed once: the strings with one vectorized pass per format over those still
+        unparsed, strings none of the formats match through _parse_date, and anything
+        that isn't a string gets its 1900-01-01 fallback.
+        """
+        values = pd.Series(values, dtype=object)
+        try:
+            codes, distinct = pd.factorize(values)
+        except TypeError:
+            # Unhashable values
+            return np.array([to_epoch_us(self._parse_date(value)) for value in values], dtype=np.int64)
+        # One slot per distinct value, plus a last one for the missing values (code -1)
+        parsed = np.full(len(distinct) + 1, to_epoch_us(datetime(1900, 1, 1)), dtype=np.int64)
+        distinct = pd.Series(distinct, dtype=object)
+        remaining = distinct[distinct.map(type) == str]
+        for fmt in self.DATE_FORMATS:
+            if remaining.empty:
+                break
+            attempt = pd.to_datetime(remaining, format=fmt, errors='coerce')
+            matched = attempt.notna()
+            parsed[attempt.index[matched]] = attempt[matched].to_numpy().astype('datetime64[us]').view(np.int64)
+            remaining = remaining[~matched]
+        for position, value in remaining.items():
+            # Includes dates outside what a datetime64[ns] column holds
+            parsed[position] = to_epoch_us(self._parse_date(value))
+        return parsed[codes]
+
+    def _failed_prediction(self, error):
+        return {
+            'is_stale': False,
+            'confidence': 0.0,
+            'triggered_rules': [],
+            'new_owner_recommendation': None,
+            'error': str(error)
+        }
+
+    def _score_features(self, ci_data: Dict, features: Dict, triggered: Optional[List[str]] = None) -> Dict:
+        """
+        Recommend a new owner and apply the rules to a CI's features (the second half
+        of predict_single). triggered is the names of the rules the features meet, if
+        already evaluated.
+        """
+        # Get recommendation for new owner FIRST
+        new_owner_recommendation = self._recommend_new_owner_from_data(ci_data)
+        
+        # Now do a second pass to check profile changes for recommended owners (only logged)
+        if new_owner_recommendation and ci_data.get('all_user_audit_records') and recommendation_log.isEnabledFor(logging.DEBUG):
+            recommended_sys_ids = set()
+            for rec in (new_owner_recommendation if isinstance(new_owner_recommendation, list) else [new_owner_recommendation]):
+                if rec.get('user_sys_id'):
+                    recommended_sys_ids.add(rec.get('user_sys_id'))
             
-            # Add reasons for other users' changes if significant
-            if features.get('title_changes_count', 0) > 0 and features.get('owner_activity_count', 0) == 0:
-                title_changes = features.get('title_changes_details', [])
-                non_owner_changes = [c for c in title_changes if not c.get('is_owner', False)]
-                if non_owner_changes:
+            if recommended_sys_ids:
+                # Check if any recommended owners have profile changes
+                for record in self._profile_index(ci_data).changes_for(recommended_sys_ids):
+                    documentkey = record.get('documentkey', '')
+                    fieldname = record.get('fieldname', '')
+                    if fieldname in ['title', 'department']:
+                        recommendation_log.debug("Found profile change for recommended owner - field: %s, sys_id: %s", fieldname, documentkey)
+        
+        # Apply rules
+        triggered_rules = []
+        total_confidence = 0
+
+        for rule_name in (self.rule_set.triggered(features) if triggered is None else triggered):
+            rule_def = self.rules[rule_name]
+            triggered_rules.append({
+                'rule': rule_name,
+                'description': rule_def['description'],
+                'confidence': rule_def['confidence'],
+                'scenarios': rule_def['scenarios']
+            })
+            total_confidence = max(total_confidence, rule_def['confidence'])
+
+        # Add specific title/department change reasons with details
+        if features.get('owner_profile_changes_details'):
+            for change in features['owner_profile_changes_details']:
+                if change['field'] == 'title':
                     triggered_rules.append({
-                        'rule': 'ci_users_title_changes',
-                        'description': f"{len(non_owner_changes)} user(s) who work on this CI had title changes while owner remained inactive",
-                        'confidence': 0.75,
-                        'scenarios': ['team_transition']
+                        'rule': 'owner_title_change_detected',
+                        'description': f"Owner's title changed from '{change['old_value']}' to '{change['new_value']}' on {change['change_date']}",
+                        'confidence': 0.85,
+                        'scenarios': ['profile_change']
                     })
-                    total_confidence = max(total_confidence, 0.75)
-            
-            if features.get('department_changes_count', 0) > 0 and features.get('owner_activity_count', 0) == 0:
-                dept_changes = features.get('department_changes_details', [])
-                non_owner_changes = [c for c in dept_changes if not c.get('is_owner', False)]
-                if non_owner_changes:
+                    total_confidence = max(total_confidence, 0.85)
+                elif change['field'] == 'department':
                     triggered_rules.append({
-                        'rule': 'ci_users_department_changes',
-                        'description': f"{len(non_owner_changes)} user(s) who work on this CI had department changes while owner remained inactive",
-                        'confidence': 0.75,
-                        'scenarios': ['team_transition']
+                        'rule': 'owner_department_change_detected',
+                        'description': f"Owner's department changed from '{change['old_value']}' to '{change['new_value']}' on {change['change_date']}",
+                        'confidence': 0.85,
+                        'scenarios': ['profile_change']
                     })
-                    total_confidence = max(total_confidence, 0.75)
-
-            # Determine staleness
-            is_stale = total_confidence > 0.7
+                    total_confidence = max(total_confidence, 0.85)
+        
+        # Add reasons for other users' changes if significant
+        if features.get('title_changes_count', 0) > 0 and features.get('owner_activity_count', 0) == 0:
+            title_changes = features.get('title_changes_details', [])
+            non_owner_changes = [c for c in title_changes if not c.get('is_owner', False)]
+            if non_owner_changes:
+                triggered_rules.append({
+                    'rule': 'ci_users_title_changes',
+                    'description': f"{len(non_owner_changes)} user(s) who work on this CI had title changes while owner remained inactive",
+                    'confidence': 0.75,
+                    'scenarios': ['team_transition']
+                })
+                total_confidence = max(total_confidence, 0.75)
+        
+        if features.get('department_changes_count', 0) > 0 and features.get('owner_activity_count', 0) == 0:
+            dept_changes = features.get('department_changes_details', [])
+            non_owner_changes = [c for c in dept_changes if not c.get('is_owner', False)]
+            if non_owner_changes:
+                triggered_rules.append({
+                    'rule': 'ci_users_department_changes',
+                    'description': f"{len(non_owner_changes)} user(s) who work on this CI had department changes while owner remained inactive",
+                    'confidence': 0.75,
+                    'scenarios': ['team_transition']
+                })
+                total_confidence = max(total_confidence, 0.75)
 
-            return {
-                'is_stale': is_stale,
-                'confidence': total_confidence,
-                'triggered_rules': triggered_rules,
-                'new_owner_recommendation': new_owner_recommendation,
-                'features': features
-            }
+        # Determine staleness
+        is_stale = total_confidence > 0.7
 
-        except Exception as e:
-            return {
-                'is_stale': False,
-                'confidence': 0.0,
-                'triggered_rules': [],
-                'new_owner_recommendation': None,
-                'error': str(e)
-            }
+        return {
+            'is_stale': is_stale,
+            'confidence': total_confidence,
+            'triggered_rules': triggered_rules,
+            'new_owner_recommendation': new_owner_recommendation,
+            'features': features
+        }
 
     def _extract_features_from_servicenow_data(self, ci_data: Dict) -> Dict:
         """
@@ -326,70 +662,45 @@ class RuleBasedStalenessDetector:
         
         # Get current owner's sys_id
         user_info = ci_data.get('user_info', {})
-        owner_sys_id = user_info.get('sys_id', '')
+        owner_sys_id = self._owner_sys_id(ci_data)
         
-        # Also try to get owner sys_id from CI info if not in user_info
-        if not owner_sys_id:
-            ci_info = ci_data.get('ci_info', {})
-            assigned_to_field = ci_info.get('assigned_to', {})
-            if isinstance(assigned_to_field, dict):
-                owner_sys_id = assigned_to_field.get('value', '')
-            # Check expanded field
-            if not owner_sys_id:
-                owner_sys_id = ci_info.get('assigned_to.sys_id', {})
-                if isinstance(owner_sys_id, dict):
-                    owner_sys_id = owner_sys_id.get('value', owner_sys_id.get('display_value', ''))
-        
-        # Debug logging
-        if owner_sys_id:
-            print(f"DEBUG: Owner '{assigned_owner}' has sys_id: {owner_sys_id}")
-        
-        # Get all user profile audit records
-        all_user_audit_records = ci_data.get('all_user_audit_records', [])
-        
-        # Get user lookup data
-        user_by_sys_id = ci_data.get('user_by_sys_id', {})
+        # Canonical user identities, for matching audit users to the owner
+        identities = self._identity_index(ci_data)
         
         # Audit records analysis
         audit_records = ci_data.get('audit_records', [])
-        features['total_activity_count'] = len(audit_records)
         
         # Separate CI audit records from user profile audit records
         ci_audit_records = [r for r in audit_records if r.get('audit_type') != 'user_profile_change']
         
+        # Per-user activity on this CI - either supplied pre-aggregated (e.g. from the
+        # ServiceNow Aggregate API) or summarized here from the raw CI audit records
+        scan_time = self._scan_time(ci_data)
+        recent_cutoff = scan_time - timedelta(days=30)
+        activity_summary = ci_data.get('activity_summary')
+        if activity_summary is None:
+            activity_summary = self._summarize_audit_activity(ci_audit_records, recent_cutoff)
+        ci_activity_count = sum(activity['count'] for activity in activity_summary.values())
+        features['total_activity_count'] = len(audit_records) if audit_records else ci_activity_count
+        
         # Owner activity analysis (only CI-related activities)
         # Handle cases where audit records contain sys_ids instead of usernames
-        owner_activities = []
-        for record in ci_audit_records:
-            audit_user = record.get('user', '')
-            # Direct username match
-            if audit_user == assigned_owner:
-                owner_activities.append(record)
-            # Check if audit_user is a sys_id that matches the owner's sys_id
-            elif audit_user == owner_sys_id:
-                owner_activities.append(record)
-            # Check if audit_user is a sys_id that can be resolved to the assigned_owner username
-            elif audit_user in user_by_sys_id:
-                resolved_user = user_by_sys_id[audit_user]
-                resolved_username = resolved_user.get('user_name', '')
-                # Check for exact match or username variations
-                if resolved_username == assigned_owner or self._are_same_user_variations(assigned_owner, resolved_username):
-                    owner_activities.append(record)
+        owner_users = [user for user in activity_summary
+                       if identities.resolves_to_owner(user, assigned_owner, owner_sys_id)]
+        owner_activity_count = sum(activity_summary[user]['count'] for user in owner_users)
         
-        features['owner_activity_count'] = len(owner_activities)
+        features['owner_activity_count'] = owner_activity_count
         
-
-        
-        if len(ci_audit_records) > 0:
-            features['owner_activity_ratio'] = len(owner_activities) / len(ci_audit_records)
+        if ci_activity_count > 0:
+            features['owner_activity_ratio'] = owner_activity_count / ci_activity_count
         else:
             features['owner_activity_ratio'] = 0
 
         # Days since owner activity
-        if owner_activities:
+        if owner_activity_count:
             try:
-                last_activity = max([self._parse_date(r.get('sys_created_on', '')) for r in owner_activities])
-                features['days_since_owner_activity'] = (datetime.now() - last_activity).days
+                last_activity = max(activity_summary[user]['last_activity'] for user in owner_users)
+                features['days_since_owner_activity'] = (scan_time - last_activity).days
             except:
                 features['days_since_owner_activity'] = 999
         else:
@@ -397,10 +708,9 @@ class RuleBasedStalenessDetector:
 
         # Other users analysis (only CI-related activities)
         other_users = {}
-        for record in ci_audit_records:
-            user = record.get('user', '')
+        for user, activity in activity_summary.items():
             if user != assigned_owner and user:
-                other_users[user] = other_users.get(user, 0) + 1
+                other_users[user] = activity['count']
 
         features['other_users_count'] = len(other_users)
         
@@ -408,32 +718,96 @@ class RuleBasedStalenessDetector:
             top_user = max(other_users.items(), key=lambda x: x[1])
             features['top_other_user'] = top_user[0]
             features['top_other_user_count'] = top_user[1]
-            features['top_other_user_ratio'] = top_user[1] / len(ci_audit_records)
+            features['top_other_user_ratio'] = top_user[1] / ci_activity_count
         else:
             features['top_other_user'] = None
             features['top_other_user_count'] = 0
             features['top_other_user_ratio'] = 0
 
         # Recent activity (last 30 days) - only CI-related
-        recent_cutoff = datetime.now() - timedelta(days=30)
-        recent_other_activities = 0
-        for record in ci_audit_records:
-            if record.get('user') != assigned_owner:
-                try:
-                    record_date = self._parse_date(record.get('sys_created_on', ''))
-                    if record_date > recent_cutoff:
-                        recent_other_activities += 1
-                except:
-                    pass
-        features['recent_other_activities'] = recent_other_activities
+        features['recent_other_activities'] = sum(
+            activity['recent_count'] for user, activity in activity_summary.items() if user != assigned_owner
+        )
 
         # User info analysis
         features['owner_active'] = user_info.get('active', True)
 
+        features.update(self._profile_change_features(ci_data, activity_summary, assigned_owner, owner_sys_id))
+
+        # Original role and department analysis (for backward compatibility)
+        role_change_fields = ['title', 'role', 'department']
+        role_changes = sum(activity['fields'].get(field, 0)
+                           for user, activity in activity_summary.items() if user == assigned_owner
+                           for field in role_change_fields)
+        features['owner_role_changes'] = role_changes
+        features['owner_title_changed'] = len([c for c in features['owner_profile_changes_details'] if c['field'] == 'title']) > 0
+        features['owner_dept_changed'] = len([c for c in features['owner_profile_changes_details'] if c['field'] == 'department']) > 0
+
+        # Group status (simplified)
+        features['assigned_group_active'] = True  # Default assumption
+
+        # Ownership field changes by non-owner
+        ownership_fields = ['assigned_to', 'managed_by', 'support_group']
+        ownership_changes = sum(activity['fields'].get(field, 0)
+                                for user, activity in activity_summary.items() if user != assigned_owner
+                                for field in ownership_fields)
+        features['non_owner_ownership_changes'] = ownership_changes
+
+        return features
+
+    def _owner_sys_id(self, ci_data: Dict) -> str:
+        """The current owner's sys_id, from the user record or the CI's assigned_to reference"""
+        user_info = ci_data.get('user_info', {})
+        owner_sys_id = user_info.get('sys_id', '')
+        
+        # Also try to get owner sys_id from CI info if not in user_info
+        if not owner_sys_id:
+            ci_info = ci_data.get('ci_info', {})
+            assigned_to_field = ci_info.get('assigned_to', {})
+            if isinstance(assigned_to_field, dict):
+                owner_sys_id = assigned_to_field.get('value', '')
+            # Check expanded field
+            if not owner_sys_id:
+                owner_sys_id = ci_info.get('assigned_to.sys_id', {})
+                if isinstance(owner_sys_id, dict):
+                    owner_sys_id = owner_sys_id.get('value', owner_sys_id.get('display_value', ''))
+        
+        if owner_sys_id:
+            ci_log.debug("Owner '%s' has sys_id: %s", ci_data.get('assigned_owner', ''), owner_sys_id)
+        return owner_sys_id
+
+    def _scan_time(self, ci_data: Dict) -> datetime:
+        """The time activity ages and the 30-day recent window are measured from"""
+        return ci_data.get('scan_time') or datetime.now()
+
+    def _identity_index(self, ci_data: Dict) -> IdentityIndex:
+        """The scan's identity index, or one built from this CI's data when scored on its own"""
+        identities = ci_data.get('identity_index')
+        if identities is None:
+            identities = IdentityIndex(ci_data.get('user_data_context', {}), ci_data.get('user_by_sys_id', {}))
+        return identities
+
+    def _profile_index(self, ci_data: Dict) -> ProfileChangeIndex:
+        """The scan's profile change index, or one built from this CI's data when scored on its own"""
+        profile_index = ci_data.get('profile_change_index')
+        if profile_index is None:
+            profile_index = ProfileChangeIndex(ci_data.get('all_user_audit_records', []),
+                                               ci_data.get('user_data_context', {}), self._parse_date)
+        return profile_index
+
+    def _profile_change_features(self, ci_data: Dict, activity_summary: Dict, assigned_owner, owner_sys_id) -> Dict:
+        """
+        Title, department and other profile changes of the CI's owner and of the users
+        active on it, from the user profile audit records
+        """
+        features = {}
+        
+        # User profile audit records by user sys_id
+        profile_index = self._profile_index(ci_data)
+        
         # Enhanced role and department change analysis
         # Get user data context for better analysis
         user_data_context = ci_data.get('user_data_context', {})
-        user_by_sys_id = ci_data.get('user_by_sys_id', {})
         
         # Track title and department changes for all users associated with this CI
         title_changes = []
@@ -450,8 +824,7 @@ class RuleBasedStalenessDetector:
             ci_related_user_sys_ids.add(owner_sys_id)
         
         # Add users who modified the CI
-        for record in ci_audit_records:
-            user = record.get('user', '')
+        for user in activity_summary:
             if user and user in user_data_context:
                 ci_related_users.add(user)
                 user_sys_id = user_data_context[user].get('sys_id', '')
@@ -477,49 +850,41 @@ class RuleBasedStalenessDetector:
                         if rec_sys_id:
                             ci_related_user_sys_ids.add(rec_sys_id)
         
-        # Now look for user profile changes using user sys_ids as documentkey
-        for record in all_user_audit_records:
+        # Now look for user profile changes of the CI-related users (user sys_id as documentkey)
+        for record in profile_index.changes_for(ci_related_user_sys_ids):
             documentkey = record.get('documentkey', '')  # This is the user's sys_id for profile changes
             fieldname = record.get('fieldname', '')
             oldvalue = record.get('oldvalue', '')
             newvalue = record.get('newvalue', '')
             change_date = record.get('sys_created_on', '')
             
-            # Check if this documentkey matches any of our CI-related users
-            if documentkey in ci_related_user_sys_ids:
-                # Find which user this sys_id belongs to
-                user_for_sys_id = None
-                for username, user_data in user_data_context.items():
-                    if user_data.get('sys_id') == documentkey:
-                        user_for_sys_id = username
-                        break
+            # Find which user this sys_id belongs to
+            user_for_sys_id = profile_index.username(documentkey)
+            
+            if user_for_sys_id:
+                change_info = {
+                    'user': user_for_sys_id,
+                    'user_sys_id': documentkey,
+                    'field': fieldname,
+                    'old_value': oldvalue,
+                    'new_value': newvalue,
+                    'change_date': change_date,
+                    'is_owner': user_for_sys_id == assigned_owner
+                }
                 
-                if user_for_sys_id:
-                    change_info = {
-                        'user': user_for_sys_id,
-                        'user_sys_id': documentkey,
-                        'field': fieldname,
-                        'old_value': oldvalue,
-                        'new_value': newvalue,
-                        'change_date': change_date,
-                        'is_owner': user_for_sys_id == assigned_owner
-                    }
-                    
-                    # Categorize profile changes
-                    if fieldname in ['title', 'job_title', 'u_job_title']:
-                        title_changes.append(change_info)
-                        if user_for_sys_id == assigned_owner:
-                            owner_profile_changes.append(change_info)
-                    elif fieldname in ['department', 'cost_center', 'location', 'company']:
-                        department_changes.append(change_info)
-                        if user_for_sys_id == assigned_owner:
-                            owner_profile_changes.append(change_info)
-                    elif fieldname in ['manager', 'active', 'locked_out', 'u_employee_type', 'u_vendor_status']:
-                        # These are also significant profile changes
-                        if user_for_sys_id == assigned_owner:
-                            owner_profile_changes.append(change_info)
-        
-
+                # Categorize profile changes
+                if fieldname in ['title', 'job_title', 'u_job_title']:
+                    title_changes.append(change_info)
+                    if user_for_sys_id == assigned_owner:
+                        owner_profile_changes.append(change_info)
+                elif fieldname in ['department', 'cost_center', 'location', 'company']:
+                    department_changes.append(change_info)
+                    if user_for_sys_id == assigned_owner:
+                        owner_profile_changes.append(change_info)
+                elif fieldname in ['manager', 'active', 'locked_out', 'u_employee_type', 'u_vendor_status']:
+                    # These are also significant profile changes
+                    if user_for_sys_id == assigned_owner:
+                        owner_profile_changes.append(change_info)
         
         # Enhanced features for title and department changes
         features['title_changes_count'] = len(title_changes)
@@ -530,39 +895,96 @@ class RuleBasedStalenessDetector:
         features['title_changes_details'] = title_changes
         features['department_changes_details'] = department_changes
         features['owner_profile_changes_details'] = owner_profile_changes
-        
-        # Original role and department analysis (for backward compatibility)
-        role_change_fields = ['title', 'role', 'department']
-        role_changes = sum(1 for r in ci_audit_records 
-                          if r.get('fieldname') in role_change_fields and r.get('user') == assigned_owner)
-        features['owner_role_changes'] = role_changes
-        features['owner_title_changed'] = len([c for c in owner_profile_changes if c['field'] == 'title']) > 0
-        features['owner_dept_changed'] = len([c for c in owner_profile_changes if c['field'] == 'department']) > 0
-
-        # Group status (simplified)
-        features['assigned_group_active'] = True  # Default assumption
+        return features
 
-        # Ownership field changes by non-owner
-        ownership_fields = ['assigned_to', 'managed_by', 'support_group']
-        ownership_changes = sum(1 for r in ci_audit_records 
-                              if r.get('fieldname') in ownership_fields and r.get('user') != assigned_owner)
-        features['non_owner_ownership_changes'] = ownership_changes
+    def _summarize_audit_activity(self, audit_records: List[Dict], recent_cutoff: datetime) -> Dict:
+        """
+        Group audit records by user, in order of first appearance.
+        Each entry holds the record count, counts per field name, first and last
+        activity dates and the number of records newer than recent_cutoff.
+        """
+        summary = {}
+        cutoff = to_epoch_us(recent_cutoff)
+        for record in audit_records:
+            user = record.get('user', '')
+            activity = summary.get(user)
+            if activity is None:
+                activity = summary[user] = {
+                    'count': 0,
+                    'fields': {},
+                    'first_activity': None,
+                    'last_activity': None,
+                    'recent_count': 0
+                }
+            activity['count'] += 1
+            fieldname = record.get('fieldname', '')
+            activity['fields'][fieldname] = activity['fields'].get(fieldname, 0) + 1
+            
+            # Dates are compared as epoch microseconds and turned into datetimes once per user
+            record_date = record.get(CREATED_EPOCH_FIELD)
+            if record_date is None:
+                record_date = to_epoch_us(self._parse_date(record.get('sys_created_on', '')))
+            if activity['last_activity'] is None or record_date > activity['last_activity']:
+                activity['last_activity'] = record_date
+            if activity['first_activity'] is None or record_date < activity['first_activity']:
+                activity['first_activity'] = record_date
+            if record_date > cutoff:
+                activity['recent_count'] += 1
+        for activity in summary.values():
+            activity['first_activity'] = from_epoch_us(activity['first_activity'])
+            activity['last_activity'] = from_epoch_us(activity['last_activity'])
+        return summary
 
-        return features
+    def build_activity_summaries(self, activity_rows: List[Dict]) -> Dict:
+        """
+        Build per-CI activity summaries from server-side sys_audit aggregates.
+        Each row is one (documentkey, user, fieldname) group with its record count,
+        first/last sys_created_on and the count of records from the last 30 days.
+        Returns {ci_id: {user: activity}} in the shape _summarize_audit_activity produces.
+        """
+        summaries = {}
+        rows = sorted(activity_rows, key=lambda r: (str(r.get('documentkey', '')), str(r.get('user', '')), str(r.get('fieldname', ''))))
+        for row in rows:
+            ci_summary = summaries.setdefault(str(row.get('documentkey', '')), {})
+            user = row.get('user', '')
+            activity = ci_summary.get(user)
+            if activity is None:
+                activity = ci_summary[user] = {
+                    'count': 0,
+                    'fields': {},
+                    'first_activity': None,
+                    'last_activity': None,
+                    'recent_count': 0
+                }
+            count = int(row.get('count', 0))
+            fieldname = row.get('fieldname', '')
+            activity['count'] += count
+            activity['fields'][fieldname] = activity['fields'].get(fieldname, 0) + count
+            activity['recent_count'] += int(row.get('recent_count', 0))
+            
+            first_activity = self._parse_date(row.get('first_activity', ''))
+            last_activity = self._parse_date(row.get('last_activity', ''))
+            if activity['last_activity'] is None or last_activity > activity['last_activity']:
+                activity['last_activity'] = last_activity
+            if activity['first_activity'] is None or first_activity < activity['first_activity']:
+                activity['first_activity'] = first_activity
+        return summaries
 
     def _parse_date(self, date_str: str) -> datetime:
-        """Parse ServiceNow date format"""
+        """Parse ServiceNow date format; strings are parsed once, as the same timestamps recur across records"""
+        if type(date_str) is not str:
+            return self._parse_date_format(date_str)
+        parsed = _parsed_dates.get(date_str)
+        if parsed is None:
+            if len(_parsed_dates) >= DATE_MEMO_SIZE:
+                _parsed_dates.clear()
+            parsed = _parsed_dates[date_str] = self._parse_date_format(date_str)
+        return parsed
+
+    def _parse_date_format(self, date_str: str) -> datetime:
         try:
             # Try common ServiceNow date formats
-            formats = [
-                '%Y-%m-%d %H:%M:%S',
-                '%Y-%m-%dT%H:%M:%S',
-                '%Y-%m-%d',
-                '%m/%d/%Y %H:%M:%S',
-                '%m/%d/%Y'
-            ]
-            
-            for fmt in formats:
+            for fmt in self.DATE_FORMATS:
                 try:
                     return datetime.strptime(date_str, fmt)
                 except ValueError:
@@ -602,20 +1024,6 @@ class RuleBasedStalenessDetector:
         # Default fallback
         return str(dept_field) if dept_field else 'Unknown'
 
-    def _evaluate_rule(self, features: Dict, conditions: List[str]) -> bool:
-        """Evaluate if all conditions are met"""
-        for condition in conditions:
-            try:
-                # Create local variables for evaluation
-                local_vars = features.copy()
-                
-                # Evaluate condition
-                if not eval(condition, {"__builtins__": {}}, local_vars):
-                    return False
-            except:
-                return False
-        return True
-
     def _recommend_new_owner_from_data(self, ci_data: Dict) -> Optional[Dict]:
         """Recommend new owner based on ServiceNow data"""
         try:
@@ -623,6 +1031,7 @@ class RuleBasedStalenessDetector:
             assigned_owner = ci_data.get('assigned_owner', '')
             username_to_display_name = ci_data.get('username_to_display_name', {})
             user_data_context = ci_data.get('user_data_context', {})
+            scan_time = self._scan_time(ci_data)
             
             # Get user data for department lookup
             user_info_lookup = {}
@@ -633,8 +1042,11 @@ class RuleBasedStalenessDetector:
             # Build user lookup from audit records and try to match with user data
             # We'll need to get user data from the broader context
             
-            if not audit_records:
-                return None
+            activity_summary = ci_data.get('activity_summary')
+            if activity_summary is None:
+                if not audit_records:
+                    return None
+                activity_summary = self._summarize_audit_activity(audit_records, scan_time - timedelta(days=30))
 
             # Get current owner's sys_id for better matching
             current_owner_sys_id = ''
@@ -650,31 +1062,11 @@ class RuleBasedStalenessDetector:
                     current_owner_sys_id = assigned_to_field.get('value', '')
             
             # Analyze user activities
+            identities = self._identity_index(ci_data)
             user_activities = {}
-            for record in audit_records:
-                user = record.get('user', '')
-                if user and self._is_different_user(user, assigned_owner, current_owner_sys_id, user_data_context):
-                    if user not in user_activities:
-                        user_activities[user] = {
-                            'count': 0,
-                            'last_activity': None,
-                            'first_activity': None,
-                            'fields': set()
-                        }
-                    
-                    user_activities[user]['count'] += 1
-                    user_activities[user]['fields'].add(record.get('fieldname', ''))
-                    
-                    try:
-                        record_date = self._parse_date(record.get('sys_created_on', ''))
-                        
-                        if user_activities[user]['last_activity'] is None or record_date > user_activities[user]['last_activity']:
-                            user_activities[user]['last_activity'] = record_date
-                        
-                        if user_activities[user]['first_activity'] is None or record_date < user_activities[user]['first_activity']:
-                            user_activities[user]['first_activity'] = record_date
-                    except:
-                        pass
+            for user, activity in activity_summary.items():
+                if user and not identities.lists_owner(user, assigned_owner, current_owner_sys_id):
+                    user_activities[user] = activity
 
             if not user_activities:
                 return None
@@ -689,7 +1081,7 @@ class RuleBasedStalenessDetector:
                 
                 # Recency (recent activity = higher score)
                 if activity['last_activity']:
-                    days_since_last = (datetime.now() - activity['last_activity']).days
+                    days_since_last = (scan_time - activity['last_activity']).days
                     if days_since_last < 30:
                         score += 25
                     elif days_since_last < 90:
@@ -699,7 +1091,7 @@ class RuleBasedStalenessDetector:
                 
                 # Ownership-related changes
                 ownership_fields = {'assigned_to', 'managed_by', 'support_group', 'owned_by'}
-                ownership_changes = len(activity['fields'].intersection(ownership_fields))
+                ownership_changes = len(ownership_fields.intersection(activity['fields']))
                 score += ownership_changes * 5
                 
                 # Get user details including sys_id
@@ -728,111 +1120,65 @@ class RuleBasedStalenessDetector:
                     'display_name': display_name,
                     'score': score,
                     'activity_count': activity['count'],
-                    'last_activity_days_ago': (datetime.now() - activity['last_activity']).days if activity['last_activity'] else 999,
+                    'last_activity_days_ago': (scan_time - activity['last_activity']).days if activity['last_activity'] else 999,
                     'ownership_changes': ownership_changes,
                     'fields_modified': len(activity['fields']),
                     'department': self._clean_department_field(user_details.get('department', 'Unknown'))
                 })
                 
-                # Debug logging for first few recommendations
-                if len(user_scores) <= 3:
-                    print(f"DEBUG recommendation {len(user_scores)}: user='{user}', user_sys_id='{user_sys_id}', "
-                          f"display_name_from_mapping='{username_to_display_name.get(user)}', "
-                          f"final_display_name='{username_to_display_name.get(user, user)}', "
-                          f"department='{user_details.get('department', 'Unknown')}'")
+                if recommendation_log.isEnabledFor(logging.DEBUG):
+                    recommendation_log.debug("Candidate %d: user='%s', user_sys_id='%s', display_name_from_mapping='%s', "
+                                             "final_display_name='%s', department='%s'",
+                                             len(user_scores), user, user_sys_id, username_to_display_name.get(user),
+                                             username_to_display_name.get(user, user), user_details.get('department', 'Unknown'))
 
             # Sort by score and return top recommendations
             user_scores.sort(key=lambda x: x['score'], reverse=True)
             
-            print(f"DEBUG _recommend_new_owner_from_data: Generated {len(user_scores)} recommendations")
-            if user_scores:
-                print(f"DEBUG _recommend_new_owner_from_data: Top recommendation: {user_scores[0]}")
-            
             # Return up to 3 recommendations
             result = user_scores[:3] if len(user_scores) >= 3 else user_scores
-            print(f"DEBUG _recommend_new_owner_from_data: Returning {len(result)} recommendations: {result}")
+            recommendation_log.debug("Scored %d candidate owners, returning %d: %s", len(user_scores), len(result), result)
             return result
 
         except Exception as e:
             return None
 
-    def _is_different_user(self, audit_user, assigned_owner, current_owner_sys_id, user_data_context):
+    def get_stale_ci_list(self, labels_df, audit_df, user_df, ci_df, ci_owner_display_names=None, activity_by_ci=None, timings=None, progress=None, batch=True, scan_time=None, workers=1):
         """
-        Check if audit_user is different from the current owner.
-        Handles cases where audit_user might be a sys_id and assigned_owner is a username.
+        Analyze all CIs and return a list of stale CIs with confidence and risk level.
+        Takes the same arguments as iter_stale_cis.
         """
-        # Direct username match - same user
-        if audit_user == assigned_owner:
-            return False
-        
-        # Direct sys_id match - same user
-        if audit_user == current_owner_sys_id:
-            return False
-        
-        # Check if audit_user (sys_id) resolves to the assigned_owner (username)
-        # user_data_context contains user data by username, but we need sys_id lookup
-        # We'll need to iterate through user_data_context to find matching sys_ids
-        for username, user_data in user_data_context.items():
-            if isinstance(user_data, dict):
-                user_sys_id = user_data.get('sys_id', '')
-                user_name = user_data.get('user_name', username)
-                
-                # If audit_user is this user's sys_id and this user is the assigned_owner
-                if audit_user == user_sys_id and user_name == assigned_owner:
-                    return False
-                
-                # If assigned_owner matches this user and audit_user is their sys_id
-                if assigned_owner == user_name and audit_user == user_sys_id:
-                    return False
-                
-                # Handle username variations (e.g., mike.foster.xyz vs mike.foster)
-                # Check if one username is a variation of the other
-                if audit_user == user_sys_id and self._are_same_user_variations(assigned_owner, user_name):
-                    return False
-        
-        # Different users
-        return True
+        return list(self.iter_stale_cis(labels_df, audit_df, user_df, ci_df, ci_owner_display_names, activity_by_ci, timings, progress, batch, scan_time, workers))
 
-    def _are_same_user_variations(self, username1, username2):
-        """
-        Check if two usernames are variations of the same user.
-        Examples: mike.foster.xyz vs mike.foster, person.f.contractor vs person.f
+    def iter_stale_cis(self, labels_df, audit_df, user_df, ci_df, ci_owner_display_names=None, activity_by_ci=None, timings=None, progress=None, batch=True, scan_time=None, workers=1):
         """
-        if not username1 or not username2:
-            return False
-        
-        # Direct match
-        if username1 == username2:
-            return True
-        
-        # Remove common suffixes and check
-        suffixes = ['.xyz', '.contractor', '.temp', '.ext', '.admin', '.generic']
-        
-        def normalize_username(username):
-            normalized = username.lower()
-            for suffix in suffixes:
-                if normalized.endswith(suffix):
-                    normalized = normalized[:-len(suffix)]
-            return normalized
-        
-        normalized1 = normalize_username(username1)
-        normalized2 = normalize_username(username2)
-        
-        return normalized1 == normalized2
-
-    def get_stale_ci_list(self, labels_df, audit_df, user_df, ci_df, ci_owner_display_names=None):
-        """
-        Analyze all CIs and return a list of stale CIs with confidence and risk level.
+        Analyze all CIs, yielding each stale CI with confidence and risk level as soon
+        as it is scored.
         Args:
             labels_df: DataFrame with columns ['ci_id', 'assigned_owner']
             audit_df: DataFrame of audit records
             user_df: DataFrame of user records
             ci_df: DataFrame of CI records
             ci_owner_display_names: Dict mapping CI IDs to owner display names
-        Returns:
-            List of dicts, each representing a stale CI with confidence and risk_level
+            activity_by_ci: Optional per-CI activity summaries (see build_activity_summaries)
+                used instead of raw CI audit records in audit_df
+            timings: Optional dict that receives seconds spent building lookups and predicting
+            progress: Optional callable progress(scored, total, stale) called every
+                PROGRESS_INTERVAL CIs and once at the end
+            batch: Score CIs PREDICT_BATCH_SIZE at a time with predict_batch rather than
+                one by one with predict_single; the results are the same
+            scan_time: The time every CI's activity ages are measured from (default: when
+                the scan starts); the same inputs and scan_time give the same results
+            workers: With more than one, scans of SHARDED_MIN_CIS CIs or more are scored on
+                this many worker processes, each chunk sharded by ci_id (see sharded_scoring);
+                the stale CIs are yielded in the same order with the same content
+        Yields:
+            Dicts, each representing a stale CI with confidence and risk_level
         """
-        stale_cis = []
+        started = time.perf_counter()
+        if scan_time is None:
+            scan_time = datetime.now()
+        stale_count = 0
         if ci_owner_display_names is None:
             ci_owner_display_names = {}
             
@@ -852,16 +1198,20 @@ class RuleBasedStalenessDetector:
                 sys_id = str(u.get('sys_id'))
                 user_by_sys_id[sys_id] = user_dict
         
-        print(f"DEBUG: Built username_to_display_name mapping with {len(username_to_display_name)} entries")
-        if username_to_display_name:
-            sample_entries = list(username_to_display_name.items())[:3]
-            print(f"DEBUG: Sample username_to_display_name entries: {sample_entries}")
+        if username_to_display_name and lookup_log.isEnabledFor(logging.DEBUG):
+            lookup_log.debug("Sample username_to_display_name entries: %s", list(username_to_display_name.items())[:3])
         
         # Build lookup for audit data
         audit_by_ci = {}
         all_user_audit_records = []  # Collect all user profile audit records
         
-        for _, row in audit_df.iterrows():
+        # Parse every record's sys_created_on in one pass, each distinct timestamp once
+        created_on = audit_df['sys_created_on'] if 'sys_created_on' in audit_df else [''] * len(audit_df)
+        created_epochs = self._parse_epochs([
+            value.get('value', value.get('display_value', '')) if isinstance(value, dict) else value
+            for value in created_on]).tolist()
+        
+        for position, (_, row) in enumerate(audit_df.iterrows()):
             doc_key = row.get('documentkey')
             
             # Extract the actual document key value if it's a dict
@@ -872,11 +1222,11 @@ class RuleBasedStalenessDetector:
                 # Convert pandas Series to dict to avoid JSON serialization issues
                 audit_record = {k: v for k, v in row.to_dict().items()}
                 
-                # Debug: Log raw audit record structure for user profile changes
-                if row.get('tablename') == 'sys_user' and row.get('fieldname') in ['title', 'department']:
-                    print(f"DEBUG: Raw user profile audit record - tablename: {row.get('tablename')}, "
-                          f"fieldname: {row.get('fieldname')}, documentkey type: {type(doc_key)}, "
-                          f"documentkey value: {doc_key}")
+                # Raw audit record structure for user profile changes
+                if lookup_log.isEnabledFor(logging.DEBUG) and row.get('tablename') == 'sys_user' \
+                        and row.get('fieldname') in ['title', 'department']:
+                    lookup_log.debug("Raw user profile audit record - tablename: %s, fieldname: %s, documentkey type: %s, "
+                                     "documentkey value: %s", row.get('tablename'), row.get('fieldname'), type(doc_key), doc_key)
                 
                 # Clean up all dict fields to extract their values
                 for field_name, field_value in audit_record.items():
@@ -890,6 +1240,7 @@ class RuleBasedStalenessDetector:
                 
                 # Make sure documentkey is properly set
                 audit_record['documentkey'] = str(doc_key)
+                audit_record[CREATED_EPOCH_FIELD] = created_epochs[position]
                 
                 # Extract user display name from expanded user fields if available
                 user_field = row.get('user')  # Get original user field from row
@@ -949,140 +1300,194 @@ class RuleBasedStalenessDetector:
             if ci_sys_id:
                 ci_by_id[str(ci_sys_id)] = {k: v for k, v in ci.to_dict().items()}
         
-        print(f"DEBUG: Built ci_by_id mapping with {len(ci_by_id)} entries")
-        print(f"DEBUG: Found {len(all_user_audit_records)} user profile audit records")
+        logger.info(f"Built lookups: {len(user_by_name)} users, {len(ci_by_id)} CIs, "
+                    f"{sum(map(len, audit_by_ci.values()))} CI audit records, {len(all_user_audit_records)} user profile audit records")
         
-        # Debug: Show breakdown of user profile changes
-        if all_user_audit_records:
+        # Breakdown and samples of the user profile changes
+        if all_user_audit_records and lookup_log.isEnabledFor(logging.DEBUG):
             title_count = sum(1 for r in all_user_audit_records if r.get('fieldname') == 'title')
             dept_count = sum(1 for r in all_user_audit_records if r.get('fieldname') == 'department')
-            print(f"DEBUG: User profile changes - {title_count} title changes, {dept_count} department changes")
-            # Show sample documentkeys
+            lookup_log.debug("User profile changes - %d title changes, %d department changes", title_count, dept_count)
             sample_keys = list(set(r.get('documentkey', '') for r in all_user_audit_records[:10]))
-            print(f"DEBUG: Sample user profile change documentkeys: {sample_keys[:5]}")
-            
-            # Show all fields being tracked
-            field_types = set(r.get('fieldname', '') for r in all_user_audit_records)
-            print(f"DEBUG: Fields being tracked in user profile changes: {field_types}")
-            
-            # Show full details of first few records
+            lookup_log.debug("Sample user profile change documentkeys: %s", sample_keys[:5])
+            lookup_log.debug("Fields being tracked in user profile changes: %s",
+                             set(r.get('fieldname', '') for r in all_user_audit_records))
             for i, record in enumerate(all_user_audit_records[:3]):
-                print(f"DEBUG: User profile audit record {i}: fieldname={record.get('fieldname')}, "
-                      f"documentkey={record.get('documentkey')}, tablename={record.get('tablename')}")
+                lookup_log.debug("User profile audit record %d: fieldname=%s, documentkey=%s, tablename=%s",
+                                 i, record.get('fieldname'), record.get('documentkey'), record.get('tablename'))
+        profile_change_index = ProfileChangeIndex(all_user_audit_records, user_by_name, self._parse_date)
+        identity_index = IdentityIndex(user_by_name, user_by_sys_id)
         
-        if ci_by_id:
-            sample_ci_id = list(ci_by_id.keys())[0]
-            sample_ci_data = ci_by_id[sample_ci_id]
-            print(f"DEBUG: Sample CI {sample_ci_id} has keys: {list(sample_ci_data.keys())}")
+        if ci_by_id and lookup_log.isEnabledFor(logging.DEBUG):
+            sample_ci_id, sample_ci_data = next(iter(ci_by_id.items()))
+            lookup_log.debug("Sample CI %s has keys: %s", sample_ci_id, list(sample_ci_data.keys()))
             if 'name' in sample_ci_data:
-                print(f"DEBUG: Sample CI name: {sample_ci_data['name']} (type: {type(sample_ci_data['name'])})")
+                lookup_log.debug("Sample CI name: %s (type: %s)", sample_ci_data['name'], type(sample_ci_data['name']))
+
+        lookups_built = time.perf_counter()
+        if timings is not None:
+            timings['lookup_build'] = lookups_built - started
+        
+        # Everything scoring a CI needs besides its label
+        context = {
+            'model': self,
+            'ci_by_id': ci_by_id,
+            'audit_by_ci': audit_by_ci,
+            'user_by_name': user_by_name,
+            'user_by_sys_id': user_by_sys_id,
+            'username_to_display_name': username_to_display_name,
+            'all_user_audit_records': all_user_audit_records,
+            'profile_change_index': profile_change_index,
+            'identity_index': identity_index,
+            'activity_by_ci': activity_by_ci,
+            'ci_owner_display_names': ci_owner_display_names,
+            'scan_time': scan_time,
+            'batch': batch
+        }
+        total = len(labels_df)
+        labels = [label.to_dict() for _, label in labels_df.iterrows()]
+        sharded = workers > 1 and total >= SHARDED_MIN_CIS
+        if sharded:
+            chunks = iter_sharded(_score_shard, context, labels, workers, PREDICT_BATCH_SIZE)
+        else:
+            batch_size = PREDICT_BATCH_SIZE if batch else 1
+            chunks = (list(enumerate(labels[chunk_start:chunk_start + batch_size], chunk_start))
+                      for chunk_start in range(0, total, batch_size))
+        for chunk in chunks:
+            for scored, stale_ci in (chunk if sharded else self._score_labels(context, chunk)):
+                if progress is not None and scored % PROGRESS_INTERVAL == 0:
+                    progress(scored, total, stale_count)
+                if stale_ci is not None:
+                    stale_count += 1
+                    yield stale_ci
+
+        if progress is not None:
+            progress(total, total, stale_count)
+        if timings is not None:
+            timings['prediction'] = time.perf_counter() - lookups_built
 
-        for _, label in labels_df.iterrows():
-            # Convert label to dict to avoid pandas Series issues
-            label_dict = label.to_dict()
+    def _score_labels(self, context: Dict, items: List[Tuple[int, Dict]]) -> List[Tuple[int, Optional[Dict]]]:
+        """
+        Score the CIs of some labels (with their positions in the scan) together.
+        Returns (position, stale CI entry or None) per label.
+        """
+        chunk = []
+        for position, label_dict in items:
             ci_id = label_dict.get('ci_id')
             assigned_owner = label_dict.get('assigned_owner')
             
-            ci_info = ci_by_id.get(str(ci_id), {})
-            audit_records = audit_by_ci.get(str(ci_id), [])
-            user_info = user_by_name.get(str(assigned_owner), {})
+            ci_info = context['ci_by_id'].get(str(ci_id), {})
+            audit_records = context['audit_by_ci'].get(str(ci_id), [])
+            user_info = context['user_by_name'].get(str(assigned_owner), {})
             
-            # Debug logging for first few CIs to see CI info lookup
-            if len(stale_cis) < 3:
-                print(f"DEBUG CI Lookup {ci_id}: ci_info keys={list(ci_info.keys()) if ci_info else 'EMPTY'}")
-                if ci_info and 'name' in ci_info:
-                    print(f"DEBUG CI name field: {ci_info['name']} (type: {type(ci_info['name'])})")
+            if ci_log.isEnabledFor(logging.DEBUG):
+                ci_log.debug("CI lookup %s: ci_info keys=%s, name=%r", ci_id,
+                             list(ci_info.keys()) if ci_info else 'EMPTY', ci_info.get('name'))
             
             ci_data = {
                 'ci_info': ci_info,
                 'audit_records': audit_records,
                 'user_info': user_info,
                 'assigned_owner': assigned_owner,
-                'username_to_display_name': username_to_display_name,  # Pass the mapping
-                'user_data_context': user_by_name,  # Pass all user data for department lookup
-                'user_by_sys_id': user_by_sys_id,  # Pass sys_id mapping for better lookups
-                'all_user_audit_records': all_user_audit_records  # Pass all user audit records
+                'username_to_display_name': context['username_to_display_name'],  # Pass the mapping
+                'user_data_context': context['user_by_name'],  # Pass all user data for department lookup
+                'user_by_sys_id': context['user_by_sys_id'],  # Pass sys_id mapping for better lookups
+                'all_user_audit_records': context['all_user_audit_records'],  # Pass all user audit records
+                'profile_change_index': context['profile_change_index'],  # The same records by user sys_id
+                'identity_index': context['identity_index'],  # Canonical user IDs for owner matching
+                'scan_time': context['scan_time']  # Reference time for activity ages
             }
-            
-            result = self.predict_single(ci_data)
-            if result.get('is_stale'):
-                # Assign risk level based on confidence
-                confidence = result.get('confidence', 0)
-                if confidence > 0.9:
-                    risk_level = 'Critical'
-                elif confidence > 0.8:
-                    risk_level = 'High'
-                elif confidence > 0.7:
-                    risk_level = 'Medium'
-                else:
-                    risk_level = 'Low'
+            if context['activity_by_ci'] is not None:
+                ci_data['activity_summary'] = context['activity_by_ci'].get(str(ci_id), {})
+            chunk.append((position, ci_id, ci_data))
+        
+        ci_data_list = [ci_data for _, _, ci_data in chunk]
+        results = self.predict_batch(ci_data_list) if context['batch'] else [self.predict_single(ci_data) for ci_data in ci_data_list]
+        scored = []
+        for (position, ci_id, ci_data), result in zip(chunk, results):
+            stale_ci = self._stale_ci_entry(ci_id, ci_data, result, context['ci_owner_display_names'],
+                                            context['username_to_display_name'])
+            scored.append((position, stale_ci))
+        return scored
+
+    def _stale_ci_entry(self, ci_id, ci_data, result, ci_owner_display_names, username_to_display_name):
+        """The JSON-ready stale CI entry for a prediction result, or None if the CI isn't stale"""
+        if not result.get('is_stale'):
+            return None
+        ci_info = ci_data['ci_info']
+        assigned_owner = ci_data['assigned_owner']
+        
+        # Assign risk level based on confidence
+        confidence = result.get('confidence', 0)
+        if confidence > 0.9:
+            risk_level = 'Critical'
+        elif confidence > 0.8:
+            risk_level = 'High'
+        elif confidence > 0.7:
+            risk_level = 'Medium'
+        else:
+            risk_level = 'Low'
                 
-                # Ensure all data is JSON serializable
-                # Get the display name for the current owner - try CI mapping first, then username mapping
-                ci_mapping_result = ci_owner_display_names.get(str(ci_id))
-                username_mapping_result = username_to_display_name.get(str(assigned_owner))
-                current_owner_display_name = ci_mapping_result or username_mapping_result or str(assigned_owner)
+        # Ensure all data is JSON serializable
+        # Get the display name for the current owner - try CI mapping first, then username mapping
+        ci_mapping_result = ci_owner_display_names.get(str(ci_id))
+        username_mapping_result = username_to_display_name.get(str(assigned_owner))
+        current_owner_display_name = ci_mapping_result or username_mapping_result or str(assigned_owner)
                 
-                # Debug logging for first few CIs
-                if len(stale_cis) < 3:
-                    print(f"DEBUG CI {ci_id}: assigned_owner='{assigned_owner}', ci_mapping='{ci_mapping_result}', username_mapping='{username_mapping_result}', final='{current_owner_display_name}'")
+        ci_log.debug("CI %s: assigned_owner='%s', ci_mapping='%s', username_mapping='%s', final='%s'",
+                     ci_id, assigned_owner, ci_mapping_result, username_mapping_result, current_owner_display_name)
                 
-                # Extract CI name properly (might be a dict with display_value/value)
-                ci_name = ci_info.get('name', 'Unknown')
-                if isinstance(ci_name, dict):
-                    ci_name = ci_name.get('display_value', ci_name.get('value', 'Unknown'))
+        # Extract CI name properly (might be a dict with display_value/value)
+        ci_name = ci_info.get('name', 'Unknown')
+        if isinstance(ci_name, dict):
+            ci_name = ci_name.get('display_value', ci_name.get('value', 'Unknown'))
                 
-                # Extract CI class properly
-                ci_class = ci_info.get('sys_class_name', 'Unknown')
-                if isinstance(ci_class, dict):
-                    ci_class = ci_class.get('display_value', ci_class.get('value', 'Unknown'))
+        # Extract CI class properly
+        ci_class = ci_info.get('sys_class_name', 'Unknown')
+        if isinstance(ci_class, dict):
+            ci_class = ci_class.get('display_value', ci_class.get('value', 'Unknown'))
                 
-                # Extract CI description properly
-                ci_description = ci_info.get('short_description', '')
-                if isinstance(ci_description, dict):
-                    ci_description = ci_description.get('display_value', ci_description.get('value', ''))
+        # Extract CI description properly
+        ci_description = ci_info.get('short_description', '')
+        if isinstance(ci_description, dict):
+            ci_description = ci_description.get('display_value', ci_description.get('value', ''))
                 
-                stale_ci_dict = {
-                    'ci_id': str(ci_id),
-                    'ci_name': str(ci_name),
-                    'ci_class': str(ci_class),
-                    'ci_description': str(ci_description),
-                    'current_owner': current_owner_display_name,
-                    'current_owner_username': str(assigned_owner),  # Keep username for technical reference
-                    'confidence': float(confidence),
-                    'risk_level': str(risk_level),
-                    'staleness_reasons': [
-                        {
-                            'rule_name': str(rule.get('rule', '')),
-                            'description': str(rule.get('description', '')),
-                            'confidence': float(rule.get('confidence', 0))
-                        } for rule in result.get('triggered_rules', [])
-                    ],
-                    'recommended_owners': self._format_owner_recommendations(result.get('new_owner_recommendation')),
-                    'owner_activity_count': int(result.get('features', {}).get('owner_activity_count', 0)),
-                    'days_since_owner_activity': int(result.get('features', {}).get('days_since_owner_activity', 999)),
-                    'owner_active': bool(result.get('features', {}).get('owner_active', True)),
-                    # Enhanced change tracking information
-                    'title_changes': self._format_change_details(result.get('features', {}).get('title_changes_details', [])),
-                    'department_changes': self._format_change_details(result.get('features', {}).get('department_changes_details', [])),
-                    'owner_profile_changes': self._format_change_details(result.get('features', {}).get('owner_profile_changes_details', [])),
-                    'title_changes_count': int(result.get('features', {}).get('title_changes_count', 0)),
-                    'department_changes_count': int(result.get('features', {}).get('department_changes_count', 0)),
-                    'owner_profile_changes_count': int(result.get('features', {}).get('owner_profile_changes_count', 0))
-                }
-
-                stale_cis.append(stale_ci_dict)
+        stale_ci_dict = {
+            'ci_id': str(ci_id),
+            'ci_name': str(ci_name),
+            'ci_class': str(ci_class),
+            'ci_description': str(ci_description),
+            'current_owner': current_owner_display_name,
+            'current_owner_username': str(assigned_owner),  # Keep username for technical reference
+            'confidence': float(confidence),
+            'risk_level': str(risk_level),
+            'staleness_reasons': [
+                {
+                    'rule_name': str(rule.get('rule', '')),
+                    'description': str(rule.get('description', '')),
+                    'confidence': float(rule.get('confidence', 0))
+                } for rule in result.get('triggered_rules', [])
+            ],
+            'recommended_owners': self._format_owner_recommendations(result.get('new_owner_recommendation')),
+            'owner_activity_count': int(result.get('features', {}).get('owner_activity_count', 0)),
+            'days_since_owner_activity': int(result.get('features', {}).get('days_since_owner_activity', 999)),
+            'owner_active': bool(result.get('features', {}).get('owner_active', True)),
+            # Enhanced change tracking information
+            'title_changes': self._format_change_details(result.get('features', {}).get('title_changes_details', [])),
+            'department_changes': self._format_change_details(result.get('features', {}).get('department_changes_details', [])),
+            'owner_profile_changes': self._format_change_details(result.get('features', {}).get('owner_profile_changes_details', [])),
+            'title_changes_count': int(result.get('features', {}).get('title_changes_count', 0)),
+            'department_changes_count': int(result.get('features', {}).get('department_changes_count', 0)),
+            'owner_profile_changes_count': int(result.get('features', {}).get('owner_profile_changes_count', 0))
+        }
 
-        return stale_cis
+        return stale_ci_dict
 
     def _format_owner_recommendations(self, recommendations):
         """Format owner recommendations to be JSON serializable"""
         if not recommendations:
             return []
         
-        print(f"DEBUG _format_owner_recommendations: Input type: {type(recommendations)}")
-        print(f"DEBUG _format_owner_recommendations: Input value: {recommendations}")
-        
         # Handle both single recommendation (old format) and multiple recommendations (new format)
         if isinstance(recommendations, dict):
             # Old format - single recommendation
@@ -1097,13 +1502,12 @@ class RuleBasedStalenessDetector:
                 'fields_modified': int(recommendations.get('fields_modified', 0)),
                 'department': str(recommendations.get('department', 'Unknown'))
             }]
-            print(f"DEBUG _format_owner_recommendations: Formatted single recommendation: {formatted}")
+            recommendation_log.debug("Formatted single recommendation: %s", formatted)
             return formatted
         elif isinstance(recommendations, list):
             # New format - multiple recommendations
             formatted = []
-            for i, rec in enumerate(recommendations):
-                print(f"DEBUG _format_owner_recommendations: Processing recommendation {i}: {rec}")
+            for rec in recommendations:
                 formatted_rec = {
                     'username': str(rec.get('user', '')),
                     'user_sys_id': str(rec.get('user_sys_id', '')),
@@ -1115,12 +1519,11 @@ class RuleBasedStalenessDetector:
                     'fields_modified': int(rec.get('fields_modified', 0)),
                     'department': str(rec.get('department', 'Unknown'))
                 }
-                print(f"DEBUG _format_owner_recommendations: Formatted recommendation {i}: {formatted_rec}")
                 formatted.append(formatted_rec)
-            print(f"DEBUG _format_owner_recommendations: Final formatted list: {formatted}")
+            recommendation_log.debug("Formatted %d recommendations: %s", len(formatted), formatted)
             return formatted
         else:
-            print(f"DEBUG _format_owner_recommendations: Unknown type, returning empty list")
+            recommendation_log.debug("Unknown recommendations type %s, returning empty list", type(recommendations))
             return []
 
     def _format_change_details(self, changes):
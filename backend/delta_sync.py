@@ -0,0 +1,154 @@
+"""
+Delta sync of ServiceNow tables.
+
+Keeps a per-instance local copy of the CI, audit and user datasets together with
+high-water marks, so a rescan only has to fetch the rows that changed since the
+previous sync and merge them into the copy.
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+SYNC_STORE_DIR = os.environ.get('SYNC_STORE_DIR', '.sync_store')
+# Re-fetch a window before each watermark; covers instance timezone offsets and
+# rows committed late with an earlier timestamp (duplicates are merged by sys_id)
+SYNC_OVERLAP_HOURS = int(os.environ.get('SYNC_OVERLAP_HOURS', 24))
+# Periodic full re-download so deletions on the instance are picked up
+SYNC_FULL_REFRESH_HOURS = int(os.environ.get('SYNC_FULL_REFRESH_HOURS', 24))
+# The user profile audit fetch only looks back this far, so the local copy is pruned to match
+USER_AUDIT_RETENTION_DAYS = 90
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Timestamp each dataset's watermark tracks
+WATERMARK_FIELDS = {
+    'ci_data': 'sys_updated_on',
+    'ci_audit_data': 'sys_created_on',
+    'user_audit_data': 'sys_created_on',
+    'user_data': 'sys_updated_on'
+}
+
+
+def field_value(record, field):
+    """Get the raw value of a field that may be a {display_value, value} dict"""
+    value = record.get(field, '')
+    if isinstance(value, dict):
+        value = value.get('value', value.get('display_value', ''))
+    return str(value) if value else ''
+
+
+class DeltaSyncStore:
+    """Gzip-compressed local copies of synced datasets, one file per instance and user"""
+
+    def __init__(self, root=None):
+        self.root = root or SYNC_STORE_DIR
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _key(self, instance_url, username):
+        # ACLs differ per user, so the copy is scoped to the user as well as the instance
+        return hashlib.sha256(f"{instance_url.rstrip('/')}|{username}".encode('utf-8')).hexdigest()[:32]
+
+    def _path(self, instance_url, username):
+        return os.path.join(self.root, f"{self._key(instance_url, username)}.pkl.gz")
+
+    def lock(self, instance_url, username):
+        """Lock serializing syncs of the same instance and user"""
+        key = self._key(instance_url, username)
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def load(self, instance_url, username):
+        """Load the sync state for an instance, or None if there is no usable copy"""
+        path = self._path(instance_url, username)
+        if not os.path.exists(path):
+            return None
+        try:
+            with gzip.open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Discarding unreadable sync state {path}: {str(e)}")
+            return None
+
+    def save(self, instance_url, username, state):
+        """Atomically write the sync state for an instance"""
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(instance_url, username)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, 'wb', compresslevel=5) as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+
+def needs_full_refresh(state, now=None):
+    """Check whether the local copy is missing or due for a full re-download"""
+    if not state or not state.get('last_full_sync'):
+        return True
+    now = now or datetime.now()
+    return now - state['last_full_sync'] > timedelta(hours=SYNC_FULL_REFRESH_HOURS)
+
+
+def delta_queries(state):
+    """Build the encoded query condition selecting rows newer than each watermark"""
+    queries = {}
+    for name, field in WATERMARK_FIELDS.items():
+        watermark = state.get('watermarks', {}).get(name)
+        if not watermark:
+            continue
+        try:
+            since = datetime.strptime(watermark, DATE_FORMAT) - timedelta(hours=SYNC_OVERLAP_HOURS)
+        except ValueError:
+            continue
+        queries[name] = f"{field}>=javascript:gs.dateGenerate('{since:%Y-%m-%d}','{since:%H:%M:%S}')"
+    return queries
+
+
+def merge_delta(state, datasets, full, now=None):
+    """
+    Merge freshly fetched rows into the local copy, keyed by sys_id, and advance
+    the watermarks. A full fetch replaces the copy instead of merging into it.
+    """
+    now = now or datetime.now()
+    if full or not state:
+        state = {'tables': {}, 'watermarks': {}, 'last_full_sync': now}
+
+    for name, records in datasets.items():
+        table = state['tables'].setdefault(name, {})
+        field = WATERMARK_FIELDS.get(name)
+        watermark = state['watermarks'].get(name, '')
+        skipped = 0
+        for record in records:
+            sys_id = field_value(record, 'sys_id')
+            if not sys_id:
+                skipped += 1
+                continue
+            table[sys_id] = record
+            if field:
+                watermark = max(watermark, field_value(record, field))
+        if skipped:
+            logger.warning(f"Skipped {skipped} {name} records without a sys_id")
+        state['watermarks'][name] = watermark
+
+    # Keep the profile change window aligned with what a full fetch would return
+    cutoff = (now - timedelta(days=USER_AUDIT_RETENTION_DAYS)).strftime(DATE_FORMAT)
+    user_audit = state['tables'].get('user_audit_data', {})
+    for sys_id in [k for k, r in user_audit.items() if field_value(r, 'sys_created_on') < cutoff]:
+        del user_audit[sys_id]
+
+    state['last_sync'] = now
+    return state
+
+
+def materialize(state):
+    """Return the local copy as record lists in sys_id order, matching a full paged fetch"""
+    return {
+        name: [table[sys_id] for sys_id in sorted(table)]
+        for name, table in state['tables'].items()
+    }
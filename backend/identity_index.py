@@ -0,0 +1,80 @@
+"""
+Canonical user identities for audit users.
+
+Audit records name their user by username or by sys_id, and the same person can
+appear under username variants (mike.foster, mike.foster.xyz,
+person.f.contractor). Deciding whether an audit user is a CI's owner used to
+mean walking the whole user table and normalizing usernames for every audit
+record. The index does that once per scan: every username variant gets one
+canonical integer ID, and every sys_id maps to the usernames (with their IDs)
+of the user records listed under it, so each check is a couple of hash lookups.
+"""
+
+# Suffixes stripped (in this order) from a lowercased username to find its canonical form
+USERNAME_SUFFIXES = ('.xyz', '.contractor', '.temp', '.ext', '.admin', '.generic')
+
+
+def normalize_username(username):
+    normalized = username.lower()
+    for suffix in USERNAME_SUFFIXES:
+        if normalized.endswith(suffix):
+            normalized = normalized[:-len(suffix)]
+    return normalized
+
+
+class IdentityIndex:
+    """Canonical IDs for usernames and the users behind each sys_id"""
+
+    def __init__(self, users_by_name, users_by_sys_id):
+        """
+        users_by_name maps username -> user record and users_by_sys_id maps
+        sys_id -> user record, as the scan's user lookups do.
+        """
+        self._canonical = {}
+        self._ids = {}
+        # sys_id -> [(username, canonical ID), ...] of every user record listed under it
+        self._listed = {}
+        for username, user in users_by_name.items():
+            if isinstance(user, dict):
+                name = user.get('user_name', username)
+                try:
+                    self._listed.setdefault(user.get('sys_id', ''), []).append((name, self.canonical_id(name)))
+                except TypeError:
+                    # An unhashable sys_id can't equal an audit user
+                    pass
+        # sys_id -> (username, canonical ID) of the user record the sys_id resolves to
+        self._resolved = {}
+        for sys_id, user in users_by_sys_id.items():
+            name = user.get('user_name', '')
+            self._resolved[sys_id] = (name, self.canonical_id(name))
+
+    def canonical_id(self, username):
+        """The integer ID shared by all variants of a username, or None for an empty or non-string name"""
+        if not username or not isinstance(username, str):
+            return None
+        user_id = self._ids.get(username)
+        if user_id is None:
+            user_id = self._ids[username] = self._canonical.setdefault(normalize_username(username), len(self._canonical))
+        return user_id
+
+    def _is_owner_name(self, name, name_id, owner):
+        return name == owner or (name_id is not None and name_id == self.canonical_id(owner))
+
+    def resolves_to_owner(self, audit_user, owner, owner_sys_id):
+        """
+        Whether an audit user is the owner: the owner's username or sys_id, or a sys_id
+        whose user record has the owner's username or a variant of it
+        """
+        if audit_user == owner or audit_user == owner_sys_id:
+            return True
+        resolved = self._resolved.get(audit_user)
+        return resolved is not None and self._is_owner_name(*resolved, owner)
+
+    def lists_owner(self, audit_user, owner, owner_sys_id):
+        """
+        Like resolves_to_owner, but a sys_id counts as the owner when any user record
+        listed under it has the owner's username or a variant
+        """
+        if audit_user == owner or audit_user == owner_sys_id:
+            return True
+        return any(self._is_owner_name(name, name_id, owner) for name, name_id in self._listed.get(audit_user, ()))
@@ -0,0 +1,110 @@
+"""
+Incremental decoding of Table API response bodies.
+
+ServiceNow returns {"result": [...]}; iter_json_array_items walks the body as it
+arrives and yields each element of the result array as soon as it has been fully
+received, so only the element being parsed (plus one network chunk) is held in
+memory rather than the whole body and its decoded object tree.
+"""
+
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = _WHITESPACE + ',]}:'
+
+
+class _Buffer:
+    """Text buffer fed from a byte chunk iterator"""
+
+    def __init__(self, chunks, encoding):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read another chunk, dropping text that has already been consumed"""
+        if self.eof:
+            return False
+        self.text = self.text[self.pos:]
+        self.pos = 0
+        for chunk in self._chunks:
+            if chunk:
+                self.text += self._decoder.decode(chunk)
+                return True
+        self.text += self._decoder.decode(b'', final=True)
+        self.eof = True
+        return True
+
+    def skip_whitespace(self):
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text) or not self.fill():
+                return
+
+    def peek(self):
+        self.skip_whitespace()
+        if self.pos >= len(self.text):
+            raise ValueError('Unexpected end of JSON input')
+        return self.text[self.pos]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at position {self.pos}, found '{self.text[self.pos]}'")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value, reading more input as needed"""
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+                # A number cut off by the chunk boundary still decodes (e.g. "-1" from
+                # "-1.5"), so only accept a value once the delimiter after it is seen
+                if self.eof or (end < len(self.text) and self.text[end] in _DELIMITERS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self.fill():
+                raise ValueError('Unexpected end of JSON input')
+
+
+def iter_json_array_items(chunks, key='result', encoding='utf-8'):
+    """
+    Yield the elements of the array stored under `key` in a top-level JSON object.
+    chunks is an iterable of bytes, e.g. response.iter_content(). Yields nothing if
+    the key is absent; raises ValueError if the body is not well-formed or the value
+    under the key is not an array.
+    """
+    buf = _Buffer(chunks, encoding)
+    buf.expect('{')
+    if buf.peek() == '}':
+        return
+
+    while True:
+        name = buf.value()
+        buf.expect(':')
+        if name == key:
+            break
+        buf.value()  # skip the value of an unrelated key
+        if buf.peek() == '}':
+            return
+        buf.expect(',')
+
+    if buf.peek() != '[':
+        raise ValueError(f"'{key}' is not a JSON array")
+    buf.pos += 1
+
+    if buf.peek() == ']':
+        return
+    while True:
+        yield buf.value()
+        if buf.peek() == ']':
+            return
+        buf.expect(',')
@@ -0,0 +1,564 @@
+"""
+Local stand-in for the ServiceNow REST endpoints the backend calls.
+
+Serves a synthetic instance (see synthetic_data.py) through
+/api/now/table/<table>, /api/now/table/<table>/<sys_id> (GET and PATCH) and
+/api/now/stats/<table>, honoring sysparm_query, sysparm_fields,
+sysparm_display_value, sysparm_exclude_reference_link, sysparm_limit,
+sysparm_offset and sysparm_no_count. Latency, a page size cap and injected
+429/503 responses can be configured to load-test the backend offline:
+
+    python mock_servicenow.py --cis 100000 --audit-ratio 20 --port 8081 --latency-ms 50 --throttle-rate 0.02
+
+then point the frontend or /scan-stale-ownership at http://localhost:8081.
+"""
+
+import argparse
+import bisect
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import Flask, jsonify, request
+
+import response_compression
+from synthetic_data import CI_CLASSES, DATE_FORMAT, TABLE_FIELDS, generate_instance
+
+logger = logging.getLogger(__name__)
+
+# Reference fields: rendered with display value and link, and dot-walkable
+REFERENCE_FIELDS = {
+    ('cmdb_ci', 'assigned_to'): ('sys_user', 'sys_id')
+}
+# sys_audit.user is a plain string holding the user name, but the backend dot-walks it
+DOT_WALK_FIELDS = {
+    **REFERENCE_FIELDS,
+    ('sys_audit', 'user'): ('sys_user', 'user_name')
+}
+CHOICE_LABELS = {
+    ('cmdb_ci', 'sys_class_name'): {name: label for name, (label, _, _) in CI_CLASSES.items()}
+}
+INDEXED_FIELDS = {
+    'sys_audit': ('documentkey',),
+    'sys_user': ('user_name',)
+}
+
+DEFAULT_PAGE_SIZE = 10000
+QUERY_CACHE_SIZE = 16
+
+_CONDITION = re.compile(r'^([A-Za-z0-9_.]+?)(!=|>=|<=|NOT IN|IN|STARTSWITH|ENDSWITH|LIKE|ISNOTEMPTY|ISEMPTY|ON|=|>|<)(.*)$')
+
+
+def resolve_query_value(value, now=None):
+    """Evaluate the javascript: date helpers the backend puts in encoded queries"""
+    now = now or datetime.now()
+    m = re.fullmatch(r"javascript:gs\.daysAgoStart\((\d+)\)", value)
+    if m:
+        return (now - timedelta(days=int(m.group(1)))).strftime('%Y-%m-%d 00:00:00')
+    m = re.fullmatch(r"javascript:gs\.daysAgoEnd\((\d+)\)", value)
+    if m:
+        return (now - timedelta(days=int(m.group(1)))).strftime('%Y-%m-%d 23:59:59')
+    m = re.fullmatch(r"javascript:gs\.daysAgo\((\d+)\)", value)
+    if m:
+        return (now - timedelta(days=int(m.group(1)))).strftime(DATE_FORMAT)
+    m = re.fullmatch(r"javascript:gs\.dateGenerate\('([\d-]+)','([\d:]+)'\)", value)
+    if m:
+        return f"{m.group(1)} {m.group(2)}"
+    return value
+
+
+def parse_encoded_query(query, now=None):
+    """
+    Parse an encoded query into (groups, order_by). groups is a list of ^NQ
+    alternatives, each a list of AND-ed clauses, each a list of OR-ed
+    (field, operator, value) conditions. order_by is a list of (field, descending).
+    """
+    groups = []
+    order_by = []
+    for part in (query or '').split('^NQ'):
+        clauses = []
+        for token in part.split('^'):
+            if not token or token == 'EQ':
+                continue
+            if token.startswith('ORDERBYDESC'):
+                order_by.append((token[len('ORDERBYDESC'):], True))
+                continue
+            if token.startswith('ORDERBY'):
+                order_by.append((token[len('ORDERBY'):], False))
+                continue
+            is_or = token.startswith('OR') and clauses
+            m = _CONDITION.match(token[2:] if is_or else token)
+            if not m:
+                raise ValueError(f"Unsupported query condition: {token}")
+            field, op, value = m.groups()
+            if op == 'ON':
+                _, start, end = value.split('@')
+                condition = (field, 'BETWEEN', (resolve_query_value(start, now), resolve_query_value(end, now)))
+            elif op in ('IN', 'NOT IN'):
+                condition = (field, op, frozenset(value.split(',')))
+            else:
+                condition = (field, op, resolve_query_value(value, now))
+            if is_or:
+                clauses[-1].append(condition)
+            else:
+                clauses.append([condition])
+        if clauses:
+            groups.append(clauses)
+    return groups, order_by
+
+
+def _matcher(position, op, value):
+    """Build a row predicate for one condition"""
+    if op == '=':
+        return lambda row: row[position] == value
+    if op == '!=':
+        return lambda row: row[position] != value
+    if op == 'IN':
+        return lambda row: row[position] in value
+    if op == 'NOT IN':
+        return lambda row: row[position] not in value
+    if op == '>=':
+        return lambda row: row[position] >= value
+    if op == '<=':
+        return lambda row: row[position] <= value
+    if op == '>':
+        return lambda row: row[position] > value
+    if op == '<':
+        return lambda row: row[position] < value
+    if op == 'BETWEEN':
+        return lambda row: value[0] <= row[position] <= value[1]
+    if op == 'STARTSWITH':
+        return lambda row: row[position].startswith(value)
+    if op == 'ENDSWITH':
+        return lambda row: row[position].endswith(value)
+    if op == 'LIKE':
+        return lambda row: value.lower() in row[position].lower()
+    if op == 'ISEMPTY':
+        return lambda row: not row[position]
+    if op == 'ISNOTEMPTY':
+        return lambda row: bool(row[position])
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+def _any_of(matchers):
+    return lambda row: any(m(row) for m in matchers)
+
+
+class MockInstance:
+    """Query engine over a synthetic instance's tuple tables"""
+
+    def __init__(self, instance, base_url='http://localhost'):
+        self.instance = instance
+        self.tables = instance.tables
+        self.base_url = base_url.rstrip('/')
+        self.positions = {table: {f: i for i, f in enumerate(fields)} for table, fields in TABLE_FIELDS.items()}
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._build_indexes()
+
+    def _build_indexes(self):
+        # Rows are kept in sys_id order, so sys_id lookups and ranges use bisect
+        self.sys_ids = {table: [row[0] for row in rows] for table, rows in self.tables.items()}
+        self.indexes = {}
+        for table, fields in INDEXED_FIELDS.items():
+            for field in fields:
+                position = self.positions[table][field]
+                index = {}
+                for i, row in enumerate(self.tables[table]):
+                    index.setdefault(row[position], []).append(i)
+                self.indexes[(table, field)] = index
+
+    def _candidates(self, table, clauses):
+        """Narrow a single AND-group to candidate row numbers using the indexes"""
+        rows = self.tables[table]
+        lo, hi = 0, len(rows)
+        for clause in clauses:
+            if len(clause) != 1:
+                continue
+            field, op, value = clause[0]
+            if field == 'sys_id' and op in ('>=', '>'):
+                side = bisect.bisect_left if op == '>=' else bisect.bisect_right
+                lo = max(lo, side(self.sys_ids[table], value))
+            elif field == 'sys_id' and op in ('<', '<='):
+                side = bisect.bisect_left if op == '<' else bisect.bisect_right
+                hi = min(hi, side(self.sys_ids[table], value))
+        for clause in clauses:
+            if len(clause) != 1:
+                continue
+            field, op, value = clause[0]
+            index = self.indexes.get((table, field))
+            if index is not None and op in ('=', 'IN'):
+                keys = [value] if op == '=' else value
+                return sorted(i for key in keys for i in index.get(key, ()) if lo <= i < hi)
+        return range(lo, hi)
+
+    def select(self, table, query):
+        """Rows of a table matching an encoded query, in the requested order"""
+        key = (table, query or '')
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        groups, order_by = parse_encoded_query(query)
+        rows = self.tables[table]
+        positions = self.positions[table]
+        if not groups:
+            selected = list(rows)
+        else:
+            matched = set() if len(groups) > 1 else None
+            selected = []
+            for clauses in groups:
+                predicates = []
+                for clause in clauses:
+                    matchers = [_matcher(positions[f], op, v) for f, op, v in clause if f in positions]
+                    if len(matchers) != len(clause):
+                        # Unknown field: ServiceNow ignores the condition, so do the same
+                        continue
+                    predicates.append(matchers[0] if len(matchers) == 1 else _any_of(matchers))
+                for i in self._candidates(table, clauses):
+                    row = rows[i]
+                    if all(p(row) for p in predicates):
+                        if matched is None:
+                            selected.append(row)
+                        elif i not in matched:
+                            matched.add(i)
+                            selected.append(row)
+            if matched is not None:
+                selected.sort(key=lambda row: row[0])
+        for field, descending in reversed(order_by):
+            if field not in positions or (field == 'sys_id' and not descending):
+                continue  # rows are already in sys_id order
+            selected.sort(key=lambda row, p=positions[field]: row[p], reverse=descending)
+
+        with self._lock:
+            self._cache[key] = selected
+            while len(self._cache) > QUERY_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return selected
+
+    def find(self, table, sys_id):
+        ids = self.sys_ids[table]
+        i = bisect.bisect_left(ids, sys_id)
+        return i if i < len(ids) and ids[i] == sys_id else None
+
+    def _lookup(self, table, field, value):
+        if not value:
+            return None
+        if field == 'sys_id':
+            i = self.find(table, value)
+        else:
+            hits = self.indexes.get((table, field), {}).get(value)
+            i = hits[0] if hits else None
+        return None if i is None else self.tables[table][i]
+
+    def _display(self, table, field, value):
+        labels = CHOICE_LABELS.get((table, field))
+        if labels:
+            return labels.get(value, value)
+        return value
+
+    def render(self, table, row, fields, display_value='false', exclude_reference_link=False):
+        """Render a row the way the Table API would for the given sysparm options"""
+        positions = self.positions[table]
+        record = {}
+        for field in fields:
+            if '.' in field:
+                base, _, target_field = field.partition('.')
+                target = DOT_WALK_FIELDS.get((table, base))
+                if target is None or base not in positions:
+                    continue
+                target_row = self._lookup(target[0], target[1], row[positions[base]])
+                value = target_row[self.positions[target[0]][target_field]] if target_row and target_field in self.positions[target[0]] else ''
+                display = self._display(target[0], target_field, value)
+            elif field in positions:
+                value = row[positions[field]]
+                reference = REFERENCE_FIELDS.get((table, field))
+                if reference:
+                    target_row = self._lookup(reference[0], reference[1], value)
+                    display = target_row[self.positions[reference[0]]['name']] if target_row else ''
+                    if value and not exclude_reference_link:
+                        link = f"{self.base_url}/api/now/table/{reference[0]}/{value}"
+                        if display_value == 'all':
+                            record[field] = {'display_value': display, 'link': link, 'value': value}
+                        elif display_value == 'true':
+                            record[field] = {'display_value': display, 'link': link}
+                        else:
+                            record[field] = {'link': link, 'value': value}
+                        continue
+                else:
+                    display = self._display(table, field, value)
+            else:
+                continue
+
+            if display_value == 'all':
+                record[field] = {'display_value': display, 'value': value}
+            elif display_value == 'true':
+                record[field] = display
+            else:
+                record[field] = value
+        return record
+
+    def aggregate(self, table, query, group_by=None, count=False, min_fields=None, max_fields=None):
+        """Aggregate API: count and min/max of fields, optionally grouped"""
+        rows = self.select(table, query)
+        positions = self.positions[table]
+        group_fields = [f for f in (group_by or []) if f in positions]
+        min_fields = [f for f in (min_fields or []) if f in positions]
+        max_fields = [f for f in (max_fields or []) if f in positions]
+
+        groups = OrderedDict()
+        for row in rows:
+            key = tuple(row[positions[f]] for f in group_fields)
+            acc = groups.get(key)
+            if acc is None:
+                acc = groups[key] = {'count': 0, 'min': {}, 'max': {}}
+            acc['count'] += 1
+            for f in min_fields:
+                value = row[positions[f]]
+                if f not in acc['min'] or value < acc['min'][f]:
+                    acc['min'][f] = value
+            for f in max_fields:
+                value = row[positions[f]]
+                if f not in acc['max'] or value > acc['max'][f]:
+                    acc['max'][f] = value
+
+        def stats(acc):
+            result = {}
+            if count:
+                result['count'] = str(acc['count'])
+            if min_fields:
+                result['min'] = acc['min']
+            if max_fields:
+                result['max'] = acc['max']
+            return result
+
+        if not group_fields:
+            acc = groups.get((), {'count': 0, 'min': {}, 'max': {}})
+            return {'stats': stats(acc)}
+        return [
+            {
+                'stats': stats(acc),
+                'groupby_fields': [
+                    {'field': f, 'value': v, 'display_value': self._display(table, f, v)}
+                    for f, v in zip(group_fields, key)
+                ]
+            }
+            for key, acc in groups.items()
+        ]
+
+    def update(self, table, sys_id, changes):
+        """Apply a PATCH to a record; returns the updated row or None if it does not exist"""
+        positions = self.positions[table]
+        with self._lock:
+            i = self.find(table, sys_id)
+            if i is None:
+                return None
+            row = list(self.tables[table][i])
+            for field, value in changes.items():
+                if field in positions and field != 'sys_id':
+                    row[positions[field]] = '' if value is None else str(value)
+            if 'sys_updated_on' in positions:
+                row[positions['sys_updated_on']] = datetime.now().strftime(DATE_FORMAT)
+            self.tables[table][i] = tuple(row)
+            # Indexed values may have changed, and cached selections hold the old tuple
+            if table in INDEXED_FIELDS:
+                self._build_indexes()
+            self._cache.clear()
+            return self.tables[table][i]
+
+
+def create_app(mock, latency_ms=0, jitter_ms=0, max_page_size=None, throttle_rate=0.0, error_rate=0.0,
+               retry_after=1, username=None, password=None, seed=None, compress=False):
+    """
+    Build the Flask app serving a MockInstance. throttle_rate and error_rate are the
+    probabilities of answering 429 and 503; max_page_size caps sysparm_limit and the
+    number of grouped stats rows like the instance's row limit does; username/password, when set, are required via basic
+    auth or a JSESSIONID issued by an earlier authenticated call. With compress,
+    responses are gzip/deflate encoded when the client accepts it, as the instance does.
+    """
+    app = Flask(__name__)
+    if compress:
+        response_compression.init_app(app)
+    rng = random.Random(seed)
+    sessions = set()
+    stats = {'requests': 0, 'throttled': 0, 'errors': 0, 'rows': 0}
+    stats_lock = threading.Lock()
+
+    def error(status, message, detail=''):
+        response = jsonify({'error': {'message': message, 'detail': detail}, 'status': 'failure'})
+        response.status_code = status
+        return response
+
+    @app.before_request
+    def simulate_instance():
+        with stats_lock:
+            stats['requests'] += 1
+        if latency_ms or jitter_ms:
+            time.sleep((latency_ms + rng.uniform(0, jitter_ms)) / 1000.0)
+
+        if username is not None:
+            cookie = request.cookies.get('JSESSIONID')
+            auth = request.authorization
+            if not (cookie in sessions or (auth and auth.username == username and auth.password == password)):
+                return error(401, 'User Not Authenticated', 'Required to provide Auth information')
+
+        roll = rng.random()
+        if roll < throttle_rate:
+            with stats_lock:
+                stats['throttled'] += 1
+            response = error(429, 'Too many requests', 'Rate limit exceeded')
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        if roll < throttle_rate + error_rate:
+            with stats_lock:
+                stats['errors'] += 1
+            response = error(503, 'Service Unavailable', 'Injected failure')
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+
+    @app.after_request
+    def issue_session(response):
+        if request.authorization and 'JSESSIONID' not in request.cookies and response.status_code < 400:
+            session_id = uuid.uuid4().hex
+            sessions.add(session_id)
+            response.set_cookie('JSESSIONID', session_id)
+        return response
+
+    def requested_fields(table):
+        fields = request.args.get('sysparm_fields')
+        return fields.split(',') if fields else list(TABLE_FIELDS[table])
+
+    def render_options():
+        return {
+            'display_value': request.args.get('sysparm_display_value', 'false').lower(),
+            'exclude_reference_link': request.args.get('sysparm_exclude_reference_link', 'false').lower() == 'true'
+        }
+
+    @app.route('/api/now/table/<table>', methods=['GET'])
+    def table_list(table):
+        if table not in mock.tables:
+            return error(400, 'Invalid table', table)
+        try:
+            rows = mock.select(table, request.args.get('sysparm_query', ''))
+        except ValueError as e:
+            return error(400, 'Invalid query', str(e))
+
+        offset = int(request.args.get('sysparm_offset', 0))
+        limit = int(request.args.get('sysparm_limit', DEFAULT_PAGE_SIZE))
+        if max_page_size:
+            limit = min(limit, max_page_size)
+        page = rows[offset:offset + limit]
+
+        fields = requested_fields(table)
+        options = render_options()
+        result = [mock.render(table, row, fields, **options) for row in page]
+        with stats_lock:
+            stats['rows'] += len(result)
+
+        response = jsonify({'result': result})
+        if request.args.get('sysparm_no_count', 'false').lower() != 'true':
+            response.headers['X-Total-Count'] = str(len(rows))
+        return response
+
+    @app.route('/api/now/table/<table>/<sys_id>', methods=['GET'])
+    def table_get(table, sys_id):
+        if table not in mock.tables:
+            return error(400, 'Invalid table', table)
+        i = mock.find(table, sys_id)
+        if i is None:
+            return error(404, 'No Record found', 'Record doesn\'t exist or ACL restricts the record retrieval')
+        return jsonify({'result': mock.render(table, mock.tables[table][i], requested_fields(table), **render_options())})
+
+    @app.route('/api/now/table/<table>/<sys_id>', methods=['PATCH', 'PUT'])
+    def table_update(table, sys_id):
+        if table not in mock.tables:
+            return error(400, 'Invalid table', table)
+        changes = request.get_json(silent=True) or {}
+        row = mock.update(table, sys_id, changes)
+        if row is None:
+            return error(404, 'No Record found', 'Record doesn\'t exist or ACL restricts the record retrieval')
+        return jsonify({'result': mock.render(table, row, requested_fields(table), **render_options())})
+
+    @app.route('/api/now/stats/<table>', methods=['GET'])
+    def table_stats(table):
+        if table not in mock.tables:
+            return error(400, 'Invalid table', table)
+
+        def listed(name):
+            value = request.args.get(name)
+            return value.split(',') if value else []
+
+        try:
+            result = mock.aggregate(
+                table, request.args.get('sysparm_query', ''),
+                group_by=listed('sysparm_group_by'),
+                count=request.args.get('sysparm_count', 'false').lower() == 'true',
+                min_fields=listed('sysparm_min_fields'),
+                max_fields=listed('sysparm_max_fields')
+            )
+        except ValueError as e:
+            return error(400, 'Invalid query', str(e))
+        if max_page_size and isinstance(result, list):
+            # Grouped results are cut at the row limit too; the stats API has no paging
+            result = result[:max_page_size]
+        return jsonify({'result': result})
+
+    @app.route('/mock/stats', methods=['GET'])
+    def mock_stats():
+        """Request counters for the running mock, plus the size of the generated instance"""
+        with stats_lock:
+            counters = dict(stats)
+        return jsonify({'requests': counters, 'tables': mock.instance.counts(), 'profile': mock.instance.profile})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic ServiceNow instance for offline testing')
+    parser.add_argument('--cis', type=int, default=1000, help='Number of CIs to generate (default 1000)')
+    parser.add_argument('--audit-ratio', type=float, default=10.0, help='Average CI audit records per CI (default 10)')
+    parser.add_argument('--users', type=int, default=None, help='Number of users (default: CIs / 25, at least 20)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for data generation and fault injection')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0, help='Fixed delay added to every request')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Random extra delay of up to this many ms')
+    parser.add_argument('--max-page-size', type=int, default=None, help='Cap on sysparm_limit, like the instance row limit')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds on injected 429/503 responses')
+    parser.add_argument('--username', default=None, help='Require this user for basic auth (default: accept any)')
+    parser.add_argument('--password', default=None)
+    parser.add_argument('--compress', action='store_true', help='Compress responses for clients sending Accept-Encoding')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    started = time.perf_counter()
+    instance = generate_instance(args.cis, audit_ratio=args.audit_ratio, seed=args.seed, user_count=args.users)
+    logger.info(f"Generated {instance.counts()} in {time.perf_counter() - started:.1f}s")
+
+    mock = MockInstance(instance, base_url=f"http://{args.host}:{args.port}")
+    app = create_app(
+        mock,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        max_page_size=args.max_page_size,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        username=args.username,
+        password=args.password,
+        seed=args.seed,
+        compress=args.compress
+    )
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Index of user profile audit records.
+
+Title, department and other profile changes are audited on sys_user with the
+user's sys_id as the documentkey. Scoring a CI only needs the changes of the few
+users related to it (its owner, the users active on it, recommended owners), so
+instead of scanning every profile record per CI - and the whole user table to
+name the user of each match - the records are grouped by documentkey once per
+scan, next to a reverse map from sys_id to username.
+"""
+
+
+class ProfileChangeIndex:
+    """User profile audit records grouped by user sys_id, plus a sys_id -> username map"""
+
+    def __init__(self, profile_records, users_by_name, parse_date=None):
+        """
+        profile_records are the user profile audit records in fetch order and
+        users_by_name maps username -> user record. With parse_date, each user's
+        changes are kept oldest first.
+        """
+        self.record_count = len(profile_records)
+        self._changes = {}
+        for position, record in enumerate(profile_records):
+            self._changes.setdefault(record.get('documentkey', ''), []).append((position, record))
+        if parse_date is not None:
+            for changes in self._changes.values():
+                changes.sort(key=lambda change: parse_date(change[1].get('sys_created_on', '')))
+
+        # Where several usernames share a sys_id the first listed wins, as a scan of the user table would find
+        self.username_by_sys_id = {}
+        for username, user in users_by_name.items():
+            try:
+                self.username_by_sys_id.setdefault(user.get('sys_id'), username)
+            except TypeError:
+                # An unhashable sys_id can't equal a documentkey
+                pass
+
+    def changes(self, sys_id):
+        """Profile audit records of one user, oldest first"""
+        return [record for _, record in self._changes.get(sys_id, ())]
+
+    def changes_for(self, sys_ids):
+        """Profile audit records of any of the users, in fetch order"""
+        found = []
+        for sys_id in sys_ids:
+            found.extend(self._changes.get(sys_id, ()))
+        found.sort(key=lambda change: change[0])
+        return [record for _, record in found]
+
+    def username(self, sys_id):
+        return self.username_by_sys_id.get(sys_id)
@@ -0,0 +1,143 @@
+"""
+Negotiated gzip/deflate compression of Flask responses.
+
+Responses at or above a size threshold are compressed when the client's
+Accept-Encoding allows it. The body is compressed in slices as it is sent, so
+the compressed copy is never held in memory next to the original. Streamed
+responses are compressed as they are produced and sync-flushed once at least the
+size threshold has built up since the last flush, so a large chunk reaches the
+client at once while tiny chunks are not each padded with a flush marker.
+Server-sent event streams are never compressed: their keepalives and events are
+small, must arrive immediately, and buffering proxies hold compressed streams.
+"""
+
+import logging
+import os
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+RESPONSE_COMPRESS_LEVEL = int(os.environ.get('RESPONSE_COMPRESS_LEVEL', 6))
+
+SLICE_BYTES = 64 * 1024
+# zlib window bits: +16 writes a gzip header/trailer, plain 15 is the zlib (deflate) format
+WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/')
+UNCOMPRESSED_MIMETYPES = ('text/event-stream',)
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick gzip or deflate from an Accept-Encoding header, honouring q-values; None if neither"""
+    weights = {}
+    for part in (accept_encoding or '').split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[token] = q
+
+    best = None
+    for encoding in ('gzip', 'deflate'):
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+    return best[0] if best else None
+
+
+def _compressible(response):
+    mimetype = response.mimetype or ''
+    if any(mimetype.startswith(kind) for kind in UNCOMPRESSED_MIMETYPES):
+        return False
+    return any(mimetype.startswith(kind) for kind in COMPRESSIBLE_MIMETYPES)
+
+
+def _compress_slices(compressor, body, stats):
+    view = memoryview(body)
+    for start in range(0, len(view), SLICE_BYTES):
+        data = compressor.compress(view[start:start + SLICE_BYTES])
+        if data:
+            stats['wire'] += len(data)
+            yield data
+    data = compressor.flush()
+    stats['wire'] += len(data)
+    yield data
+
+
+def _compress_stream(compressor, chunks, stats, flush_bytes):
+    pending = 0
+    for chunk in chunks:
+        stats['raw'] += len(chunk)
+        pending += len(chunk)
+        data = compressor.compress(chunk)
+        if pending >= flush_bytes:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if data:
+            stats['wire'] += len(data)
+            yield data
+    data = compressor.flush()
+    stats['wire'] += len(data)
+    yield data
+
+
+def _logged(chunks, encoding, path, stats, started):
+    try:
+        yield from chunks
+    finally:
+        if stats['wire']:
+            logger.info(f"Compressed {path} with {encoding}: {stats['raw']} -> {stats['wire']} bytes "
+                        f"({stats['raw'] / stats['wire']:.1f}x) in {time.perf_counter() - started:.3f}s")
+
+
+def compress_response(response, request, min_bytes=None, level=None):
+    """Compress a response in place if the client accepts it and it is worth it"""
+    min_bytes = RESPONSE_COMPRESS_MIN_BYTES if min_bytes is None else min_bytes
+    level = RESPONSE_COMPRESS_LEVEL if level is None else level
+
+    if request.method == 'HEAD' or response.status_code in (204, 304) or response.status_code < 200:
+        return response
+    if response.direct_passthrough or 'Content-Encoding' in response.headers or not _compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if not encoding:
+        return response
+
+    stats = {'raw': 0, 'wire': 0}
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+    if response.is_streamed:
+        # Size is unknown up front, so streamed bodies are always compressed
+        chunks = _compress_stream(compressor, response.iter_encoded(), stats, min_bytes)
+    else:
+        body = response.get_data()
+        if len(body) < min_bytes:
+            return response
+        stats['raw'] = len(body)
+        chunks = _compress_slices(compressor, body, stats)
+        response.headers['X-Uncompressed-Length'] = str(len(body))
+
+    response.response = _logged(chunks, encoding, request.path, stats, time.perf_counter())
+    response.headers['Content-Encoding'] = encoding
+    response.headers.pop('Content-Length', None)
+    return response
+
+
+def init_app(app, min_bytes=None, level=None):
+    """Compress every eligible response of a Flask app"""
+    from flask import request
+
+    @app.after_request
+    def _compress(response):
+        return compress_response(response, request, min_bytes, level)
+
+    return app
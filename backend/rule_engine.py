@@ -0,0 +1,289 @@
+"""
+Compiled staleness rule conditions.
+
+Rule conditions are written as Python expressions over the feature names
+('owner_activity_count == 0', "'vendor' in owner_name.lower()"). Rather than
+passing each one to eval() for every CI, they are parsed once into a small
+expression tree that only allows feature names, constants, comparisons,
+and/or/not and a few string methods. A compiled condition can be evaluated two
+ways: against one CI's feature dict, or against a column of values per feature
+for many CIs at once, giving a boolean mask. Both follow eval()'s semantics: a
+condition that refers to a missing feature or raises while being evaluated
+counts as not met for that CI.
+"""
+
+import ast
+import operator
+
+import numpy as np
+import pandas as pd
+
+# Largest integer a float64 column holds exactly
+_EXACT_FLOAT_INT = 2 ** 53
+
+_COMPARE_OPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b
+}
+
+_STRING_METHODS = ('lower', 'upper', 'strip')
+
+
+class RuleCompileError(ValueError):
+    """Raised for a condition that uses anything outside the supported expression forms"""
+    pass
+
+
+class FeatureTable:
+    """
+    Feature values of many CIs, one column per feature name. Columns are built on
+    first use: numeric when every CI has a bool, int or float value, otherwise
+    object; present marks the CIs that have the feature at all.
+    """
+
+    def __init__(self, feature_dicts):
+        self.feature_dicts = feature_dicts
+        self.size = len(feature_dicts)
+        self._columns = {}
+
+    def column(self, name):
+        if name not in self._columns:
+            missing = object()
+            values = [features.get(name, missing) for features in self.feature_dicts]
+            present = np.array([value is not missing for value in values], dtype=bool)
+            types = set(map(type, values))
+            if types and types <= {bool, int, float} and (float not in types or all(
+                    type(value) is not int or abs(value) <= _EXACT_FLOAT_INT for value in values)):
+                column = np.array(values)
+                if column.dtype.kind not in 'biuf':
+                    column = _object_array(values)
+            else:
+                column = _object_array([None if value is missing else value for value in values])
+            self._columns[name] = (column, present)
+        return self._columns[name]
+
+
+def _object_array(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _is_numeric(values):
+    if isinstance(values, np.ndarray):
+        return values.dtype.kind in 'biuf'
+    return type(values) in (bool, int, float)
+
+
+def _elementwise(function, *operands, size):
+    """Apply function row by row; rows where it raises are marked invalid"""
+    arrays = [operand if isinstance(operand, np.ndarray) else [operand] * size for operand in operands]
+    results = np.empty(size, dtype=object)
+    valid = np.ones(size, dtype=bool)
+    for row, args in enumerate(zip(*arrays)):
+        try:
+            results[row] = function(*args)
+        except Exception:
+            valid[row] = False
+    return results, valid
+
+
+def _truth(values, valid, size):
+    """Truth value of each row; rows where bool() raises are marked invalid"""
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+        return values.astype(bool), valid
+    if not isinstance(values, np.ndarray):
+        return np.full(size, bool(values)), valid
+    truth, ok = _elementwise(bool, values, size=size)
+    return truth.astype(bool) & ok, valid & ok
+
+
+class _Name:
+    def __init__(self, name):
+        self.name = name
+
+    def scalar(self, features):
+        return features[self.name]
+
+    def vector(self, table):
+        return table.column(self.name)
+
+
+class _Constant:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self, features):
+        return self.value
+
+    def vector(self, table):
+        return self.value, True
+
+
+class _StringMethod:
+    def __init__(self, operand, method):
+        self.operand = operand
+        self.method = method
+
+    def scalar(self, features):
+        return getattr(self.operand.scalar(features), self.method)()
+
+    def vector(self, table):
+        values, valid = self.operand.vector(table)
+        if isinstance(values, np.ndarray) and values.dtype == object and valid is not True and valid.all() \
+                and all(type(value) is str for value in values):
+            return getattr(pd.Series(values, dtype=object).str, self.method)().to_numpy(dtype=object), valid
+        results, ok = _elementwise(lambda value: getattr(value, self.method)(), values, size=table.size)
+        return results, valid & ok
+
+
+class _Compare:
+    def __init__(self, left, ops, comparators):
+        self.left = left
+        self.ops = ops
+        self.comparators = comparators
+
+    def scalar(self, features):
+        left = self.left.scalar(features)
+        for op, comparator in zip(self.ops, self.comparators):
+            right = comparator.scalar(features)
+            result = op(left, right)
+            if not result:
+                return result
+            left = right
+        return result
+
+    def vector(self, table):
+        left, left_valid = self.left.vector(table)
+        truth = np.ones(table.size, dtype=bool)
+        valid = np.ones(table.size, dtype=bool) & left_valid
+        for op, comparator in zip(self.ops, self.comparators):
+            right, right_valid = comparator.vector(table)
+            result, ok = self._compare(op, left, right, table.size)
+            # Later links only run (and can only fail) where the chain is still true
+            pending = valid & truth
+            valid &= ~pending | (right_valid & ok)
+            truth &= result
+            left = right
+        return truth, valid
+
+    @staticmethod
+    def _compare(op, left, right, size):
+        if op not in (_COMPARE_OPS[ast.In], _COMPARE_OPS[ast.NotIn]) and _is_numeric(left) and _is_numeric(right):
+            return np.broadcast_to(op(left, right), (size,)).astype(bool), True
+        if op in (_COMPARE_OPS[ast.In], _COMPARE_OPS[ast.NotIn]) and type(left) is str \
+                and isinstance(right, np.ndarray) and right.dtype == object and all(type(value) is str for value in right):
+            found = pd.Series(right, dtype=object).str.contains(left, regex=False).to_numpy(dtype=bool)
+            return (found if op is _COMPARE_OPS[ast.In] else ~found), True
+        results, ok = _elementwise(op, left, right, size=size)
+        truth, truth_ok = _truth(results, ok, size)
+        return truth, truth_ok
+
+
+class _BoolOp:
+    def __init__(self, is_and, operands):
+        self.is_and = is_and
+        self.operands = operands
+
+    def scalar(self, features):
+        if self.is_and:
+            return all(operand.scalar(features) for operand in self.operands)
+        return any(operand.scalar(features) for operand in self.operands)
+
+    def vector(self, table):
+        truth, valid = _truth(*self.operands[0].vector(table), table.size)
+        for operand in self.operands[1:]:
+            next_truth, next_valid = _truth(*operand.vector(table), table.size)
+            # The next operand is only reached while and stays true / or stays false
+            reached = truth if self.is_and else ~truth
+            valid = valid & (~reached | next_valid)
+            truth = (truth & next_truth) if self.is_and else (truth | next_truth)
+        return truth, valid
+
+
+class _Not:
+    def __init__(self, operand):
+        self.operand = operand
+
+    def scalar(self, features):
+        return not self.operand.scalar(features)
+
+    def vector(self, table):
+        truth, valid = _truth(*self.operand.vector(table), table.size)
+        return ~truth, valid
+
+
+def _compile_node(node, source, boolean_context):
+    if isinstance(node, ast.Name):
+        return _Name(node.id)
+    if isinstance(node, ast.Constant) and type(node.value) in (bool, int, float, str, type(None)):
+        return _Constant(node.value)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in _STRING_METHODS \
+            and not node.args and not node.keywords:
+        return _StringMethod(_compile_node(node.func.value, source, False), node.func.attr)
+    if isinstance(node, ast.Compare) and all(type(op) in _COMPARE_OPS for op in node.ops):
+        return _Compare(_compile_node(node.left, source, False), [_COMPARE_OPS[type(op)] for op in node.ops],
+                        [_compile_node(comparator, source, False) for comparator in node.comparators])
+    # and/or/not yield booleans here, so they may only appear where just their truth counts
+    if boolean_context and isinstance(node, ast.BoolOp):
+        return _BoolOp(isinstance(node.op, ast.And), [_compile_node(value, source, True) for value in node.values])
+    if boolean_context and isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return _Not(_compile_node(node.operand, source, True))
+    raise RuleCompileError(f"Unsupported expression {ast.dump(node)} in rule condition: {source}")
+
+
+class Condition:
+    """One compiled rule condition"""
+
+    def __init__(self, source):
+        self.source = source
+        try:
+            tree = ast.parse(source.strip(), mode='eval')
+        except SyntaxError as e:
+            raise RuleCompileError(f"Invalid rule condition {source!r}: {e.msg}")
+        self.expression = _compile_node(tree.body, source, True)
+
+    def evaluate(self, features):
+        try:
+            return bool(self.expression.scalar(features))
+        except Exception:
+            return False
+
+    def mask(self, table):
+        truth, valid = _truth(*self.expression.vector(table), table.size)
+        return truth & valid
+
+
+class RuleSet:
+    """The compiled conditions of a rules dict, in rule order; a rule triggers when all its conditions are met"""
+
+    def __init__(self, rules):
+        self.names = list(rules)
+        self.conditions = [[Condition(source) for source in rules[name]['conditions']] for name in self.names]
+
+    def triggered(self, features):
+        """Names of the rules one CI's features trigger"""
+        return [name for name, conditions in zip(self.names, self.conditions)
+                if all(condition.evaluate(features) for condition in conditions)]
+
+    def triggered_batch(self, feature_dicts):
+        """Names of the rules each CI triggers, from one mask per condition over all the CIs"""
+        table = FeatureTable(feature_dicts)
+        matrix = np.ones((len(self.names), table.size), dtype=bool)
+        for row, conditions in enumerate(self.conditions):
+            for condition in conditions:
+                matrix[row] &= condition.mask(table)
+        # Few distinct combinations of rules occur, so name each combination once
+        patterns = np.zeros(table.size, dtype=object)
+        for row in range(len(self.names)):
+            patterns += matrix[row].astype(object) << row
+        combinations = {}
+        for pattern in set(patterns.tolist()):
+            combinations[pattern] = [name for row, name in enumerate(self.names) if pattern >> row & 1]
+        return [list(combinations[pattern]) for pattern in patterns.tolist()]
@@ -0,0 +1,259 @@
+"""
+Background scan jobs.
+
+A submitted scan runs on a bounded pool of worker processes, so a long scan
+neither holds an HTTP request open past proxy timeouts nor competes with the
+request threads for the GIL. Workers report their stage and percent complete
+over a queue that a listener thread in the server process applies to the job
+table, appending each update to the job's event log for clients following it as
+a stream (see wait_events). Finished jobs keep their result until they are older
+than the retention period or pushed out by newer finished jobs.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+SCAN_JOB_WORKERS = int(os.environ.get('SCAN_JOB_WORKERS', 2))
+# Jobs waiting for a free worker beyond this are rejected
+SCAN_JOB_MAX_PENDING = int(os.environ.get('SCAN_JOB_MAX_PENDING', 20))
+SCAN_JOB_RETENTION_SECONDS = int(os.environ.get('SCAN_JOB_RETENTION_SECONDS', 3600))
+SCAN_JOB_MAX_FINISHED = int(os.environ.get('SCAN_JOB_MAX_FINISHED', 20))
+# Progress events kept per job for clients that (re)connect late; each is a full snapshot
+MAX_EVENTS_PER_JOB = 200
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+# Set in each worker process by the pool initializer
+_progress_queue = None
+
+
+class TooManyJobsError(Exception):
+    """Raised when the pending job limit is reached"""
+    pass
+
+
+def _init_worker(queue):
+    global _progress_queue
+    _progress_queue = queue
+
+
+def _run_job(run, job_id, params):
+    """Worker process entry point: run(params, progress) with progress sent back to the server"""
+    def progress(stage, percent, **details):
+        _progress_queue.put((job_id, stage, percent, details))
+
+    return run(params, progress)
+
+
+class ScanJob:
+    """State of one submitted scan"""
+
+    def __init__(self, job_id, key=None, credential=None):
+        self.id = job_id
+        # Identical submissions (same key) made while this job is unfinished share it
+        self.key = key
+        self.credential = credential
+        self.state = QUEUED
+        self.stage = QUEUED
+        self.percent = 0.0
+        self.details = {}
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.status_code = None
+        self.error = None
+        self.events = deque(maxlen=MAX_EVENTS_PER_JOB)
+        self.last_event_id = 0
+
+    def add_event(self, event_type):
+        self.last_event_id += 1
+        self.events.append({'id': self.last_event_id, 'event': event_type, 'data': self.as_dict()})
+
+    @property
+    def done(self):
+        return self.state in (SUCCEEDED, FAILED)
+
+    def as_dict(self):
+        def iso(ts):
+            return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(ts)) if ts else None
+
+        return {
+            'job_id': self.id,
+            'state': self.state,
+            'stage': self.stage,
+            'percent': round(self.percent, 1),
+            'details': self.details,
+            'created_at': iso(self.created),
+            'started_at': iso(self.started),
+            'finished_at': iso(self.finished),
+            'error': self.error
+        }
+
+
+class ScanJobManager:
+    """Submit scans to a process pool and track their progress and results"""
+
+    def __init__(self, run, workers=None, max_pending=None, retention_seconds=None, max_finished=None, on_result=None):
+        self.run = run
+        # Called as on_result(job) in the server process when a job succeeds, before it is marked done
+        self.on_result = on_result
+        self.workers = workers or SCAN_JOB_WORKERS
+        self.max_pending = SCAN_JOB_MAX_PENDING if max_pending is None else max_pending
+        self.retention_seconds = SCAN_JOB_RETENTION_SECONDS if retention_seconds is None else retention_seconds
+        self.max_finished = SCAN_JOB_MAX_FINISHED if max_finished is None else max_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._executor = None
+
+    def _pool(self):
+        # Created on first use; spawned workers start from a clean interpreter rather
+        # than a fork of a server that may be holding locks in other threads
+        if self._executor is None:
+            context = multiprocessing.get_context('spawn')
+            queue = context.Queue()
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                                 initializer=_init_worker, initargs=(queue,))
+            threading.Thread(target=self._listen, args=(queue,), name='scan-job-progress', daemon=True).start()
+        return self._executor
+
+    def _listen(self, queue):
+        """Apply progress messages from the workers to the job table"""
+        while True:
+            try:
+                job_id, stage, percent, details = queue.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.done:
+                    continue
+                if job.state == QUEUED:
+                    job.state = RUNNING
+                    job.started = time.time()
+                job.stage = stage
+                job.percent = percent
+                job.details = details
+                job.add_event('progress')
+                self._changed.notify_all()
+
+    def _active(self, key):
+        for job in self._jobs.values():
+            if job.key == key and not job.done:
+                return job
+        return None
+
+    def submit(self, params, key=None, credential=None, authorize=None):
+        """
+        Queue a scan and return (job, shared); raises TooManyJobsError when the queue
+        is full. With a key, an unfinished job submitted under the same key is
+        returned instead of queueing another (shared is True) - straight away for the
+        same credential, otherwise once authorize() has confirmed the caller's own.
+        """
+        self.evict()
+        authorized = False
+        if key is not None and authorize is not None:
+            with self._lock:
+                job = self._active(key)
+            if job is not None and job.credential != credential:
+                authorized = authorize()
+
+        with self._lock:
+            # Looked up again: the job may have finished while authorize() ran
+            job = self._active(key) if key is not None else None
+            if job is not None and (job.credential == credential or authorized):
+                logger.info(f"Attached to in-flight scan job {job.id}")
+                return job, True
+            pending = sum(1 for job in self._jobs.values() if job.state == QUEUED)
+            if pending >= self.max_pending:
+                raise TooManyJobsError(f"{pending} scan jobs are already waiting for a worker")
+            job = ScanJob(uuid.uuid4().hex, key, credential)
+            job.add_event('progress')
+            self._jobs[job.id] = job
+            future = self._pool().submit(_run_job, self.run, job.id, params)
+        future.add_done_callback(lambda f: self._finish(job, f))
+        logger.info(f"Queued scan job {job.id}")
+        return job, False
+
+    def _finish(self, job, future):
+        try:
+            result, status_code = future.result()
+            error = result.get('error') if status_code >= 400 else None
+            if not error and self.on_result is not None:
+                job.result = result
+                self.on_result(job)
+        except BrokenProcessPool as e:
+            result, status_code, error = None, 500, f"Scan worker exited unexpectedly: {str(e) or 'process killed'}"
+            with self._lock:
+                # A broken pool accepts no more work; the next submit starts a new one
+                self._executor = None
+        except Exception as e:
+            result, status_code, error = None, 500, f"Scan failed: {str(e)}"
+
+        with self._lock:
+            job.result = result
+            job.status_code = status_code
+            job.error = error
+            job.state = FAILED if error else SUCCEEDED
+            job.stage = 'done'
+            job.percent = 100.0
+            job.started = job.started or time.time()
+            job.finished = time.time()
+            job.add_event('done')
+            self._changed.notify_all()
+        logger.info(f"Scan job {job.id} {job.state} in {job.finished - job.created:.1f}s")
+
+    def get(self, job_id):
+        self.evict()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait_events(self, job_id, after=0, timeout=None):
+        """
+        Wait until the job has events newer than the event ID after, or it has finished,
+        or timeout passes. Returns (events, done); events is None if the job is unknown.
+        """
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None, True
+            self._changed.wait_for(lambda: job.last_event_id > after or job.done, timeout)
+            return [event for event in job.events if event['id'] > after], job.done
+
+    def counts(self):
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.state] += 1
+            return counts
+
+    def evict(self):
+        """Drop finished jobs past the retention period, then the oldest beyond max_finished"""
+        now = time.time()
+        with self._lock:
+            finished = sorted((job for job in self._jobs.values() if job.done), key=lambda job: job.finished)
+            expired = [job for job in finished if now - job.finished > self.retention_seconds]
+            kept = [job for job in finished if now - job.finished <= self.retention_seconds]
+            if len(kept) > self.max_finished:
+                expired.extend(kept[:len(kept) - self.max_finished])
+            for job in expired:
+                del self._jobs[job.id]
+        if expired:
+            logger.info(f"Evicted {len(expired)} finished scan jobs")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
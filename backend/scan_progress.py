@@ -0,0 +1,126 @@
+"""
+Progress accounting for a running scan.
+
+Collects the pages and records fetched per table (against the row counts
+ServiceNow reports in X-Total-Count), the records normalized for the model and
+the CIs scored so far, and turns them into a percent complete, throughput and
+an ETA for the current stage. Every update is passed on as a full snapshot to a
+callback - in a scan job, the queue back to the server process.
+"""
+
+import threading
+import time
+
+# Share of the overall percent each stage accounts for
+FETCH_SHARE = 60.0
+NORMALIZE_SHARE = 5.0
+SCORING_SHARE = 30.0
+
+
+class ScanProgress:
+    """Running totals for one scan, reported as progress(stage, percent, **details)"""
+
+    def __init__(self, progress=None):
+        self.progress = progress
+        # Pages arrive from several fetch threads at once
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stage = 'fetching'
+        self.stage_started = self.started
+        self.tables = {}
+        self.records_normalized = 0
+        self.cis_scored = 0
+        self.cis_total = 0
+        self.stale_found = 0
+        self.percent = 0.0
+        self.eta_seconds = None
+
+    def _elapsed(self):
+        return time.perf_counter() - self.stage_started
+
+    def _eta(self, done, total):
+        # Straight-line estimate from the rate so far in this stage
+        if not done or not total or done >= total:
+            return None
+        return round(self._elapsed() * (total - done) / done, 1)
+
+    def _table(self, name):
+        return self.tables.setdefault(name, {'pages': 0, 'records': 0, 'total': None, 'done': False})
+
+    def set_stage(self, stage, percent):
+        with self._lock:
+            self.stage = stage
+            self.stage_started = time.perf_counter()
+            self.percent = percent
+            self.eta_seconds = None
+            self._report()
+
+    def start_fetch(self, names):
+        """Declare the datasets being fetched, so percent complete covers all of them"""
+        with self._lock:
+            for name in names:
+                self._table(name)
+            self._report()
+
+    def table_page(self, name, pages, records, total):
+        """A page of a table was read; total is the expected row count if the server sent one"""
+        with self._lock:
+            self._table(name).update(pages=pages, records=records, total=total)
+            self._update_fetch()
+
+    def table_fetched(self, name, records):
+        with self._lock:
+            self._table(name).update(records=records, done=True)
+            self._update_fetch()
+
+    def _update_fetch(self):
+        fractions = []
+        fetched = expected = 0
+        for table in self.tables.values():
+            if table['done']:
+                fractions.append(1.0)
+            elif table['total']:
+                fractions.append(min(table['records'] / table['total'], 1.0))
+            else:
+                fractions.append(0.0)
+            if table['total'] is not None:
+                fetched += min(table['records'], table['total'])
+                expected += table['total']
+        self.percent = FETCH_SHARE * sum(fractions) / len(fractions) if fractions else 0.0
+        self.eta_seconds = self._eta(fetched, expected)
+        self._report()
+
+    def normalized(self, records):
+        with self._lock:
+            self.records_normalized = records
+            self.percent = FETCH_SHARE + NORMALIZE_SHARE
+            self._report()
+
+    def scored(self, scored, total, stale):
+        with self._lock:
+            if scored == 0:
+                # Rates count from the first CI, not from building the lookups before it
+                self.stage_started = time.perf_counter()
+            self.cis_scored = scored
+            self.cis_total = total
+            self.stale_found = stale
+            self.percent = FETCH_SHARE + NORMALIZE_SHARE + (SCORING_SHARE * scored / total if total else SCORING_SHARE)
+            self.eta_seconds = self._eta(scored, total)
+            self._report()
+
+    def snapshot(self):
+        elapsed = self._elapsed()
+        return {
+            'tables': {name: dict(table) for name, table in self.tables.items()},
+            'records_normalized': self.records_normalized,
+            'cis_scored': self.cis_scored,
+            'cis_total': self.cis_total,
+            'cis_per_second': round(self.cis_scored / elapsed, 1) if self.stage == 'scoring' and elapsed > 0 else None,
+            'stale_found': self.stale_found,
+            'elapsed_seconds': round(time.perf_counter() - self.started, 1),
+            'eta_seconds': self.eta_seconds
+        }
+
+    def _report(self):
+        if self.progress is not None:
+            self.progress(self.stage, round(self.percent, 1), **self.snapshot())
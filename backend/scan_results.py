@@ -0,0 +1,294 @@
+"""
+Retained scan results with indexed queries.
+
+The stale CIs of a finished scan are kept in memory under a result ID and
+indexed so the frontend can ask for one filtered, sorted page at a time instead
+of downloading every stale CI and filtering in the browser. Each filterable
+field has an inverted index (value -> positions), confidence has a sorted index
+for range filters, and each sort order is a precomputed permutation of the
+results, built the first time it is asked for. A page is found by intersecting
+the filter indexes and walking the permutation from the cursor, so its cost
+depends on the page size and the filters rather than on the size of the scan.
+
+A streamed scan indexes each stale CI as it is scored and retains the index
+once the scan ends. Cursors are opaque tokens holding the sort position of the
+last row returned. Results never change once retained, so a cursor stays valid
+for as long as its result does.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SCAN_RESULT_RETENTION_SECONDS = int(os.environ.get('SCAN_RESULT_RETENTION_SECONDS', 3600))
+SCAN_RESULT_MAX = int(os.environ.get('SCAN_RESULT_MAX', 10))
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Filter combinations whose matches are kept per result, so paging through one costs only the page
+MATCH_CACHE_SIZE = 16
+
+RISK_ORDER = {'Critical': 4, 'High': 3, 'Medium': 2, 'Low': 1}
+
+# Sort keys, matching the sort options of the results table
+SORT_KEYS = {
+    'confidence': lambda ci: ci.get('confidence') or 0,
+    'risk': lambda ci: RISK_ORDER.get(ci.get('risk_level'), 0),
+    'name': lambda ci: (ci.get('ci_name') or '').lower(),
+    'date': lambda ci: 999 if ci.get('days_since_owner_activity') is None else ci['days_since_owner_activity'],
+    'profile_changes': lambda ci: ((ci.get('title_changes_count') or 0) + (ci.get('department_changes_count') or 0)
+                                   + (ci.get('owner_profile_changes_count') or 0))
+}
+
+
+def _recommended_owner(ci):
+    owners = ci.get('recommended_owners') or []
+    return owners[0].get('username') if owners else None
+
+
+# Filterable fields: name -> the values a CI is indexed under
+FILTER_FIELDS = {
+    'risk_level': lambda ci: [ci.get('risk_level')],
+    'ci_class': lambda ci: [ci.get('ci_class')],
+    'rule': lambda ci: {reason.get('rule_name') for reason in ci.get('staleness_reasons') or []},
+    'owner': lambda ci: [ci.get('current_owner_username')],
+    'recommended_owner': lambda ci: [_recommended_owner(ci)]
+}
+
+
+class InvalidQueryError(ValueError):
+    """Raised for unknown sort keys, bad ranges or a cursor that doesn't belong to the query"""
+    pass
+
+
+class ScanResultIndex:
+    """Indexes over the stale CIs of one scan"""
+
+    def __init__(self, result_id, stale_cis=()):
+        self.id = result_id
+        self.items = []
+        self.created = time.time()
+        self.last_used = self.created
+        self.fields = {name: {} for name in FILTER_FIELDS}
+        for ci in stale_cis:
+            self.append(ci)
+
+        # (sort key, order) -> (positions in sort order, rank of each position)
+        self._orders = {}
+        self._matches = OrderedDict()
+        self._confidence = None
+        self._lock = threading.Lock()
+
+    def append(self, ci):
+        """Index one more stale CI; only done before the result is retained"""
+        position = len(self.items)
+        self.items.append(ci)
+        for name, values_of in FILTER_FIELDS.items():
+            for value in values_of(ci):
+                if value is not None:
+                    self.fields[name].setdefault(value, array('I')).append(position)
+
+    def _confidence_index(self):
+        """(positions sorted by confidence, their confidences), built the first time a range is asked for"""
+        with self._lock:
+            if self._confidence is None:
+                items = self.items
+                by_confidence = sorted(range(len(items)), key=lambda i: items[i].get('confidence') or 0)
+                self._confidence = (array('I', by_confidence), [items[i].get('confidence') or 0 for i in by_confidence])
+            return self._confidence
+
+    def _order(self, sort, order):
+        with self._lock:
+            cached = self._orders.get((sort, order))
+            if cached is None:
+                key = SORT_KEYS[sort]
+                keys = [key(ci) for ci in self.items]
+                # Stable in both directions: ties keep scan order
+                positions = array('I', sorted(range(len(keys)), key=keys.__getitem__, reverse=(order == 'desc')))
+                ranks = array('I', bytes(4 * len(positions)))
+                for rank, position in enumerate(positions):
+                    ranks[position] = rank
+                cached = self._orders[(sort, order)] = (positions, ranks)
+            return cached
+
+    def facets(self):
+        """Number of stale CIs per value of each filterable field"""
+        return {name: {value: len(positions) for value, positions in values.items()}
+                for name, values in self.fields.items()}
+
+    def _candidates(self, filters, min_confidence, max_confidence):
+        """Set of positions matching every filter, or None when nothing is filtered"""
+        key = (tuple(sorted((name, tuple(sorted(map(str, values)))) for name, values in filters.items())),
+               min_confidence, max_confidence)
+        with self._lock:
+            if key in self._matches:
+                self._matches.move_to_end(key)
+                return self._matches[key]
+        candidates = self._match(filters, min_confidence, max_confidence)
+        with self._lock:
+            self._matches[key] = candidates
+            while len(self._matches) > MATCH_CACHE_SIZE:
+                self._matches.popitem(last=False)
+        return candidates
+
+    def _match(self, filters, min_confidence, max_confidence):
+        sets = []
+        for name, values in filters.items():
+            index = self.fields[name]
+            matches = [index[value] for value in values if value in index]
+            sets.append(set().union(*matches) if matches else set())
+
+        if min_confidence is not None or max_confidence is not None:
+            confidence_positions, confidence_values = self._confidence_index()
+            start = 0 if min_confidence is None else bisect_left(confidence_values, min_confidence)
+            end = len(confidence_values) if max_confidence is None else bisect_right(confidence_values, max_confidence)
+            if start > 0 or end < len(confidence_values):
+                sets.append(set(confidence_positions[start:end]))
+
+        if not sets:
+            return None
+        sets.sort(key=len)
+        candidates = sets[0]
+        for other in sets[1:]:
+            candidates = candidates.intersection(other)
+        return candidates
+
+    def query(self, filters=None, min_confidence=None, max_confidence=None, sort='confidence', order='desc',
+              limit=DEFAULT_PAGE_SIZE, cursor=None):
+        """
+        One page of stale CIs. filters maps a FILTER_FIELDS name to the values to
+        accept (any of them); fields are combined with AND. Returns a dict with the
+        items, the total number of matches and the cursor for the next page (None on
+        the last page).
+        """
+        filters = {name: list(values) for name, values in (filters or {}).items() if values}
+        unknown = set(filters) - set(FILTER_FIELDS)
+        if unknown:
+            raise InvalidQueryError(f"Unknown filter: {', '.join(sorted(unknown))}")
+        if sort not in SORT_KEYS:
+            raise InvalidQueryError(f"Unknown sort key: {sort}")
+        if order not in ('asc', 'desc'):
+            raise InvalidQueryError(f"Unknown sort order: {order}")
+        if min_confidence is not None and max_confidence is not None and min_confidence > max_confidence:
+            raise InvalidQueryError('min_confidence is greater than max_confidence')
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        self.last_used = time.time()
+        fingerprint = self._fingerprint(filters, min_confidence, max_confidence, sort, order)
+        after = -1 if cursor is None else decode_cursor(cursor, fingerprint)
+
+        positions, ranks = self._order(sort, order)
+        candidates = self._candidates(filters, min_confidence, max_confidence)
+        if candidates is None:
+            total = len(positions)
+            page = positions[after + 1:after + 1 + limit]
+            last_rank = after + len(page)
+            has_more = last_rank + 1 < total
+        elif len(candidates) * 8 >= len(positions):
+            # Dense match: walking the sort order hits a match every few rows
+            total = len(candidates)
+            page = []
+            last_rank = after
+            has_more = False
+            for rank in range(after + 1, len(positions)):
+                if positions[rank] in candidates:
+                    if len(page) == limit:
+                        has_more = True
+                        break
+                    page.append(positions[rank])
+                    last_rank = rank
+        else:
+            # Sparse match: order just the matches by their rank
+            total = len(candidates)
+            matched = sorted(ranks[position] for position in candidates)
+            start = bisect_right(matched, after)
+            page_ranks = matched[start:start + limit]
+            page = [positions[rank] for rank in page_ranks]
+            last_rank = page_ranks[-1] if page_ranks else after
+            has_more = start + limit < len(matched)
+
+        return {
+            'result_id': self.id,
+            'items': [self.items[position] for position in page],
+            'total': total,
+            'limit': limit,
+            'sort': sort,
+            'order': order,
+            'next_cursor': encode_cursor(last_rank, fingerprint) if has_more else None
+        }
+
+    def _fingerprint(self, filters, min_confidence, max_confidence, sort, order):
+        query = {'result': self.id, 'filters': {name: sorted(map(str, values)) for name, values in filters.items()},
+                 'min': min_confidence, 'max': max_confidence, 'sort': sort, 'order': order}
+        return hashlib.sha256(json.dumps(query, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def encode_cursor(after, fingerprint):
+    token = json.dumps({'a': after, 'q': fingerprint}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(token).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, fingerprint):
+    """Sort position a cursor continues after; raises InvalidQueryError if it belongs to another query"""
+    try:
+        token = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        after, query = int(token['a']), token['q']
+    except Exception:
+        raise InvalidQueryError('Malformed cursor')
+    if query != fingerprint:
+        raise InvalidQueryError('Cursor does not belong to this query; start again without a cursor')
+    return after
+
+
+class ScanResultStore:
+    """Retained, indexed scan results, dropped by age and then least recent use"""
+
+    def __init__(self, retention_seconds=None, max_results=None):
+        self.retention_seconds = SCAN_RESULT_RETENTION_SECONDS if retention_seconds is None else retention_seconds
+        self.max_results = SCAN_RESULT_MAX if max_results is None else max_results
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def add(self, stale_cis, result_id=None):
+        """Index and retain the stale CIs of a scan; returns the result ID"""
+        return self.retain(self.new_index(result_id, stale_cis))
+
+    def new_index(self, result_id=None, stale_cis=()):
+        """An index to append a scan's stale CIs to as they arrive, then retain"""
+        return ScanResultIndex(result_id or uuid.uuid4().hex, stale_cis)
+
+    def retain(self, index):
+        """Keep a finished index for queries; returns its result ID"""
+        with self._lock:
+            self._results[index.id] = index
+        logger.info(f"Retained scan result {index.id}: {len(index.items)} stale CIs")
+        self.evict()
+        return index.id
+
+    def get(self, result_id):
+        self.evict()
+        with self._lock:
+            return self._results.get(result_id)
+
+    def evict(self):
+        now = time.time()
+        with self._lock:
+            results = sorted(self._results.values(), key=lambda index: index.last_used)
+            expired = [index for index in results if now - index.created > self.retention_seconds]
+            kept = [index for index in results if now - index.created <= self.retention_seconds]
+            if len(kept) > self.max_results:
+                expired.extend(kept[:len(kept) - self.max_results])
+            for index in expired:
+                del self._results[index.id]
+        if expired:
+            logger.info(f"Evicted {len(expired)} retained scan results")
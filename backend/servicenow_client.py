@@ -0,0 +1,256 @@
+"""
+Pooled, keep-alive ServiceNow HTTP client.
+
+Sessions are kept per (instance, user, credential) with a sized connection pool,
+so repeated calls reuse TCP/TLS connections. Once an instance has issued a
+JSESSIONID cookie, requests are sent on that session without basic auth, which
+skips the per-request credential check on the server; a 401 falls back to basic
+auth and starts a fresh session. A session is shared by every thread calling
+with the same credentials, and is only evicted (by idleness or the session cap)
+while no request is being sent on it. Responses are requested gzip/deflate
+encoded and decoded as they stream in (iter_body), counting bytes on the wire.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.environ.get('SERVICENOW_POOL_SIZE', 16))
+SESSION_IDLE_SECONDS = int(os.environ.get('SERVICENOW_SESSION_IDLE_SECONDS', 300))
+MAX_SESSIONS = int(os.environ.get('SERVICENOW_MAX_SESSIONS', 32))
+
+SESSION_COOKIE = 'JSESSIONID'
+# ServiceNow compresses JSON bodies when asked; iter_body decodes them as they stream in
+ACCEPT_ENCODING = 'gzip, deflate'
+# Link speed used to estimate the transfer time compression saves
+COMPRESSION_REFERENCE_MBPS = float(os.environ.get('COMPRESSION_REFERENCE_MBPS', 100))
+
+
+def _retry_strategy():
+    return Retry(
+        total=3,  # number of retries
+        backoff_factor=1,  # wait 1, 2, 4 seconds between retries
+        status_forcelist=[408, 429, 500, 502, 503, 504]  # HTTP status codes to retry on
+    )
+
+
+class _PooledSession:
+    """A requests session plus bookkeeping for eviction: when it was last used and how many requests are using it"""
+
+    def __init__(self, pool_size):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=_retry_strategy())
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        self.last_used = time.monotonic()
+        self.active = 0
+
+    def has_session_cookie(self):
+        return SESSION_COOKIE in self.session.cookies
+
+    def close(self):
+        self.session.close()
+
+
+class TransferStats:
+    """
+    Bytes received on the wire versus after decompression, across a set of responses,
+    plus the Table API pages read. on_page, when given, is called with the stats
+    after every page.
+    """
+
+    def __init__(self, on_page=None):
+        self._lock = threading.Lock()
+        self.responses = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self.encodings = {}
+        self.pages = 0
+        self.records = 0
+        # Sum of X-Total-Count over the queries paged so far; None until one reports it
+        self.total_count = None
+        self.on_page = on_page
+
+    def record(self, encoding, wire_bytes, decoded_bytes):
+        """Account for one fully read response body"""
+        with self._lock:
+            self.responses += 1
+            self.wire_bytes += wire_bytes
+            self.decoded_bytes += decoded_bytes
+            self.encodings[encoding] = self.encodings.get(encoding, 0) + 1
+
+    def record_page(self, records, total_count=None, first_page=False):
+        """Account for one Table API page; total_count is the query's X-Total-Count"""
+        with self._lock:
+            self.pages += 1
+            self.records += records
+            if first_page and total_count is not None:
+                self.total_count = (self.total_count or 0) + total_count
+        if self.on_page is not None:
+            self.on_page(self)
+
+    def merge(self, other):
+        with self._lock:
+            self.responses += other.responses
+            self.wire_bytes += other.wire_bytes
+            self.decoded_bytes += other.decoded_bytes
+            for encoding, count in other.encodings.items():
+                self.encodings[encoding] = self.encodings.get(encoding, 0) + count
+
+    def as_dict(self):
+        saved = max(self.decoded_bytes - self.wire_bytes, 0)
+        return {
+            'responses': self.responses,
+            'wire_bytes': self.wire_bytes,
+            'decoded_bytes': self.decoded_bytes,
+            'compression_ratio': round(self.decoded_bytes / self.wire_bytes, 2) if self.wire_bytes else None,
+            'estimated_seconds_saved': round(saved * 8 / (COMPRESSION_REFERENCE_MBPS * 1000000), 3),
+            'encodings': dict(self.encodings)
+        }
+
+
+def _decompressor(encoding):
+    if encoding == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        # Accepts both zlib-wrapped deflate and the gzip format some servers send instead
+        return zlib.decompressobj(32 + zlib.MAX_WBITS)
+    return None
+
+
+def iter_body(response, chunk_size, transfer_stats=None):
+    """
+    Yield the decoded body of a streamed response chunk by chunk. gzip and deflate
+    bodies are read off the wire undecoded and inflated here, so transfer_stats
+    sees both the compressed and the decoded size. Decoding errors raise ValueError.
+    """
+    encoding = response.headers.get('Content-Encoding', 'identity').strip().lower()
+    decompressor = _decompressor(encoding)
+    wire_bytes = decoded_bytes = 0
+    try:
+        if decompressor is None:
+            # Identity, or an encoding only urllib3 knows how to decode
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                wire_bytes += len(chunk)
+                decoded_bytes += len(chunk)
+                yield chunk
+            return
+        for wire_chunk in response.raw.stream(chunk_size, decode_content=False):
+            wire_bytes += len(wire_chunk)
+            chunk = decompressor.decompress(wire_chunk)
+            if chunk:
+                decoded_bytes += len(chunk)
+                yield chunk
+        chunk = decompressor.flush()
+        if chunk:
+            decoded_bytes += len(chunk)
+            yield chunk
+    except zlib.error as e:
+        raise ValueError(f"Invalid {encoding} body: {str(e)}")
+    finally:
+        if transfer_stats is not None:
+            transfer_stats.record(encoding, wire_bytes, decoded_bytes)
+
+
+def credential_key(username, password):
+    """Digest identifying a username/password pair without keeping the password"""
+    return hashlib.sha256(f"{username}\0{password}".encode('utf-8')).hexdigest()
+
+
+class ServiceNowClient:
+    """Shared entry point for every call the backend makes to ServiceNow"""
+
+    def __init__(self, pool_size=None, idle_seconds=None, max_sessions=None):
+        self.pool_size = pool_size or POOL_SIZE
+        self.idle_seconds = idle_seconds or SESSION_IDLE_SECONDS
+        self.max_sessions = max_sessions or MAX_SESSIONS
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, instance_url, username, password):
+        # The password is part of the key so a cached session cookie is never
+        # handed to a caller presenting different credentials
+        return (instance_url.rstrip('/'), username, credential_key(username, password))
+
+    def _acquire(self, instance_url, username, password):
+        key = self._key(instance_url, username, password)
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for other_key, pooled in list(self._sessions.items()):
+                if not pooled.active and now - pooled.last_used > self.idle_seconds:
+                    evicted.append(self._sessions.pop(other_key))
+
+            pooled = self._sessions.get(key)
+            if pooled is None:
+                pooled = _PooledSession(self.pool_size)
+                self._sessions[key] = pooled
+            self._sessions.move_to_end(key)
+            pooled.last_used = now
+            pooled.active += 1
+
+            # Least recently used first; sessions with a request in progress are skipped,
+            # so the cap can be exceeded while every session is busy
+            excess = len(self._sessions) - self.max_sessions
+            for other_key, other in list(self._sessions.items()):
+                if excess <= 0:
+                    break
+                if not other.active:
+                    evicted.append(self._sessions.pop(other_key))
+                    excess -= 1
+
+        for stale in evicted:
+            stale.close()
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} idle ServiceNow sessions")
+        return pooled
+
+    def _release(self, pooled):
+        with self._lock:
+            pooled.active -= 1
+            pooled.last_used = time.monotonic()
+
+    def request(self, method, instance_url, username, password, url, **kwargs):
+        """
+        Send a request on the pooled session for these credentials. The session
+        counts as in use until the response headers are in; a streamed body read
+        after that keeps its connection even if the session is evicted meanwhile.
+        """
+        pooled = self._acquire(instance_url, username, password)
+        try:
+            if pooled.has_session_cookie():
+                response = pooled.session.request(method, url, **kwargs)
+                if response.status_code != 401:
+                    return response
+                # Session expired on the server - drop it and authenticate again
+                response.close()
+                pooled.session.cookies.clear()
+
+            return pooled.session.request(method, url, auth=(username, password), **kwargs)
+        finally:
+            self._release(pooled)
+
+    def get(self, instance_url, username, password, url, **kwargs):
+        return self.request('GET', instance_url, username, password, url, **kwargs)
+
+    def patch(self, instance_url, username, password, url, **kwargs):
+        return self.request('PATCH', instance_url, username, password, url, **kwargs)
+
+    def close(self):
+        """Close every pooled session"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for pooled in sessions:
+            pooled.close()
@@ -0,0 +1,88 @@
+"""
+Sharded CI scoring on a process pool.
+
+Scoring is CPU-bound Python, so a scan scores on one core however many the host
+has. In sharded mode each chunk of CIs is split into shards by a hash of the
+ci_id and the shards are scored by a pool of worker processes. The lookups every
+shard needs (audit records by CI, the user tables, the profile change and
+identity indexes) are pickled once into a shared memory block that each worker
+loads when it starts, so a task carries only the labels of its CIs rather than
+its own pickled copy of the scan's data. Each shard returns its results with
+their position in the label list and a chunk's shards are merged back into that
+order, so the output is the same as scoring the CIs one after another.
+"""
+
+import logging
+import multiprocessing
+import pickle
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+logger = logging.getLogger(__name__)
+
+# Set in each worker process by the pool initializer: (score, context)
+_shared = None
+
+
+def shard_of(ci_id, shards):
+    """The shard a CI falls in; crc32 rather than hash() so the split is the same in every run"""
+    return zlib.crc32(str(ci_id).encode('utf-8')) % shards
+
+
+def _init_worker(block_name, size):
+    global _shared
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        _shared = pickle.loads(block.buf[:size])
+    finally:
+        block.close()
+
+
+def _score_shard(items):
+    """Worker process entry point: score(context, items) with the scan's shared score and context"""
+    score, context = _shared
+    return score(context, items)
+
+
+def iter_sharded(score, context, labels, workers, chunk_size):
+    """
+    Score labels chunk_size at a time on a pool of workers processes, each chunk
+    split into one shard per worker by the labels' ci_id. score is a module-level
+    function called in the workers as score(context, [(position, label), ...]) and
+    returning a list of (position, result); context is everything it needs besides
+    the labels, published to the workers once through shared memory.
+    Yields each chunk's (position, result) pairs in position order, chunk by chunk.
+    """
+    payload = pickle.dumps((score, context), protocol=pickle.HIGHEST_PROTOCOL)
+    size = len(payload)
+    block = shared_memory.SharedMemory(create=True, size=size)
+    executor = None
+    try:
+        block.buf[:size] = payload
+        del payload
+        # Spawned like the scan job workers: a fork could inherit locks held by the server's other threads
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(block.name, size))
+        logger.info(f"Scoring {len(labels)} CIs in up to {workers} shards per chunk")
+
+        # Every chunk is queued up front; the workers run ahead while earlier chunks are consumed
+        chunks = []
+        for chunk_start in range(0, len(labels), chunk_size):
+            shards = [[] for _ in range(workers)]
+            for position in range(chunk_start, min(chunk_start + chunk_size, len(labels))):
+                label = labels[position]
+                shards[shard_of(label.get('ci_id'), workers)].append((position, label))
+            chunks.append([executor.submit(_score_shard, shard) for shard in shards if shard])
+
+        for futures in chunks:
+            merged = []
+            for future in futures:
+                merged.extend(future.result())
+            merged.sort(key=lambda scored: scored[0])
+            yield merged
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        block.close()
+        block.unlink()
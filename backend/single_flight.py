@@ -0,0 +1,71 @@
+"""
+Coalescing of concurrent identical calls.
+
+The first caller for a key runs the work; callers that arrive with the same key
+while it is running wait for it and get the same result (or exception) instead
+of repeating it. Each call carries an opaque credential: a caller presenting a
+different credential from the one that started the work attaches only once its
+own authorize() check passes, and otherwise runs the work itself so it fails or
+succeeds on its own credentials.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self, credential):
+        self.credential = credential
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Run fn() at most once at a time per key, sharing its outcome with concurrent callers"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, credential=None, authorize=None):
+        """
+        Return (result, shared): shared is True when the result came from another
+        caller's run. authorize() is called, outside the lock, only when attaching to
+        a run started with a different credential; a falsy answer makes this caller
+        run fn() on its own.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call(credential)
+                leader = True
+            else:
+                leader = False
+
+        if leader:
+            try:
+                call.result = fn()
+                return call.result, False
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.credential != credential and (authorize is None or not authorize()):
+            logger.info("Not sharing an in-flight call with an unverified caller")
+            return fn(), False
+
+        with self._lock:
+            call.waiters += 1
+        logger.info(f"Joined an in-flight call ({call.waiters} callers waiting on it)")
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result, True
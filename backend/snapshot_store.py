@@ -0,0 +1,226 @@
+"""
+On-disk snapshots of fetched ServiceNow tables.
+
+A scan's datasets are written column by column (string columns dictionary-encoded,
+{display_value, value} objects split into one sub-column per key) and gzip
+compressed, keyed by instance, user and the fetch parameters. A write to an
+instance invalidates the snapshots of every user of it. A repeat scan
+within the TTL loads the snapshot instead of calling ServiceNow. The directory
+is kept under a size cap by evicting the least recently used snapshots.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', '.snapshots')
+# Snapshots older than this are not reused; 0 disables the snapshot cache
+SNAPSHOT_TTL_SECONDS = int(os.environ.get('SNAPSHOT_TTL_SECONDS', 300))
+SNAPSHOT_MAX_MB = int(os.environ.get('SNAPSHOT_MAX_MB', 1024))
+
+FORMAT_VERSION = 1
+SUFFIX = '.snap.gz'
+
+
+def _encode_values(values):
+    """Encode one column; values holds only the rows where the field is present"""
+    if values and all(type(v) is dict for v in values):
+        keys = tuple(values[0])
+        if all(tuple(v) == keys for v in values):
+            return {'kind': 'struct', 'keys': keys,
+                    'children': {k: _encode_values([v[k] for v in values]) for k in keys}}
+    if values and all(type(v) is str for v in values):
+        codes = {}
+        for v in values:
+            codes.setdefault(v, len(codes))
+        if len(codes) <= len(values) // 2:
+            return {'kind': 'dictionary', 'values': list(codes),
+                    'codes': array('I', [codes[v] for v in values]).tobytes()}
+    return {'kind': 'plain', 'values': values}
+
+
+def _decode_values(column):
+    kind = column['kind']
+    if kind == 'struct':
+        keys = column['keys']
+        children = [_decode_values(column['children'][k]) for k in keys]
+        return [dict(zip(keys, items)) for items in zip(*children)] if children else []
+    if kind == 'dictionary':
+        codes = array('I')
+        codes.frombytes(column['codes'])
+        values = column['values']
+        return [values[c] for c in codes]
+    return column['values']
+
+
+def encode_table(records):
+    """Turn a list of records into a columnar table"""
+    fields = {}
+    for record in records:
+        for field in record:
+            fields.setdefault(field, None)
+
+    columns = {}
+    for field in fields:
+        missing = []
+        values = []
+        for i, record in enumerate(records):
+            if field in record:
+                values.append(record[field])
+            else:
+                missing.append(i)
+        columns[field] = {'missing': missing, 'data': _encode_values(values)}
+    return {'rows': len(records), 'fields': list(fields), 'columns': columns}
+
+
+def decode_table(table):
+    """Rebuild the list of records from a columnar table"""
+    rows = table['rows']
+    records = [{} for _ in range(rows)]
+    for field in table['fields']:
+        column = table['columns'][field]
+        values = iter(_decode_values(column['data']))
+        missing = set(column['missing'])
+        for i, record in enumerate(records):
+            if i not in missing:
+                record[field] = next(values)
+    return records
+
+
+class SnapshotStore:
+    """Compressed columnar snapshots with TTL expiry and a total size cap"""
+
+    def __init__(self, root=None, ttl_seconds=None, max_bytes=None):
+        self.root = root or SNAPSHOT_DIR
+        self.ttl_seconds = SNAPSHOT_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_bytes = max_bytes if max_bytes is not None else SNAPSHOT_MAX_MB * 1024 * 1024
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl_seconds > 0
+
+    def _instance_prefix(self, instance_url):
+        return hashlib.sha256(instance_url.rstrip('/').encode('utf-8')).hexdigest()[:16] + '-'
+
+    def _path(self, instance_url, username, params):
+        # ACLs differ per user, so snapshots are scoped to the user as well as the instance
+        user_key = hashlib.sha256(username.encode('utf-8')).hexdigest()[:16]
+        params_key = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.root, f"{self._instance_prefix(instance_url)}{user_key}-{params_key}{SUFFIX}")
+
+    def _expired(self, created, now=None):
+        return (now or time.time()) - created > self.ttl_seconds
+
+    def load(self, instance_url, username, params):
+        """Return (datasets, info) for a fresh snapshot, or None"""
+        if not self.enabled:
+            return None
+        path = self._path(instance_url, username, params)
+        try:
+            created = os.path.getmtime(path)
+        except OSError:
+            return None
+        if self._expired(created):
+            return None
+
+        started = time.perf_counter()
+        try:
+            with gzip.open(path, 'rb') as f:
+                snapshot = pickle.load(f)
+            if snapshot.get('version') != FORMAT_VERSION:
+                return None
+            datasets = {name: decode_table(table) for name, table in snapshot['tables'].items()}
+        except Exception as e:
+            logger.warning(f"Discarding unreadable snapshot {path}: {str(e)}")
+            return None
+
+        # Record the access for LRU eviction; mtime keeps the creation time for the TTL
+        try:
+            os.utime(path, (time.time(), created))
+        except OSError:
+            pass
+        info = {
+            'hit': True,
+            'age_seconds': round(time.time() - created, 1),
+            'bytes': os.path.getsize(path),
+            'load_seconds': round(time.perf_counter() - started, 3)
+        }
+        logger.info(f"Loaded snapshot {os.path.basename(path)} ({info['bytes']} bytes, {info['age_seconds']}s old)")
+        return datasets, info
+
+    def save(self, instance_url, username, params, datasets):
+        """Write a snapshot of the datasets and enforce the size cap; returns info about it"""
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(instance_url, username, params)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        snapshot = {
+            'version': FORMAT_VERSION,
+            'params': params,
+            'tables': {name: encode_table(records) for name, records in datasets.items()}
+        }
+        with gzip.open(tmp_path, 'wb', compresslevel=5) as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        self.evict()
+        info = {'hit': False, 'bytes': size, 'save_seconds': round(time.perf_counter() - started, 3)}
+        logger.info(f"Saved snapshot {os.path.basename(path)} ({size} bytes)")
+        return info
+
+    def invalidate(self, instance_url):
+        """Drop every user's snapshots of an instance, e.g. after writing to the instance"""
+        prefix = self._instance_prefix(instance_url)
+        removed = 0
+        with self._lock:
+            for name in self._list():
+                if name.startswith(prefix):
+                    self._remove(name)
+                    removed += 1
+        if removed:
+            logger.info(f"Invalidated {removed} snapshots for {instance_url}")
+
+    def evict(self):
+        """Remove expired snapshots, then least recently used ones until under the size cap"""
+        now = time.time()
+        with self._lock:
+            entries = []
+            for name in self._list():
+                try:
+                    stat = os.stat(os.path.join(self.root, name))
+                except OSError:
+                    continue
+                if self._expired(stat.st_mtime, now):
+                    self._remove(name)
+                else:
+                    entries.append((stat.st_atime, stat.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(name)
+                total -= size
+
+    def _list(self):
+        try:
+            return [name for name in os.listdir(self.root) if name.endswith(SUFFIX)]
+        except OSError:
+            return []
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.root, name))
+        except OSError:
+            pass
@@ -0,0 +1,221 @@
+"""
+Seeded synthetic CMDB generator.
+
+Builds sys_user, cmdb_ci, sys_audit and sys_db_object tables that look like a
+real instance: active employees, terminated owners who still hold CIs, vendor
+and generic/service accounts, CI change history spread over two years and
+recent title/department changes on user profiles. The same seed always yields
+the same data, so runs against the mock server or the benchmarks are comparable.
+
+Rows are stored as tuples (see TABLE_FIELDS) sorted by sys_id, which keeps a
+million-CI instance within a few GB of memory.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+TABLE_FIELDS = {
+    'sys_user': ('sys_id', 'user_name', 'name', 'email', 'active', 'title', 'department', 'sys_created_on', 'sys_updated_on'),
+    'cmdb_ci': ('sys_id', 'name', 'short_description', 'sys_class_name', 'assigned_to', 'sys_created_on', 'sys_updated_on'),
+    'sys_audit': ('sys_id', 'sys_created_on', 'tablename', 'fieldname', 'documentkey', 'user', 'oldvalue', 'newvalue'),
+    'sys_db_object': ('sys_id', 'name', 'label')
+}
+
+CI_CLASSES = {
+    'cmdb_ci_linux_server': ('Linux Server', 'lnx', 30),
+    'cmdb_ci_win_server': ('Windows Server', 'win', 25),
+    'cmdb_ci_server': ('Server', 'srv', 20),
+    'cmdb_ci_computer': ('Computer', 'pc', 20),
+    'cmdb_ci': ('Configuration Item', 'ci', 5)
+}
+
+FIRST_NAMES = ['Alex', 'Jordan', 'Sam', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn',
+               'Priya', 'Wei', 'Fatima', 'Diego', 'Olga', 'Kenji', 'Amara', 'Lars', 'Noor', 'Mateo']
+LAST_NAMES = ['Smith', 'Garcia', 'Chen', 'Patel', 'Kowalski', 'Okafor', 'Nguyen', 'Müller', 'Silva', 'Haddad',
+              'Johansson', 'Kim', 'Rossi', 'Dubois', 'Novak', 'Tanaka', 'Mensah', 'Ivanova', 'Brown', 'Lopez']
+DEPARTMENTS = ['IT Operations', 'Infrastructure', 'Network Engineering', 'Database Administration', 'Security',
+               'Application Support', 'Cloud Platform', 'Service Desk', 'Finance IT', 'HR Systems']
+TITLES = ['Systems Administrator', 'Senior Systems Engineer', 'Network Engineer', 'DBA', 'Site Reliability Engineer',
+          'IT Manager', 'Support Analyst', 'Cloud Architect', 'Security Engineer', 'Team Lead']
+VENDORS = ['acme', 'globex', 'initech', 'umbrella', 'stark']
+
+# Accounts that appear in audit history without being a person
+GENERIC_ACCOUNTS = [
+    ('admin', 'System Administrator'),
+    ('system', 'System'),
+    ('discovery', 'Discovery'),
+    ('integration.user', 'Integration User'),
+    ('svc_cmdb_sync', 'CMDB Sync Service'),
+    ('hr.integration', 'HR Integration')
+]
+
+HUMAN_CI_FIELDS = ['assigned_to', 'managed_by', 'support_group', 'state', 'short_description', 'name', 'comments', 'install_status']
+DISCOVERY_CI_FIELDS = ['os_version', 'ip_address', 'ram', 'cpu_count', 'serial_number']
+PROFILE_FIELDS = ['title', 'department', 'manager']
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+HISTORY_DAYS = 730
+
+
+class SyntheticInstance:
+    """Generated tables plus the facts behind them (who is terminated, vendor, generic)"""
+
+    def __init__(self, tables, now, seed, profile):
+        self.tables = tables
+        self.now = now
+        self.seed = seed
+        self.profile = profile
+
+    def field_index(self, table):
+        return {field: i for i, field in enumerate(TABLE_FIELDS[table])}
+
+    def records(self, table):
+        """Yield the rows of a table as plain {field: value} dicts"""
+        fields = TABLE_FIELDS[table]
+        for row in self.tables[table]:
+            yield dict(zip(fields, row))
+
+    def counts(self):
+        return {name: len(rows) for name, rows in self.tables.items()}
+
+
+def generate_instance(ci_count, audit_ratio=10.0, seed=0, now=None, user_count=None, profile_change_rate=0.15):
+    """
+    Generate a synthetic instance with ci_count CIs and on average audit_ratio CI
+    audit records per CI. now anchors every timestamp and defaults to the start of
+    the current day, so the same seed reproduces the same data within a day.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    user_count = user_count or max(20, ci_count // 25)
+
+    def new_sys_id():
+        return '%032x' % rng.getrandbits(128)
+
+    def timestamp(days_ago):
+        return (now - timedelta(seconds=int(days_ago * 86400))).strftime(DATE_FORMAT)
+
+    # Users: mostly employees, some terminated, some vendor contractors
+    users = []
+    employees, terminated, vendors = [], [], []
+    terminated_days_ago = {}
+    for i in range(user_count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        kind = rng.random()
+        sys_id = new_sys_id()
+        created = timestamp(rng.uniform(HISTORY_DAYS, HISTORY_DAYS * 3))
+        if kind < 0.08:
+            user_name = f"{first}.{last}{i}".lower()
+            department = rng.choice(DEPARTMENTS)
+            active = 'false'
+            left = rng.uniform(1, HISTORY_DAYS)
+            terminated_days_ago[user_name] = left
+            terminated.append(user_name)
+            updated = timestamp(left)
+        elif kind < 0.12:
+            vendor = rng.choice(VENDORS)
+            user_name = f"vnd.{vendor}.{first}{i}".lower()
+            department = 'Vendor Management'
+            active = 'true'
+            vendors.append(user_name)
+            updated = timestamp(rng.uniform(0, HISTORY_DAYS))
+        else:
+            user_name = f"{first}.{last}{i}".lower()
+            department = rng.choice(DEPARTMENTS)
+            active = 'true'
+            employees.append(user_name)
+            updated = timestamp(rng.uniform(0, HISTORY_DAYS))
+        users.append((sys_id, user_name, f"{first} {last}", f"{user_name}@example.com", active,
+                      rng.choice(TITLES), department, created, updated))
+    for user_name, name in GENERIC_ACCOUNTS:
+        users.append((new_sys_id(), user_name, name, '', 'true', '', '', timestamp(HISTORY_DAYS * 3), timestamp(HISTORY_DAYS)))
+
+    user_sys_id = {u[1]: u[0] for u in users}
+    generic_names = [name for name, _ in GENERIC_ACCOUNTS]
+    employees = employees or [generic_names[0]]
+
+    # CIs and their change history
+    class_names = list(CI_CLASSES)
+    class_weights = [CI_CLASSES[c][2] for c in class_names]
+    cis = []
+    audits = []
+    for i in range(ci_count):
+        ci_sys_id = new_sys_id()
+        ci_class = rng.choices(class_names, class_weights)[0]
+        label, prefix, _ = CI_CLASSES[ci_class]
+
+        r = rng.random()
+        if r < 0.05:
+            owner = ''
+        elif r < 0.15 and terminated:
+            owner = rng.choice(terminated)
+        elif r < 0.20 and vendors:
+            owner = rng.choice(vendors)
+        elif r < 0.23:
+            owner = rng.choice(generic_names)
+        else:
+            owner = rng.choice(employees)
+
+        created_days_ago = rng.uniform(30, HISTORY_DAYS * 2)
+        cis.append((ci_sys_id, f"{prefix}-{i:07d}", f"{label} {prefix}-{i:07d}", ci_class,
+                    user_sys_id.get(owner, ''), timestamp(created_days_ago), timestamp(rng.uniform(0, min(created_days_ago, 365)))))
+
+        # The people who actually work on this CI
+        team = rng.sample(employees, min(len(employees), rng.randint(1, 4)))
+        owner_left = terminated_days_ago.get(owner)
+        events = int(rng.expovariate(1.0 / audit_ratio) + 0.5) if audit_ratio > 0 else 0
+        for _ in range(events):
+            days_ago = rng.uniform(0, min(created_days_ago, HISTORY_DAYS))
+            r = rng.random()
+            if owner and r < 0.45 and (owner_left is None or days_ago > owner_left):
+                actor = owner
+            elif r < 0.85:
+                actor = rng.choice(team)
+            else:
+                actor = rng.choice(generic_names[:4])
+
+            if actor == 'discovery' or actor == 'svc_cmdb_sync':
+                fieldname = rng.choice(DISCOVERY_CI_FIELDS)
+            else:
+                fieldname = rng.choice(HUMAN_CI_FIELDS)
+            if fieldname == 'assigned_to':
+                oldvalue, newvalue = user_sys_id.get(owner, ''), user_sys_id[rng.choice(team)]
+            else:
+                oldvalue, newvalue = f"{fieldname}-{rng.randint(1, 50)}", f"{fieldname}-{rng.randint(1, 50)}"
+            audits.append((new_sys_id(), timestamp(days_ago), ci_class, fieldname, ci_sys_id, actor, oldvalue, newvalue))
+
+    # User profile changes: title/department moves and recent terminations
+    for user in users:
+        sys_id, user_name = user[0], user[1]
+        if user_name in generic_names:
+            continue
+        if rng.random() < profile_change_rate:
+            for _ in range(rng.randint(1, 3)):
+                fieldname = rng.choice(PROFILE_FIELDS)
+                if fieldname == 'title':
+                    oldvalue, newvalue = rng.choice(TITLES), rng.choice(TITLES)
+                elif fieldname == 'department':
+                    oldvalue, newvalue = rng.choice(DEPARTMENTS), rng.choice(DEPARTMENTS)
+                else:
+                    oldvalue, newvalue = user_sys_id[rng.choice(employees)], user_sys_id[rng.choice(employees)]
+                audits.append((new_sys_id(), timestamp(rng.uniform(0, 90)), 'sys_user', fieldname, sys_id,
+                               rng.choice(['admin', 'hr.integration']), oldvalue, newvalue))
+        left = terminated_days_ago.get(user_name)
+        if left is not None and left <= 90:
+            audits.append((new_sys_id(), timestamp(left), 'sys_user', 'active', sys_id, 'hr.integration', 'true', 'false'))
+
+    classes = [(new_sys_id(), name, label) for name, (label, _, _) in CI_CLASSES.items()]
+
+    tables = {
+        'sys_user': sorted(users),
+        'cmdb_ci': sorted(cis),
+        'sys_audit': sorted(audits),
+        'sys_db_object': sorted(classes)
+    }
+    profile = {
+        'terminated': len(terminated),
+        'vendors': len(vendors),
+        'employees': len(employees),
+        'generic_accounts': len(GENERIC_ACCOUNTS)
+    }
+    return SyntheticInstance(tables, now, seed, profile)
@@ -0,0 +1,252 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+import pytest
+from werkzeug.serving import make_server
+
+import app
+from compact_payload import expand_compact_datasets
+from delta_sync import DeltaSyncStore
+from mock_servicenow import MockInstance, create_app
+from synthetic_data import generate_instance
+
+NOW = datetime(2024, 6, 1)
+
+
+@pytest.fixture(scope='module')
+def mock():
+    # Anchored to today, so relative windows such as the 90-day profile changes hold rows
+    return MockInstance(generate_instance(150, audit_ratio=6, seed=4))
+
+
+@pytest.fixture
+def serve(mock):
+    """Start a mock ServiceNow server (the shared instance unless one is given); returns its URL"""
+    servers = []
+
+    def serve(instance=None, **options):
+        server = make_server('127.0.0.1', 0, create_app(instance or mock, **options), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}'
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def value(field):
+    return field.get('value', '') if isinstance(field, dict) else field
+
+
+def owned_ci_ids(url):
+    return app.owned_ci_ids(app.fetch_ci_data(url, 'u', 'p'))
+
+
+def test_sys_id_ranges_cover_the_keyspace():
+    for partitions in (1, 3, 16, 256, 1000):
+        ranges = app.sys_id_ranges(partitions)
+        assert len(ranges) == min(partitions, 256)
+        assert ranges[0][0] is None and ranges[-1][1] is None
+        # Each range starts where the previous one ends
+        assert all(upper == lower for (_, upper), (lower, _) in zip(ranges, ranges[1:]))
+    assert app.sys_id_ranges(0) == [(None, None)]
+
+
+def test_partitioned_fetch_matches_a_plain_paged_fetch(serve, monkeypatch):
+    url = serve()
+    monkeypatch.setattr(app, 'PAGE_SIZE', 17)
+    plain = list(app.fetch_ci_audit_records(url, 'u', 'p', partitions=1))
+    assert len(plain) > 17 * 3
+    assert [value(r['sys_id']) for r in plain] == sorted(value(r['sys_id']) for r in plain)
+    for partitions in (2, 7):
+        assert list(app.fetch_ci_audit_records(url, 'u', 'p', partitions=partitions)) == plain
+        assert list(app.fetch_ci_audit_records(url, 'u', 'p', limit=50, partitions=partitions)) == plain[:50]
+
+
+def test_aggregates_match_the_raw_audit_rows(serve):
+    url = serve()
+    ci_ids = owned_ci_ids(url)
+    expected = {}
+    for record in app.fetch_ci_audit_records_for_cis(url, 'u', 'p', ci_ids):
+        key = (value(record['documentkey']), value(record['user']), value(record['fieldname']))
+        created = value(record['sys_created_on'])
+        count, first, last = expected.get(key, (0, created, created))
+        expected[key] = (count + 1, min(first, created), max(last, created))
+
+    rows = app.fetch_ci_audit_aggregates(url, 'u', 'p', ci_ids)
+    assert {(r['documentkey'], r['user'], r['fieldname']): (r['count'], r['first_activity'], r['last_activity'])
+            for r in rows} == expected
+    assert len(rows) == len(expected)
+    assert all(0 <= r['recent_count'] <= r['count'] for r in rows)
+
+
+def test_aggregate_chunks_at_the_row_limit_are_split(serve, monkeypatch):
+    ci_ids = owned_ci_ids(serve())
+    expected = app.fetch_ci_audit_aggregates(serve(), 'u', 'p', ci_ids)
+    # The instance cuts grouped results at its row limit; each chunk holds far more groups
+    monkeypatch.setattr(app, 'AUDIT_AGGREGATE_MAX_GROUPS', 40)
+    limited = app.fetch_ci_audit_aggregates(serve(max_page_size=40), 'u', 'p', ci_ids)
+    key = lambda r: (r['documentkey'], r['user'], r['fieldname'])
+    assert sorted(limited, key=key) == sorted(expected, key=key)
+
+
+def test_aggregate_failure_is_raised_and_reported(serve, monkeypatch):
+    url = serve()
+    ci_ids = owned_ci_ids(url)
+    with pytest.raises(app.ServiceNowFetchError):
+        app.fetch_ci_audit_aggregates(url + '/missing', 'u', 'p', ci_ids)
+
+    # A CI whose groups fill a whole response fails instead of coming back silently truncated
+    monkeypatch.setattr(app, 'AUDIT_AGGREGATE_MAX_GROUPS', 1)
+    datasets, fetch_stats = app.fetch_scan_datasets(url, 'u', 'p', audit_mode='aggregate')
+    assert datasets['ci_activity_data'] == []
+    assert 'group limit' in fetch_stats['ci_activity_data']['error']
+
+
+def test_sync_merges_deltas_and_keeps_the_copy_when_a_fetch_fails(serve, monkeypatch, tmp_path):
+    instance = MockInstance(generate_instance(60, audit_ratio=4, seed=2, now=NOW))
+    url = serve(instance)
+    monkeypatch.setattr(app, 'sync_store', DeltaSyncStore(root=str(tmp_path)))
+
+    datasets, _, info = app.sync_scan_datasets(url, 'u', 'p')
+    assert info['mode'] == 'full' and info['saved']
+    ci = datasets['ci_data'][0]
+    instance.update('cmdb_ci', value(ci['sys_id']), {'name': 'renamed'})
+
+    datasets, _, info = app.sync_scan_datasets(url, 'u', 'p')
+    assert info['mode'] == 'delta' and info['saved']
+    # Only the renamed CI and rows in the overlap window before the watermark are fetched again
+    assert 1 <= info['fetched']['ci_data'] < 60
+    assert value(datasets['ci_data'][0]['name']) == 'renamed'
+    assert len(datasets['ci_data']) == 60
+    state = app.sync_store.load(url, 'u')
+
+    def failing(*args, **kwargs):
+        raise app.ServiceNowFetchError('sys_audit page at offset 0 returned 403')
+
+    monkeypatch.setattr(app, 'fetch_ci_audit_records', failing)
+    for full in (False, True):
+        monkeypatch.setattr(app, 'needs_full_refresh', lambda state: full)
+        failed, fetch_stats, info = app.sync_scan_datasets(url, 'u', 'p')
+        assert info['mode'] == ('full' if full else 'delta')
+        assert not info['saved'] and 'ci_audit_data' in info['failed']
+        assert fetch_stats['ci_audit_data']['error']
+        # Neither the copy nor its watermarks move, and the scan gets the unchanged copy
+        assert app.sync_store.load(url, 'u') == state
+        assert failed == datasets
+
+
+def test_concurrent_fetch_returns_each_dataset_like_a_plain_fetch(serve):
+    url = serve()
+    datasets, fetch_stats = app.fetch_scan_datasets(url, 'u', 'p')
+    assert datasets == {
+        'ci_data': list(app.fetch_ci_data(url, 'u', 'p')),
+        'ci_audit_data': list(app.fetch_ci_audit_records(url, 'u', 'p')),
+        'user_audit_data': list(app.fetch_user_audit_records(url, 'u', 'p')),
+        'user_data': list(app.fetch_user_data(url, 'u', 'p'))
+    }
+    for name, records in datasets.items():
+        assert records
+        assert fetch_stats[name]['records'] == len(records)
+        assert fetch_stats[name]['error'] is None and not fetch_stats[name]['cancelled']
+    assert app.failed_fetches(fetch_stats) == []
+
+
+def test_failed_fetch_is_isolated(serve, monkeypatch):
+    url = serve()
+
+    def failing(*args, **kwargs):
+        raise app.ServiceNowFetchError('sys_audit page at offset 0 returned 403')
+
+    monkeypatch.setattr(app, 'fetch_user_audit_records', failing)
+    datasets, fetch_stats = app.fetch_scan_datasets(url, 'u', 'p')
+    assert datasets['user_audit_data'] == []
+    assert fetch_stats['user_audit_data']['error'] == 'sys_audit page at offset 0 returned 403'
+    assert app.failed_fetches(fetch_stats) == ['user_audit_data']
+    assert datasets['ci_data'] == list(app.fetch_ci_data(url, 'u', 'p'))
+    assert datasets['ci_audit_data'] and datasets['user_data']
+
+
+def test_empty_required_dataset_cancels_the_other_fetches(serve, monkeypatch):
+    # Slow, small pages, so the audit fetch is still paging when the CI fetch comes back empty
+    url = serve(latency_ms=30)
+    monkeypatch.setattr(app, 'PAGE_SIZE', 10)
+    datasets, fetch_stats = app.fetch_scan_datasets(url, 'u', 'p', queries={'ci_data': 'name=no such ci'})
+    assert datasets['ci_data'] == []
+    assert datasets['ci_audit_data'] == []
+    assert fetch_stats['ci_audit_data']['cancelled'] and fetch_stats['ci_audit_data']['error'] is None
+    assert 'ci_audit_data' in app.failed_fetches(fetch_stats)
+
+
+def test_plan_keeps_every_url_under_the_limit():
+    url = 'https://dev.service-now.com/api/now/table/sys_audit'
+    params = {'sysparm_fields': app.CI_AUDIT_FIELDS, 'sysparm_display_value': 'all', 'sysparm_query': app.CI_AUDIT_QUERY}
+    ci_ids = {'%032x' % (i * 7919) for i in range(500)}
+    queries = app.plan_ci_audit_queries(url, params, ci_ids, lookback_days=30, max_url_length=2000)
+    assert len(queries) > 1
+
+    prefix = app.and_query(app.CI_AUDIT_QUERY, app.lookback_condition(30)) + '^documentkeyIN'
+    planned = []
+    for query in queries:
+        page_params = dict(params, sysparm_query=query + '^ORDERBYsys_id', sysparm_limit=10000, sysparm_offset=1000000)
+        assert len(url) + 1 + len(urlencode(page_params)) <= 2000
+        assert query.startswith(prefix)
+        planned.extend(query[len(prefix):].split(','))
+    assert planned == sorted(ci_ids)
+
+
+def test_filtered_fetch_matches_filtering_a_plain_fetch(serve, monkeypatch, caplog):
+    url = serve()
+    # Only owned CIs have history on the mock, so ask for half of them
+    ci_ids = set(sorted(owned_ci_ids(url))[::2])
+    plain = list(app.fetch_ci_audit_records(url, 'u', 'p'))
+    expected = [r for r in plain if value(r['documentkey']) in ci_ids]
+    assert 0 < len(expected) < len(plain)
+
+    # A short URL limit splits the owned CIs over several concurrent queries
+    monkeypatch.setattr(app, 'AUDIT_MAX_URL_LENGTH', 2500)
+    with caplog.at_level(logging.INFO, logger='app'):
+        filtered = list(app.fetch_ci_audit_records_for_cis(url, 'u', 'p', ci_ids))
+    planned = next(r.getMessage() for r in caplog.records if r.getMessage().startswith('Planned'))
+    assert int(planned.split()[1]) > 1
+    assert filtered == expected
+
+    cutoff = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d 00:00:00')
+    recent = list(app.fetch_ci_audit_records_for_cis(url, 'u', 'p', ci_ids, lookback_days=30))
+    assert recent == [r for r in expected if value(r['sys_created_on']) >= cutoff]
+    assert 0 < len(recent) < len(expected)
+
+
+def without_links(record):
+    # Compact mode excludes reference links, which nothing downstream reads
+    return {
+        field: {k: v for k, v in value.items() if k != 'link'} if isinstance(value, dict) else value
+        for field, value in record.items()
+    }
+
+
+def test_compact_fetch_resolves_to_the_full_records(serve):
+    url = serve()
+    full, full_stats = app.fetch_scan_datasets(url, 'u', 'p')
+    compact, compact_stats = app.fetch_scan_datasets(url, 'u', 'p', compact=True)
+    assert isinstance(compact['ci_data'][0]['sys_id'], str)
+    resolved = app.resolve_compact_datasets(url, 'u', 'p', compact)
+    for name, records in full.items():
+        assert records
+        assert resolved[name] == [without_links(r) for r in records]
+    assert compact_stats['transfer']['decoded_bytes'] < full_stats['transfer']['decoded_bytes'] / 2
+
+    # Records that already carry display values pass through unchanged, and without
+    # class labels a compact CI's class is displayed by its table name
+    mixed = dict(compact, ci_data=full['ci_data'][:5] + compact['ci_data'][5:])
+    expanded = expand_compact_datasets(mixed)
+    assert expanded['ci_data'][:5] == full['ci_data'][:5]
+    class_names = [value(r['sys_class_name']) for r in resolved['ci_data'][5:]]
+    assert expanded['ci_data'][5:] == [
+        dict(r, sys_class_name={'display_value': name, 'value': name})
+        for r, name in zip(resolved['ci_data'][5:], class_names)
+    ]
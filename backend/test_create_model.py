@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+import pickle
+from datetime import datetime
+
+import pytest
+
+import app
+import benchmark
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'staleness_detector_model.pkl')
+
+
+@pytest.fixture(scope='module')
+def model():
+    with open(MODEL_PATH, 'rb') as f:
+        return pickle.load(f)
+
+
+def field(value):
+    return {'display_value': value, 'value': value}
+
+
+def scan_inputs(ci_count=300, audit_ratio=5, seed=7):
+    """A synthetic instance as scan inputs, with the edge cases the two scoring paths must agree on"""
+    ci_data, audit_data, user_data = benchmark.build_inputs(ci_count, audit_ratio, seed)
+    user_sys_ids = {user['user_name']: user['sys_id'] for user in user_data}
+
+    # An owned CI with no audit history at all
+    orphan = dict(ci_data[0], sys_id=field('f' * 32), name=field('no-history'))
+    ci_data.append(orphan)
+
+    for i, record in enumerate(audit_data):
+        if i % 7 == 0:
+            # Audit user known only by sys_id, without the dot-walked user fields
+            sys_id = user_sys_ids.get(record['user']['value'])
+            if sys_id:
+                record['user'] = field(sys_id)
+                record.pop('user.user_name', None)
+                record.pop('user.name', None)
+        elif i % 11 == 0:
+            record['sys_created_on'] = field('not a date')
+        elif i % 13 == 0:
+            record['sys_created_on'] = field('')
+    return ci_data, audit_data, user_data
+
+
+def model_arguments(model, monkeypatch, ci_data, audit_data, user_data):
+    """The DataFrames and lookups app prepares for the model, captured instead of scored"""
+    captured = {}
+
+    class Recorder:
+        def __getattr__(self, name):
+            return getattr(model, name)
+
+        def iter_stale_cis(self, *args, **kwargs):
+            captured['args'] = args
+            return iter([])
+
+    monkeypatch.setattr(app, 'model', Recorder())
+    app.analyze_cis_with_model(ci_data, audit_data, user_data)
+    return captured['args']
+
+
+def test_batch_and_single_paths_agree(model, monkeypatch):
+    ci_data, audit_data, user_data = scan_inputs()
+    args = model_arguments(model, monkeypatch, ci_data, audit_data, user_data)
+    scan_time = datetime.now()
+
+    batched = model.get_stale_ci_list(*args, batch=True, scan_time=scan_time)
+    single = model.get_stale_ci_list(*args, batch=False, scan_time=scan_time)
+
+    assert batched
+    assert json.dumps(batched, sort_keys=True, default=str) == json.dumps(single, sort_keys=True, default=str)
+
+
+def test_sharded_scoring_matches_serial(model, monkeypatch, caplog):
+    import create_model
+
+    ci_data, audit_data, user_data = scan_inputs(ci_count=400, seed=11)
+    args = model_arguments(model, monkeypatch, ci_data, audit_data, user_data)
+    scan_time = datetime.now()
+    # Small enough that this scan is sharded and split into several chunks
+    monkeypatch.setattr(create_model, 'SHARDED_MIN_CIS', 100)
+    monkeypatch.setattr(create_model, 'PREDICT_BATCH_SIZE', 64)
+
+    def scored(workers):
+        progress = []
+        stale = model.get_stale_ci_list(*args, progress=lambda *counts: progress.append(counts),
+                                        scan_time=scan_time, workers=workers)
+        return json.dumps(stale, sort_keys=True, default=str), progress
+
+    serial, serial_progress = scored(1)
+    with caplog.at_level(logging.INFO, logger='sharded_scoring'):
+        sharded, sharded_progress = scored(2)
+    assert 'in up to 2 shards per chunk' in caplog.text
+    assert sharded == serial
+    assert sharded_progress == serial_progress
@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+
+import delta_sync
+from delta_sync import DeltaSyncStore, delta_queries, materialize, merge_delta, needs_full_refresh
+
+NOW = datetime(2024, 6, 1, 12, 0, 0)
+
+
+def record(sys_id, stamp, field='sys_updated_on', **fields):
+    return dict({'sys_id': {'display_value': sys_id, 'value': sys_id}, field: {'display_value': stamp, 'value': stamp}}, **fields)
+
+
+def full_fetch():
+    return {
+        'ci_data': [record('c2', '2024-05-30 08:00:00'), record('c1', '2024-05-31 09:00:00')],
+        'ci_audit_data': [record('a1', '2024-05-31 10:00:00', 'sys_created_on')],
+        'user_audit_data': [record('p1', '2024-05-20 10:00:00', 'sys_created_on')],
+        'user_data': [record('u1', '2024-04-01 00:00:00')]
+    }
+
+
+def test_full_sync_sets_the_watermarks():
+    state = merge_delta(None, full_fetch(), full=True, now=NOW)
+    assert state['last_full_sync'] == NOW
+    assert state['watermarks'] == {
+        'ci_data': '2024-05-31 09:00:00',
+        'ci_audit_data': '2024-05-31 10:00:00',
+        'user_audit_data': '2024-05-20 10:00:00',
+        'user_data': '2024-04-01 00:00:00'
+    }
+    # Materialized tables are in sys_id order, like a paged fetch
+    assert [r['sys_id']['value'] for r in materialize(state)['ci_data']] == ['c1', 'c2']
+
+
+def test_delta_merges_by_sys_id_and_advances_the_watermark():
+    state = merge_delta(None, full_fetch(), full=True, now=NOW)
+    later = NOW + timedelta(hours=1)
+    delta = {
+        'ci_data': [record('c1', '2024-06-01 11:30:00', name='renamed'), record('c3', '2024-06-01 11:00:00')],
+        'ci_audit_data': [],
+        'user_audit_data': [],
+        'user_data': []
+    }
+    state = merge_delta(state, delta, full=False, now=later)
+    ci_data = materialize(state)['ci_data']
+    assert [r['sys_id']['value'] for r in ci_data] == ['c1', 'c2', 'c3']
+    assert ci_data[0]['name'] == 'renamed'
+    assert state['watermarks']['ci_data'] == '2024-06-01 11:30:00'
+    # An empty delta keeps the previous watermark, and the full sync time stays put
+    assert state['watermarks']['ci_audit_data'] == '2024-05-31 10:00:00'
+    assert state['last_full_sync'] == NOW and state['last_sync'] == later
+
+
+def test_full_sync_replaces_the_copy():
+    state = merge_delta(None, full_fetch(), full=True, now=NOW)
+    refreshed = dict(full_fetch(), ci_data=[record('c2', '2024-05-30 08:00:00')])
+    state = merge_delta(state, refreshed, full=True, now=NOW + timedelta(days=1))
+    # c1 was deleted on the instance, so a full sync drops it
+    assert [r['sys_id']['value'] for r in materialize(state)['ci_data']] == ['c2']
+    assert state['watermarks']['ci_data'] == '2024-05-30 08:00:00'
+
+
+def test_rows_without_sys_id_are_skipped():
+    datasets = dict(full_fetch(), user_data=[{'user_name': 'ghost', 'sys_updated_on': '2024-06-01 00:00:00'}])
+    state = merge_delta(None, datasets, full=True, now=NOW)
+    assert materialize(state)['user_data'] == []
+    assert state['watermarks']['user_data'] == ''
+
+
+def test_user_audit_copy_is_pruned_to_the_fetch_window():
+    old = (NOW - timedelta(days=delta_sync.USER_AUDIT_RETENTION_DAYS, seconds=1)).strftime(delta_sync.DATE_FORMAT)
+    datasets = dict(full_fetch(), user_audit_data=[
+        record('p1', '2024-05-20 10:00:00', 'sys_created_on'), record('p0', old, 'sys_created_on')
+    ])
+    state = merge_delta(None, datasets, full=True, now=NOW)
+    assert [r['sys_id']['value'] for r in materialize(state)['user_audit_data']] == ['p1']
+
+
+def test_delta_queries_start_an_overlap_window_before_each_watermark(monkeypatch):
+    monkeypatch.setattr(delta_sync, 'SYNC_OVERLAP_HOURS', 24)
+    state = merge_delta(None, full_fetch(), full=True, now=NOW)
+    state['watermarks']['user_data'] = 'not a date'
+    state['watermarks']['user_audit_data'] = ''
+    assert delta_queries(state) == {
+        'ci_data': "sys_updated_on>=javascript:gs.dateGenerate('2024-05-30','09:00:00')",
+        'ci_audit_data': "sys_created_on>=javascript:gs.dateGenerate('2024-05-30','10:00:00')"
+    }
+
+
+def test_needs_full_refresh(monkeypatch):
+    monkeypatch.setattr(delta_sync, 'SYNC_FULL_REFRESH_HOURS', 24)
+    state = merge_delta(None, full_fetch(), full=True, now=NOW)
+    assert needs_full_refresh(None)
+    assert not needs_full_refresh(state, now=NOW + timedelta(hours=23))
+    assert needs_full_refresh(state, now=NOW + timedelta(hours=25))
+
+
+def test_store_round_trip(tmp_path):
+    store = DeltaSyncStore(root=str(tmp_path))
+    assert store.load('https://dev.service-now.com', 'ann') is None
+    state = merge_delta(None, full_fetch(), full=True, now=NOW)
+    store.save('https://dev.service-now.com/', 'ann', state)
+    assert store.load('https://dev.service-now.com', 'ann') == state
+    assert store.load('https://dev.service-now.com', 'bob') is None
+    assert store.lock('https://dev.service-now.com', 'ann') is store.lock('https://dev.service-now.com/', 'ann')
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from json_stream import iter_json_array_items
+
+BODIES = {
+    'strings': {'result': [
+        {'name': 'say "hi"', 'path': 'C:\\temp\\', 'brackets': '] ]] [', 'braces': '}{,:'},
+        {'value': '\\"', 'unicode': '\u00e9\u2603', 'empty': ''}
+    ]},
+    'utf8': {'result': [{'name': 'Müller'}, {'name': '日本語'}, {'name': '🚀 launch'}, 'é']},
+    'numbers': {'result': [1.5, -12, 3e10, 0, -0.25, 12345678901234567890, 1e-7]},
+    'literals': {'result': [True, False, None, [], {}, [[1, [2]], {'a': [None]}]]},
+    'empty': {'result': []},
+    'key_after_others': {
+        'meta': {'result': ['not', 'this'], 'count': 2},
+        'note': 'the result is [below]',
+        'list': [{'result': 1}],
+        'result': [{'sys_id': 'a'}, {'sys_id': 'b'}]
+    },
+}
+
+
+def splits(body):
+    """The body cut into two chunks at every byte boundary, then into one-byte chunks"""
+    for i in range(len(body) + 1):
+        yield [body[:i], body[i:]]
+    yield [body[i:i + 1] for i in range(len(body))]
+
+
+@pytest.mark.parametrize('name', sorted(BODIES))
+@pytest.mark.parametrize('indent', [None, 2])
+@pytest.mark.parametrize('ensure_ascii', [False, True])
+def test_items_match_json_loads_at_every_split(name, indent, ensure_ascii):
+    # ensure_ascii=False puts multi-byte UTF-8 on the wire, True \uXXXX escapes and surrogate pairs
+    body = json.dumps(BODIES[name], indent=indent, ensure_ascii=ensure_ascii).encode('utf-8')
+    expected = json.loads(body)['result']
+    for chunks in splits(body):
+        assert list(iter_json_array_items(chunks)) == expected
+
+
+def test_items_are_yielded_before_the_body_ends():
+    def chunks():
+        yield b'{"result": [{"a": 1}, '
+        raise AssertionError('read past the first item')
+
+    assert next(iter_json_array_items(chunks())) == {'a': 1}
+
+
+def test_missing_key_yields_nothing():
+    for chunks in splits(b'{"error": {"message": "none"}}'):
+        assert list(iter_json_array_items(chunks)) == []
+    assert list(iter_json_array_items([b'{}'])) == []
+
+
+@pytest.mark.parametrize('body', [b'{"result": {"a": 1}}', b'{"result": "[1]"}', b'{"result": 5}', b'{"result": null}'])
+def test_non_array_result_raises(body):
+    for chunks in splits(body):
+        with pytest.raises(ValueError):
+            list(iter_json_array_items(chunks))
+
+
+@pytest.mark.parametrize('body', [b'', b'[1, 2]', b'{"result": [1, 2', b'{"result": [1 2]}', b'{"result": [{"a": 1]}', b'{"result": ["open'])
+def test_malformed_body_raises(body):
+    for chunks in splits(body):
+        with pytest.raises(ValueError):
+            list(iter_json_array_items(chunks))
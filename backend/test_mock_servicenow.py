@@ -0,0 +1,129 @@
+from datetime import datetime
+
+import pytest
+
+from mock_servicenow import MockInstance, create_app, parse_encoded_query, resolve_query_value
+from synthetic_data import generate_instance
+
+NOW = datetime(2024, 6, 1)
+
+
+@pytest.fixture
+def mock():
+    return MockInstance(generate_instance(120, audit_ratio=4, seed=9, now=NOW))
+
+
+@pytest.fixture
+def client(mock):
+    return create_app(mock, max_page_size=50).test_client()
+
+
+def test_parse_encoded_query():
+    groups, order_by = parse_encoded_query('active=true^nameLIKEsmith^ORname=x^NQsys_idIN1,2^ORDERBYDESCsys_created_on')
+    assert groups == [
+        [[('active', '=', 'true')], [('name', 'LIKE', 'smith'), ('name', '=', 'x')]],
+        [[('sys_id', 'IN', frozenset({'1', '2'}))]]
+    ]
+    assert order_by == [('sys_created_on', True)]
+    with pytest.raises(ValueError):
+        parse_encoded_query('no operator here')
+
+
+def test_resolve_query_value():
+    assert resolve_query_value('javascript:gs.daysAgoStart(3)', NOW) == '2024-05-29 00:00:00'
+    assert resolve_query_value("javascript:gs.dateGenerate('2024-01-02','03:04:05')") == '2024-01-02 03:04:05'
+    assert resolve_query_value('plain') == 'plain'
+
+
+def test_paging_returns_every_row_once_in_sys_id_order(client, mock):
+    sys_ids = []
+    offset = 0
+    while True:
+        # The mock caps sysparm_limit at max_page_size, like the instance row limit
+        response = client.get('/api/now/table/cmdb_ci', query_string={
+            'sysparm_query': 'ORDERBYsys_id', 'sysparm_fields': 'sys_id',
+            'sysparm_limit': 1000, 'sysparm_offset': offset
+        })
+        assert response.status_code == 200
+        assert response.headers['X-Total-Count'] == '120'
+        page = [row['sys_id'] for row in response.get_json()['result']]
+        assert len(page) <= 50
+        if not page:
+            break
+        sys_ids.extend(page)
+        offset += len(page)
+    assert sys_ids == [row[0] for row in mock.tables['cmdb_ci']]
+
+
+def test_query_filters_match_the_records(client, mock):
+    ci = next(mock.instance.records('cmdb_ci'))
+    response = client.get('/api/now/table/sys_audit', query_string={
+        'sysparm_query': f"documentkey={ci['sys_id']}^ORDERBYDESCsys_created_on",
+        'sysparm_fields': 'documentkey,sys_created_on'
+    })
+    rows = response.get_json()['result']
+    expected = [r for r in mock.instance.records('sys_audit') if r['documentkey'] == ci['sys_id']]
+    assert len(rows) == len(expected) > 0
+    assert all(row['documentkey'] == ci['sys_id'] for row in rows)
+    dates = [row['sys_created_on'] for row in rows]
+    assert dates == sorted(dates, reverse=True)
+
+    response = client.get('/api/now/table/cmdb_ci', query_string={'sysparm_query': 'bogus'})
+    assert response.status_code == 400
+
+
+def test_display_values_and_reference_links(client, mock):
+    ci = next(r for r in mock.instance.records('cmdb_ci') if r['assigned_to'])
+    owner = next(r for r in mock.instance.records('sys_user') if r['sys_id'] == ci['assigned_to'])
+    url = f"/api/now/table/cmdb_ci/{ci['sys_id']}"
+    fields = {'sysparm_fields': 'sys_class_name,assigned_to,assigned_to.user_name'}
+
+    record = client.get(url, query_string=dict(fields, sysparm_display_value='all')).get_json()['result']
+    assert record['assigned_to']['value'] == owner['sys_id']
+    assert record['assigned_to']['display_value'] == owner['name']
+    assert record['assigned_to']['link'].endswith(f"/api/now/table/sys_user/{owner['sys_id']}")
+    assert record['assigned_to.user_name'] == {'display_value': owner['user_name'], 'value': owner['user_name']}
+    assert record['sys_class_name']['value'] == ci['sys_class_name']
+
+    record = client.get(url, query_string=dict(fields, sysparm_display_value='true',
+                                               sysparm_exclude_reference_link='true')).get_json()['result']
+    assert record['assigned_to'] == owner['name']
+
+    assert client.get('/api/now/table/cmdb_ci/missing').status_code == 404
+
+
+def test_patch_updates_the_record_and_later_queries(client, mock):
+    ci = next(mock.instance.records('cmdb_ci'))
+    response = client.patch(f"/api/now/table/cmdb_ci/{ci['sys_id']}", json={'name': 'renamed'})
+    assert response.status_code == 200
+    assert response.get_json()['result']['name'] == 'renamed'
+
+    rows = client.get('/api/now/table/cmdb_ci', query_string={'sysparm_query': 'name=renamed'}).get_json()['result']
+    assert [row['sys_id'] for row in rows] == [ci['sys_id']]
+    assert client.patch('/api/now/table/cmdb_ci/missing', json={'name': 'x'}).status_code == 404
+
+
+def test_stats_counts_and_groups(client, mock):
+    total = client.get('/api/now/stats/cmdb_ci', query_string={'sysparm_count': 'true'}).get_json()['result']
+    assert total == {'stats': {'count': '120'}}
+    groups = client.get('/api/now/stats/cmdb_ci', query_string={
+        'sysparm_count': 'true', 'sysparm_group_by': 'sys_class_name'
+    }).get_json()['result']
+    assert sum(int(group['stats']['count']) for group in groups) == 120
+
+
+def test_basic_auth_issues_a_session():
+    app = create_app(MockInstance(generate_instance(20, seed=1, now=NOW)), username='admin', password='pw')
+    client = app.test_client()
+    assert client.get('/api/now/table/cmdb_ci').status_code == 401
+    assert client.get('/api/now/table/cmdb_ci', auth=('admin', 'wrong')).status_code == 401
+    assert client.get('/api/now/table/cmdb_ci', auth=('admin', 'pw')).status_code == 200
+    # The JSESSIONID cookie from the authenticated call is enough on its own
+    assert client.get('/api/now/table/cmdb_ci').status_code == 200
+
+
+def test_injected_throttling_answers_429():
+    app = create_app(MockInstance(generate_instance(20, seed=1, now=NOW)), throttle_rate=1.0, retry_after=3)
+    response = app.test_client().get('/api/now/table/cmdb_ci')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '3'
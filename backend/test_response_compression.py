@@ -0,0 +1,76 @@
+import gzip
+import zlib
+
+import pytest
+from flask import Flask, Response, jsonify
+
+import response_compression
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    response_compression.init_app(app, min_bytes=1024)
+
+    @app.route('/json/<int:size>')
+    def json_body(size):
+        return jsonify({'data': 'x' * size})
+
+    @app.route('/ndjson/<int:lines>/<int:size>')
+    def ndjson(lines, size):
+        return Response((f'{{"n": {i}, "pad": "{"y" * size}"}}\n' for i in range(lines)), mimetype='application/x-ndjson')
+
+    @app.route('/events')
+    def events():
+        return Response((f'data: {i}\n\n' for i in range(50)), mimetype='text/event-stream')
+
+    return app.test_client()
+
+
+def chunks_of(response):
+    return [chunk for chunk in response.response if chunk]
+
+
+@pytest.mark.parametrize('accept, encoding', [('gzip', 'gzip'), ('deflate', 'deflate'), ('gzip;q=0.5, deflate', 'deflate'),
+                                              ('br', None), ('gzip;q=0', None)])
+def test_negotiate_encoding(accept, encoding):
+    assert response_compression.negotiate_encoding(accept) == encoding
+
+
+def test_large_json_is_compressed(client):
+    response = client.get('/json/5000', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    body = gzip.decompress(response.get_data())
+    assert int(response.headers['X-Uncompressed-Length']) == len(body)
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_small_json_is_not_compressed(client):
+    response = client.get('/json/10', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_event_stream_is_not_compressed(client):
+    response = client.get('/events', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data().decode().count('data: ') == 50
+
+
+def test_small_stream_chunks_are_not_flushed_one_by_one(client):
+    response = client.get('/ndjson/200/10', headers={'Accept-Encoding': 'deflate'}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'deflate'
+    chunks = chunks_of(response)
+    # About 30 bytes a line: a flush per 1024 bytes, not per line
+    assert len(chunks) < 20
+    lines = zlib.decompress(b''.join(chunks)).decode().splitlines()
+    assert len(lines) == 200 and lines[-1].startswith('{"n": 199')
+
+
+def test_large_stream_chunks_arrive_as_produced(client):
+    response = client.get('/ndjson/20/2000', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+    decompressor = zlib.decompressobj(response_compression.WBITS['gzip'])
+    chunks = iter(response.response)
+    for i in range(20):
+        # Every line is past the threshold, so it is flushed and decodes before the next is produced
+        line = decompressor.decompress(next(chunk for chunk in chunks if chunk)).decode()
+        assert line.startswith(f'{{"n": {i},') and line.endswith('\n')
@@ -0,0 +1,109 @@
+import random
+import re
+
+import pytest
+
+from create_model import RuleBasedStalenessDetector
+from rule_engine import Condition, FeatureTable, RuleCompileError, RuleSet
+
+RULES = RuleBasedStalenessDetector()._define_detection_rules()
+CONDITIONS = sorted({source for rule in RULES.values() for source in rule['conditions']})
+FEATURE_NAMES = sorted({name for source in CONDITIONS
+                        for name in re.findall(r'\b[a-z_]+\b', re.sub(r"'[^']*'|\"[^\"]*\"", '', source))
+                        if name not in ('and', 'or', 'not', 'in', 'lower', 'upper', 'strip')})
+
+# Feature values of every shape a scan can produce, and a few it shouldn't
+VALUES = [0, 1, 2, 3, -1, 0.0, 0.2, 0.29, 0.5, 0.7, 151, 200, 999, 10 ** 20, float('nan'), True, False, None,
+          '', 'bob', 'vendor.bob', 'admin.generic', 'a.contractor', 'EXTERNAL x', 'true', [1], {}]
+
+
+def evaluated(source, features):
+    """How rule conditions were checked before they were compiled"""
+    try:
+        return bool(eval(source, {'__builtins__': {}}, dict(features)))
+    except Exception:
+        return False
+
+
+def feature_dicts(count, seed):
+    rng = random.Random(seed)
+    dicts = []
+    for _ in range(count):
+        # Some features missing, the rest a mix of numbers, bools, None, strings and containers
+        dicts.append({name: rng.choice(VALUES) for name in FEATURE_NAMES if rng.random() < 0.85})
+    return dicts
+
+
+@pytest.mark.parametrize('source', CONDITIONS)
+def test_scalar_and_vector_match_eval(source):
+    condition = Condition(source)
+    for seed in range(3):
+        dicts = feature_dicts(300, seed)
+        mask = condition.mask(FeatureTable(dicts))
+        for features, masked in zip(dicts, mask):
+            expected = evaluated(source, features)
+            assert condition.evaluate(features) == expected, features
+            assert bool(masked) == expected, features
+
+
+@pytest.mark.parametrize('source', CONDITIONS)
+def test_numeric_columns_match_eval(source):
+    # Every CI has every feature as a number or bool, so columns take the numeric fast path
+    rng = random.Random(source)
+    dicts = [{name: ('vendor.x' if name == 'owner_name' and rng.random() < 0.5 else
+                     rng.choice([0, 1, 2, 151, 0.3, 0.6, True, False]))
+              for name in FEATURE_NAMES} for _ in range(300)]
+    condition = Condition(source)
+    mask = condition.mask(FeatureTable(dicts))
+    for features, masked in zip(dicts, mask):
+        expected = evaluated(source, features)
+        assert condition.evaluate(features) == expected == bool(masked), features
+
+
+def test_rule_set_batch_matches_per_ci():
+    rule_set = RuleSet(RULES)
+    dicts = feature_dicts(500, 42)
+    batched = rule_set.triggered_batch(dicts)
+    for features, names in zip(dicts, batched):
+        expected = [name for name, rule in RULES.items()
+                    if all(evaluated(source, features) for source in rule['conditions'])]
+        assert rule_set.triggered(features) == expected == names
+
+
+@pytest.mark.parametrize('source', [
+    'a < b < c', 'not a', 'a or b and not c', "'x' not in s.upper()", 'a == None', 's.strip() == "q"',
+    '(a > 1) == True', 'a != b'
+])
+def test_expression_forms_match_eval(source):
+    rng = random.Random(source)
+    dicts = [{name: rng.choice([0, 1, 2, None, 'x', 'q ', ' X', 'xs', 1.5]) for name in 'abcs' if rng.random() < 0.9}
+             for _ in range(500)]
+    condition = Condition(source)
+    mask = condition.mask(FeatureTable(dicts))
+    for features, masked in zip(dicts, mask):
+        expected = evaluated(source, features)
+        assert condition.evaluate(features) == expected == bool(masked), features
+
+
+@pytest.mark.parametrize('source', [
+    '__import__("os")',
+    'a.__class__',
+    'a.__class__.__bases__',
+    'a.startswith("x")',
+    'a.lower',
+    'a.lower(1)',
+    'f(1)',
+    'len(a) > 0',
+    'a[0] == 1',
+    'a["key"]',
+    'a + 1 > 2',
+    '[x for x in y]',
+    'lambda: 1',
+    '(a or b) > 1',
+    'a if b else c',
+    'a = 1',
+    'a ==',
+])
+def test_hostile_expressions_are_rejected(source):
+    with pytest.raises(RuleCompileError):
+        Condition(source)
@@ -0,0 +1,118 @@
+import os
+import time
+
+import pytest
+
+from scan_jobs import FAILED, SUCCEEDED, ScanJobManager, TooManyJobsError
+
+
+def fake_scan(params, progress):
+    """Stands in for run_scan in the worker processes"""
+    progress('fetching', 10.0, pages=1)
+    if params.get('wait'):
+        time.sleep(params['wait'])
+    progress('scoring', 60.0, scored=5)
+    # Progress travels on a queue; give it time to land before the job finishes
+    time.sleep(params.get('settle', 0))
+    if params.get('crash'):
+        os._exit(1)
+    if params.get('fail'):
+        return {'error': 'Failed to fetch CI data'}, 500
+    return {'stale_cis': [{'ci_id': 'ci1'}], 'n': params.get('n')}, 200
+
+
+def wait_done(manager, job, timeout=60):
+    deadline = time.monotonic() + timeout
+    after = 0
+    events = []
+    while time.monotonic() < deadline:
+        new, done = manager.wait_events(job.id, after, timeout=1)
+        events.extend(new)
+        if new:
+            after = new[-1]['id']
+        if done:
+            return events
+    raise AssertionError(f"scan job {job.id} did not finish")
+
+
+@pytest.fixture
+def manager():
+    retained = []
+    manager = ScanJobManager(fake_scan, workers=1, max_pending=5, on_result=retained.append)
+    manager.retained = retained
+    yield manager
+    manager.shutdown()
+
+
+def test_job_reports_progress_and_result(manager):
+    job, shared = manager.submit({'n': 1, 'settle': 0.5})
+    assert not shared
+    events = wait_done(manager, job)
+    assert job.state == SUCCEEDED and job.status_code == 200
+    assert job.result['n'] == 1
+    assert manager.retained == [job]
+    stages = [event['data']['stage'] for event in events]
+    assert stages[-1] == 'done' and events[-1]['event'] == 'done'
+    assert 'fetching' in stages and 'scoring' in stages
+    assert [event['id'] for event in events] == sorted(event['id'] for event in events)
+
+
+def test_failed_scan_marks_the_job_failed(manager):
+    job, _ = manager.submit({'fail': True})
+    wait_done(manager, job)
+    assert job.state == FAILED and job.status_code == 500
+    assert job.error == 'Failed to fetch CI data'
+    assert manager.retained == []
+
+
+def test_crashed_worker_fails_the_job_and_the_next_job_runs(manager):
+    job, _ = manager.submit({'crash': True})
+    wait_done(manager, job)
+    assert job.state == FAILED and 'exited unexpectedly' in job.error
+    job, _ = manager.submit({'n': 2})
+    wait_done(manager, job)
+    assert job.state == SUCCEEDED and job.result['n'] == 2
+
+
+def test_identical_submissions_share_a_job(manager):
+    first, shared = manager.submit({'wait': 1}, key='k', credential='secret')
+    again, again_shared = manager.submit({'wait': 1}, key='k', credential='secret')
+    assert again is first and again_shared and not shared
+
+    # Another credential attaches only once it is authorized
+    other, other_shared = manager.submit({'wait': 1}, key='k', credential='other', authorize=lambda: False)
+    assert other is not first and not other_shared
+    joined, joined_shared = manager.submit({'wait': 1}, key='k', credential='other', authorize=lambda: True)
+    assert joined is first and joined_shared
+    wait_done(manager, first)
+    wait_done(manager, other)
+
+
+def test_pending_limit():
+    manager = ScanJobManager(fake_scan, workers=1, max_pending=1)
+    try:
+        running, _ = manager.submit({'wait': 2})
+        manager.wait_events(running.id, after=1, timeout=30)
+        assert running.state == 'running'
+        # The only worker is busy, so this one waits and fills the queue
+        queued, _ = manager.submit({'n': 1})
+        with pytest.raises(TooManyJobsError):
+            manager.submit({'n': 2})
+        wait_done(manager, queued)
+    finally:
+        manager.shutdown()
+
+
+def test_finished_jobs_are_evicted():
+    manager = ScanJobManager(fake_scan, workers=1, max_finished=1)
+    try:
+        first, _ = manager.submit({'n': 1})
+        wait_done(manager, first)
+        second, _ = manager.submit({'n': 2})
+        wait_done(manager, second)
+        assert manager.get(first.id) is None
+        assert manager.get(second.id) is second
+        second.finished -= manager.retention_seconds + 1
+        assert manager.get(second.id) is None
+    finally:
+        manager.shutdown()
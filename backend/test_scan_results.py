@@ -0,0 +1,112 @@
+import random
+
+import pytest
+
+from scan_results import InvalidQueryError, RISK_ORDER, ScanResultIndex, ScanResultStore
+
+
+def stale_cis(count=230, seed=3):
+    rng = random.Random(seed)
+    cis = []
+    for i in range(count):
+        cis.append({
+            'ci_id': f'ci{i:04d}',
+            'ci_name': None if rng.random() < 0.1 else f"{rng.choice('abcXYZ')}-{i}",
+            'ci_class': rng.choice(['Server', 'Linux Server', 'Computer']),
+            'confidence': rng.choice([0.3, 0.55, 0.7, 0.85, 0.9, 0.95, None]),
+            'risk_level': rng.choice(list(RISK_ORDER)),
+            'current_owner_username': rng.choice(['ann', 'bob', 'cid']),
+            'days_since_owner_activity': rng.choice([None, 5, 40, 400]),
+            'staleness_reasons': [{'rule_name': name} for name in rng.sample(['inactive', 'left', 'vendor'], rng.randint(0, 2))],
+            'recommended_owners': [{'username': rng.choice(['dan', 'eve'])}] if rng.random() < 0.8 else []
+        })
+    return cis
+
+
+def pages(index, **query):
+    items, cursor = [], None
+    while True:
+        page = index.query(cursor=cursor, **query)
+        items.extend(page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return items, page['total']
+
+
+@pytest.mark.parametrize('query, matches', [
+    ({}, lambda ci: True),
+    ({'filters': {'risk_level': ['Critical', 'High']}}, lambda ci: ci['risk_level'] in ('Critical', 'High')),
+    ({'filters': {'owner': ['ann']}, 'min_confidence': 0.8},
+     lambda ci: ci['current_owner_username'] == 'ann' and (ci['confidence'] or 0) >= 0.8),
+    ({'filters': {'rule': ['vendor'], 'recommended_owner': ['eve']}},
+     lambda ci: any(r['rule_name'] == 'vendor' for r in ci['staleness_reasons'])
+     and ci['recommended_owners'] and ci['recommended_owners'][0]['username'] == 'eve'),
+    ({'max_confidence': 0.6}, lambda ci: (ci['confidence'] or 0) <= 0.6),
+])
+@pytest.mark.parametrize('sort, key', [
+    ('confidence', lambda ci: ci['confidence'] or 0),
+    ('risk', lambda ci: RISK_ORDER[ci['risk_level']]),
+    ('date', lambda ci: 999 if ci['days_since_owner_activity'] is None else ci['days_since_owner_activity']),
+])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_cursor_paging_matches_filtering_the_full_list(query, matches, sort, key, order):
+    cis = stale_cis()
+    index = ScanResultIndex('r1', cis)
+    items, total = pages(index, sort=sort, order=order, limit=7, **query)
+    expected = sorted([ci for ci in cis if matches(ci)], key=key, reverse=(order == 'desc'))
+    assert [ci['ci_id'] for ci in items] == [ci['ci_id'] for ci in expected]
+    assert total == len(expected)
+
+
+def test_incrementally_built_index_answers_like_a_batch_built_one():
+    cis = stale_cis()
+    appended = ScanResultIndex('r1')
+    for ci in cis:
+        appended.append(ci)
+    batch = ScanResultIndex('r1', cis)
+    for query in ({}, {'min_confidence': 0.7, 'sort': 'name'}, {'filters': {'ci_class': ['Server']}, 'order': 'asc'}):
+        assert pages(appended, limit=9, **query) == pages(batch, limit=9, **query)
+    assert appended.facets() == batch.facets()
+
+
+def test_cursor_from_another_query_is_rejected():
+    index = ScanResultIndex('r1', stale_cis())
+    cursor = index.query(limit=5)['next_cursor']
+    assert index.query(limit=5, cursor=cursor)['items']
+    with pytest.raises(InvalidQueryError):
+        index.query(limit=5, sort='name', cursor=cursor)
+    with pytest.raises(InvalidQueryError):
+        index.query(limit=5, filters={'owner': ['ann']}, cursor=cursor)
+    with pytest.raises(InvalidQueryError):
+        ScanResultIndex('r2', stale_cis()).query(limit=5, cursor=cursor)
+    with pytest.raises(InvalidQueryError):
+        index.query(cursor='not-a-cursor')
+
+
+@pytest.mark.parametrize('query', [
+    {'sort': 'bogus'}, {'order': 'sideways'}, {'filters': {'colour': ['red']}},
+    {'min_confidence': 0.9, 'max_confidence': 0.1}
+])
+def test_invalid_queries_are_rejected(query):
+    with pytest.raises(InvalidQueryError):
+        ScanResultIndex('r1', stale_cis()).query(**query)
+
+
+def test_store_drops_the_least_recently_used_result():
+    store = ScanResultStore(retention_seconds=3600, max_results=2)
+    first = store.add(stale_cis(10))
+    second = store.add(stale_cis(10))
+    # Reading the first result makes the second the least recently used
+    store.get(first).query()
+    store.get(first).last_used += 1
+    third = store.retain(store.new_index(stale_cis=stale_cis(10)))
+    assert store.get(second) is None
+    assert store.get(first) is not None and store.get(third) is not None
+
+
+def test_store_drops_expired_results():
+    store = ScanResultStore(retention_seconds=60)
+    result_id = store.add(stale_cis(10), result_id='job1')
+    assert result_id == 'job1'
+    store.get(result_id).created -= 61
+    assert store.get(result_id) is None
@@ -0,0 +1,127 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import servicenow_client
+from servicenow_client import ServiceNowClient
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/slow':
+            self.server.entered.set()
+            self.server.release.wait(10)
+        if self.path == '/stream':
+            body = b'x' * 1000000
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:1000])
+            self.server.release.wait(10)
+            self.wfile.write(body[1000:])
+            return
+        body = b'{"result": []}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.entered = threading.Event()
+    httpd.release = threading.Event()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}', httpd
+    httpd.release.set()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def closed(monkeypatch):
+    """The pooled sessions closed so far"""
+    closed = []
+    original = servicenow_client._PooledSession.close
+
+    def close(pooled):
+        closed.append(pooled)
+        original(pooled)
+
+    monkeypatch.setattr(servicenow_client._PooledSession, 'close', close)
+    return closed
+
+
+def test_sessions_are_reused_per_credentials(server):
+    url, _ = server
+    client = ServiceNowClient(max_sessions=4)
+    assert client.get(url, 'ann', 'pw', f'{url}/fast').status_code == 200
+    assert client.get(url + '/', 'ann', 'pw', f'{url}/fast').status_code == 200
+    assert client.get(url, 'ann', 'other', f'{url}/fast').status_code == 200
+    assert len(client._sessions) == 2
+    client.close()
+
+
+def test_session_in_use_is_not_evicted_by_the_cap(server, closed):
+    url, httpd = server
+    client = ServiceNowClient(max_sessions=1)
+    results = []
+    slow = threading.Thread(target=lambda: results.append(client.get(url, 'ann', 'pw', f'{url}/slow', timeout=10)))
+    slow.start()
+    assert httpd.entered.wait(5)
+    in_use = client._sessions[client._key(url, 'ann', 'pw')]
+
+    # Over the cap while ann's request is in flight: ann's session stays open
+    assert client.get(url, 'bob', 'pw', f'{url}/fast').status_code == 200
+    assert in_use not in closed
+    assert len(client._sessions) == 2
+
+    httpd.release.set()
+    slow.join(5)
+    assert results[0].status_code == 200
+    # Once nothing is using it, the least recently used session goes
+    client.get(url, 'cid', 'pw', f'{url}/fast')
+    assert in_use in closed
+    assert list(client._sessions) == [client._key(url, 'cid', 'pw')]
+    client.close()
+
+
+def test_session_in_use_is_not_evicted_when_idle(server, closed):
+    url, httpd = server
+    client = ServiceNowClient(idle_seconds=1)
+    slow = threading.Thread(target=lambda: client.get(url, 'ann', 'pw', f'{url}/slow', timeout=10))
+    slow.start()
+    assert httpd.entered.wait(5)
+    in_use = client._sessions[client._key(url, 'ann', 'pw')]
+    in_use.last_used -= 60
+
+    client.get(url, 'bob', 'pw', f'{url}/fast')
+    assert in_use not in closed
+
+    httpd.release.set()
+    slow.join(5)
+    bob = client._sessions[client._key(url, 'bob', 'pw')]
+    bob.last_used -= 60
+    client.get(url, 'ann', 'pw', f'{url}/fast')
+    assert bob in closed and in_use not in closed
+    client.close()
+
+
+def test_streamed_body_survives_eviction(server, closed):
+    url, httpd = server
+    client = ServiceNowClient(max_sessions=1)
+    response = client.get(url, 'ann', 'pw', f'{url}/stream', stream=True, timeout=10)
+    client.get(url, 'bob', 'pw', f'{url}/fast')
+    assert len(closed) == 1
+
+    httpd.release.set()
+    assert len(b''.join(response.iter_content(65536))) == 1000000
+    response.close()
+    client.close()
@@ -0,0 +1,112 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class Leader:
+    """fn for the first caller of a key: blocks until released, counting its runs"""
+
+    def __init__(self, result='leader', error=None):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.runs = 0
+        self.result = result
+        self.error = error
+
+    def __call__(self):
+        self.runs += 1
+        self.started.set()
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def join_while_running(flight, leader, key, callers):
+    """Start the leader, run callers (fn, credential, authorize) once it is running, then release it"""
+    with ThreadPoolExecutor(max_workers=len(callers) + 1) as executor:
+        first = executor.submit(flight.do, key, leader, 'secret')
+        assert leader.started.wait(5)
+        others = [executor.submit(flight.do, key, fn, credential, authorize) for fn, credential, authorize in callers]
+        # Give the callers time to attach before the leader finishes
+        threading.Event().wait(0.2)
+        leader.release.set()
+        return first, others
+
+
+def test_same_credential_shares_the_result():
+    flight = SingleFlight()
+    leader = Leader()
+    follower = Leader(result='follower')
+    first, others = join_while_running(flight, leader, 'k', [(follower, 'secret', None)] * 3)
+    assert first.result() == ('leader', False)
+    assert [other.result() for other in others] == [('leader', True)] * 3
+    assert leader.runs == 1 and follower.runs == 0
+
+
+def test_other_credential_joins_only_when_authorized():
+    flight = SingleFlight()
+    leader = Leader()
+    checks = []
+
+    def authorize():
+        checks.append(True)
+        return True
+
+    first, others = join_while_running(flight, leader, 'k', [(lambda: 'own', 'other', authorize)])
+    assert others[0].result() == ('leader', True)
+    assert checks == [True]
+
+
+@pytest.mark.parametrize('authorize', [None, lambda: False])
+def test_unauthorized_credential_runs_on_its_own(authorize):
+    flight = SingleFlight()
+    leader = Leader()
+    own = []
+
+    def fn():
+        own.append(True)
+        return 'own'
+
+    first, others = join_while_running(flight, leader, 'k', [(fn, 'other', authorize)])
+    assert others[0].result() == ('own', False)
+    assert first.result() == ('leader', False)
+    assert own == [True]
+
+
+def test_same_credential_is_not_checked():
+    flight = SingleFlight()
+    leader = Leader()
+
+    def authorize():
+        raise AssertionError('authorize called for the leader credential')
+
+    first, others = join_while_running(flight, leader, 'k', [(lambda: 'own', 'secret', authorize)])
+    assert others[0].result() == ('leader', True)
+
+
+def test_error_is_shared_and_the_key_is_freed():
+    flight = SingleFlight()
+    leader = Leader(error=RuntimeError('fetch failed'))
+    first, others = join_while_running(flight, leader, 'k', [(lambda: 'own', 'secret', None)])
+    with pytest.raises(RuntimeError):
+        first.result()
+    with pytest.raises(RuntimeError):
+        others[0].result()
+    # The next call starts afresh
+    assert flight.do('k', lambda: 'again', 'secret') == ('again', False)
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    leader = Leader()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        first = executor.submit(flight.do, 'k', leader, 'secret')
+        assert leader.started.wait(5)
+        # Runs while the leader of 'k' is still blocked
+        assert flight.do('other', lambda: 'other', 'secret') == ('other', False)
+        leader.release.set()
+        assert first.result() == ('leader', False)
@@ -0,0 +1,127 @@
+import os
+import time
+
+import pytest
+
+import app
+from scan_progress import ScanProgress
+from snapshot_store import SnapshotStore, SUFFIX
+
+INSTANCE = 'https://dev.service-now.com'
+PARAMS = {'audit_ci_filter': False, 'audit_lookback_days': None, 'audit_mode': 'raw'}
+
+
+def sample_datasets():
+    ci_data = [
+        {'sys_id': {'display_value': f'ci{i}', 'value': f'ci{i}'}, 'name': f'server-{i}',
+         'sys_class_name': 'cmdb_ci_server', 'assigned_to': {'display_value': 'Ann', 'value': 'u1'}}
+        for i in range(20)
+    ]
+    ci_data[3]['short_description'] = 'only on one row'
+    ci_data[7]['assigned_to'] = ''
+    return {
+        'ci_data': ci_data,
+        'ci_audit_data': [{'sys_id': 'a1', 'documentkey': 'ci1', 'newvalue': None, 'count': 3}],
+        'user_audit_data': [],
+        'user_data': [{'sys_id': 'u1', 'user_name': 'ann', 'active': 'true'}]
+    }
+
+
+def snapshot_files(root):
+    return sorted(name for name in os.listdir(root) if name.endswith(SUFFIX))
+
+
+def test_round_trip(tmp_path):
+    store = SnapshotStore(root=str(tmp_path), ttl_seconds=300)
+    datasets = sample_datasets()
+    assert store.load(INSTANCE, 'ann', PARAMS) is None
+
+    info = store.save(INSTANCE, 'ann', PARAMS, datasets)
+    assert info['hit'] is False and info['bytes'] > 0
+
+    loaded, info = store.load(INSTANCE + '/', 'ann', PARAMS)
+    assert loaded == datasets
+    assert info['hit'] is True
+    # Other users and other fetch options have snapshots of their own
+    assert store.load(INSTANCE, 'bob', PARAMS) is None
+    assert store.load(INSTANCE, 'ann', dict(PARAMS, audit_mode='aggregate')) is None
+
+
+def test_ttl_expiry(tmp_path):
+    store = SnapshotStore(root=str(tmp_path), ttl_seconds=60)
+    store.save(INSTANCE, 'ann', PARAMS, sample_datasets())
+    path = os.path.join(str(tmp_path), snapshot_files(str(tmp_path))[0])
+    created = time.time() - 61
+    os.utime(path, (created, created))
+    assert store.load(INSTANCE, 'ann', PARAMS) is None
+
+    store.evict()
+    assert snapshot_files(str(tmp_path)) == []
+
+
+def test_disabled_with_zero_ttl(tmp_path):
+    store = SnapshotStore(root=str(tmp_path), ttl_seconds=0)
+    assert store.save(INSTANCE, 'ann', PARAMS, sample_datasets()) is None
+    assert store.load(INSTANCE, 'ann', PARAMS) is None
+
+
+def test_lru_eviction(tmp_path):
+    root = str(tmp_path)
+    store = SnapshotStore(root=root, ttl_seconds=300)
+    for user in ('ann', 'bob', 'cid'):
+        store.save(INSTANCE, user, PARAMS, sample_datasets())
+    sizes = {name: os.path.getsize(os.path.join(root, name)) for name in snapshot_files(root)}
+    assert len(sizes) == 3
+
+    # ann's snapshot is the least recently used, cid's the most
+    now = time.time()
+    for age, user in ((30, 'ann'), (20, 'bob'), (10, 'cid')):
+        path = store._path(INSTANCE, user, PARAMS)
+        os.utime(path, (now - age, os.path.getmtime(path)))
+    assert store.load(INSTANCE, 'ann', PARAMS) is not None
+
+    store.max_bytes = sum(sizes.values()) - 1
+    store.evict()
+    assert store.load(INSTANCE, 'bob', PARAMS) is None
+    assert store.load(INSTANCE, 'ann', PARAMS) is not None
+    assert store.load(INSTANCE, 'cid', PARAMS) is not None
+
+
+def test_invalidate_covers_every_user_of_the_instance(tmp_path):
+    store = SnapshotStore(root=str(tmp_path), ttl_seconds=300)
+    other = 'https://other.service-now.com'
+    for user in ('ann', 'bob'):
+        store.save(INSTANCE, user, PARAMS, sample_datasets())
+        store.save(INSTANCE, user, dict(PARAMS, audit_ci_filter=True), sample_datasets())
+    store.save(other, 'ann', PARAMS, sample_datasets())
+
+    store.invalidate(INSTANCE + '/')
+    for user in ('ann', 'bob'):
+        assert store.load(INSTANCE, user, PARAMS) is None
+        assert store.load(INSTANCE, user, dict(PARAMS, audit_ci_filter=True)) is None
+    assert store.load(other, 'ann', PARAMS) is not None
+
+
+@pytest.mark.parametrize('failure', [{'error': '403 Forbidden'}, {'cancelled': True}])
+def test_scan_with_a_failed_fetch_is_not_snapshotted(tmp_path, monkeypatch, failure):
+    store = SnapshotStore(root=str(tmp_path), ttl_seconds=300)
+    monkeypatch.setattr(app, 'snapshot_store', store)
+
+    def fetch_scan_datasets(*args, **kwargs):
+        # The CI audit fetch failed while the user audit fetch still returned rows
+        datasets = dict(sample_datasets(), ci_audit_data=[], user_audit_data=[{'sys_id': 'p1', 'documentkey': 'u1'}])
+        fetch_stats = {name: {'records': len(records), 'error': None, 'cancelled': False} for name, records in datasets.items()}
+        fetch_stats['ci_audit_data'].update(failure)
+        fetch_stats['transfer'] = {}
+        return datasets, fetch_stats
+
+    monkeypatch.setattr(app, 'fetch_scan_datasets', fetch_scan_datasets)
+    data = {'instance_url': INSTANCE, 'username': 'ann', 'password': 'pw'}
+    inputs, error = app.load_scan_inputs(data, ScanProgress())
+    assert error is None and inputs['snapshot'] is None
+    assert snapshot_files(str(tmp_path)) == []
+
+    failure = {'error': None, 'cancelled': False}
+    inputs, error = app.load_scan_inputs(data, ScanProgress())
+    assert inputs['snapshot'] is not None
+    assert len(snapshot_files(str(tmp_path))) == 1
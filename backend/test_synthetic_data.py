@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from synthetic_data import GENERIC_ACCOUNTS, TABLE_FIELDS, generate_instance
+
+NOW = datetime(2024, 6, 1)
+
+
+def test_same_seed_yields_the_same_instance():
+    first = generate_instance(200, audit_ratio=4, seed=5, now=NOW)
+    again = generate_instance(200, audit_ratio=4, seed=5, now=NOW)
+    other = generate_instance(200, audit_ratio=4, seed=6, now=NOW)
+    assert first.tables == again.tables
+    assert first.profile == again.profile
+    assert first.tables['cmdb_ci'] != other.tables['cmdb_ci']
+
+
+def test_tables_are_sorted_tuples_of_the_declared_fields():
+    instance = generate_instance(200, audit_ratio=4, seed=5, now=NOW)
+    counts = instance.counts()
+    assert counts['cmdb_ci'] == 200
+    # user_count people plus the generic and service accounts
+    assert counts['sys_user'] == 20 + len(GENERIC_ACCOUNTS)
+    for table, rows in instance.tables.items():
+        assert len(rows) == counts[table]
+        assert all(len(row) == len(TABLE_FIELDS[table]) for row in rows)
+        sys_ids = [row[0] for row in rows]
+        assert sys_ids == sorted(sys_ids) and len(set(sys_ids)) == len(sys_ids)
+
+
+def test_audit_records_point_at_generated_cis_and_stay_in_the_past():
+    instance = generate_instance(200, audit_ratio=4, seed=5, now=NOW)
+    ci_ids = {ci['sys_id'] for ci in instance.records('cmdb_ci')}
+    stamp = NOW.strftime('%Y-%m-%d %H:%M:%S')
+    for record in instance.records('sys_audit'):
+        if record['tablename'] == 'cmdb_ci':
+            assert record['documentkey'] in ci_ids
+        assert record['sys_created_on'] <= stamp
@@ -0,0 +1,91 @@
+import logging
+
+import pytest
+
+import trace_logging
+from trace_logging import SamplingFilter, parse_setting
+
+
+def record(message='line %d', args=(1,)):
+    return logging.LogRecord('create_model.ci', logging.DEBUG, __file__, 1, message, args, None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable time.monotonic for the rate limit's one-second windows"""
+    now = [1000.0]
+    monkeypatch.setattr(trace_logging.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_parse_setting():
+    assert parse_setting('INFO, create_model.ci=DEBUG,app=WARNING') == ('INFO', {'create_model.ci': 'DEBUG', 'app': 'WARNING'})
+    assert parse_setting('create_model=5', int) == (None, {'create_model': 5})
+    assert parse_setting('') == (None, {})
+
+
+def test_category_setting_falls_back_through_parents():
+    setting = '3,create_model=7,create_model.ci=2'
+    assert trace_logging._category_setting(setting, 'create_model.ci', 1) == 2
+    assert trace_logging._category_setting(setting, 'create_model.recommendation', 1) == 7
+    assert trace_logging._category_setting(setting, 'app.samples', 1) == 3
+    assert trace_logging._category_setting('create_model=7', 'app.samples', 1) == 1
+
+
+def test_sampling_keeps_one_in_every(clock):
+    sampling = SamplingFilter(every=5)
+    kept = [i for i in range(23) if sampling.filter(record())]
+    assert kept == [0, 5, 10, 15, 20]
+
+
+def test_rate_limit_per_second(clock):
+    sampling = SamplingFilter(per_second=3)
+    assert [sampling.filter(record()) for _ in range(5)] == [True, True, True, False, False]
+    clock[0] += 1
+    assert [sampling.filter(record()) for _ in range(4)] == [True, True, True, False]
+
+
+def test_kept_record_reports_the_dropped_count(clock):
+    sampling = SamplingFilter(every=2, per_second=2)
+    records = [record() for _ in range(10)]
+    kept = [r for r in records if sampling.filter(r)]
+    # Kept: 0 and 2; odd records fall to sampling and 4, 6 and 8 to the rate limit
+    assert [r.getMessage() for r in kept] == ['line 1', 'line 1 [1 earlier lines dropped]']
+
+    clock[0] += 1
+    following = record('after %s', ('window',))
+    assert sampling.filter(following)
+    assert following.getMessage() == 'after window [7 earlier lines dropped]'
+    # The count starts over after every kept record
+    sampling.filter(record())
+    next_kept = record()
+    assert sampling.filter(next_kept)
+    assert next_kept.getMessage() == 'line 1 [1 earlier lines dropped]'
+
+
+def test_unlimited_by_default(clock):
+    sampling = SamplingFilter()
+    assert all(sampling.filter(record()) for _ in range(1000))
+
+
+def test_trace_logger_attaches_one_filter(monkeypatch):
+    monkeypatch.setattr(trace_logging, 'LOG_SAMPLE_EVERY', '1,test_trace.sampled=4')
+    monkeypatch.setattr(trace_logging, 'LOG_RATE_LIMIT', '0')
+    logger = trace_logging.trace_logger('test_trace.sampled')
+    assert trace_logging.trace_logger('test_trace.sampled') is logger
+    filters = [f for f in logger.filters if isinstance(f, SamplingFilter)]
+    assert len(filters) == 1
+    assert (filters[0].every, filters[0].per_second) == (4, 0)
+    assert logger in trace_logging.trace_loggers()
+
+
+def test_disabled_trace_line_is_not_formatted(caplog):
+    class Expensive:
+        def __str__(self):
+            raise AssertionError('formatted a disabled line')
+
+    logger = trace_logging.trace_logger('test_trace.quiet')
+    logger.setLevel(logging.INFO)
+    with caplog.at_level(logging.INFO):
+        logger.debug('value %s', Expensive())
+    assert caplog.records == []
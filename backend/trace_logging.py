@@ -0,0 +1,121 @@
+"""
+Leveled, sampled and rate-limited logging for hot paths.
+
+Scoring logs per CI and per candidate owner, so a line left on in those loops
+costs more than the scoring itself on a large scan and floods the log pipeline.
+Hot-path code logs through trace loggers: children of its module's logger named
+by category ('create_model.recommendation'), called at DEBUG with %-style
+arguments so a disabled line costs one level check and is never formatted.
+Arguments that are expensive to build are guarded with isEnabledFor.
+
+LOG_LEVEL sets the level of the root logger and, optionally, of single
+categories ('INFO,create_model.recommendation=DEBUG'), so detailed tracing can
+be switched on for one category at a time. Records a trace logger lets through
+then pass a per-category filter that keeps one record in LOG_SAMPLE_EVERY and at
+most LOG_RATE_LIMIT per second; the next record kept reports how many were
+dropped in between. Both settings take per-category overrides the same way.
+"""
+
+import logging
+import os
+import threading
+import time
+
+# Root level, then category=level overrides
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+# Keep one record in this many per trace category
+LOG_SAMPLE_EVERY = os.environ.get('LOG_SAMPLE_EVERY', '1')
+# Records kept per trace category per second; 0 is unlimited
+LOG_RATE_LIMIT = os.environ.get('LOG_RATE_LIMIT', '20')
+
+
+def parse_setting(value, parse=str):
+    """
+    Split a 'default,category=value,...' setting into (default, {category: value}).
+    The default is None when the setting only has overrides.
+    """
+    default, overrides = None, {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '=' in item:
+            category, category_value = item.split('=', 1)
+            overrides[category.strip()] = parse(category_value.strip())
+        else:
+            default = parse(item)
+    return default, overrides
+
+
+def _category_setting(value, category, fallback):
+    """A category's value from a setting: its own override, then its parents', then the default"""
+    default, overrides = parse_setting(value, int)
+    name = category
+    while name:
+        if name in overrides:
+            return overrides[name]
+        name = name.rpartition('.')[0]
+    return fallback if default is None else default
+
+
+def configure_logging(level=None):
+    """Set up the root handler and the levels LOG_LEVEL (or level) names"""
+    default, overrides = parse_setting(level or LOG_LEVEL, str.upper)
+    logging.basicConfig(level=default or 'INFO')
+    for category, category_level in overrides.items():
+        logging.getLogger(category).setLevel(category_level)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep one record in every, and at most per_second records each second (0: no limit)"""
+
+    def __init__(self, every=1, per_second=0):
+        super().__init__()
+        self.every = max(every, 1)
+        self.per_second = per_second
+        self._lock = threading.Lock()
+        self._seen = 0
+        self._window = None
+        self._in_window = 0
+        self._dropped = 0
+
+    def filter(self, record):
+        with self._lock:
+            self._seen += 1
+            if (self._seen - 1) % self.every:
+                self._dropped += 1
+                return False
+            window = int(time.monotonic())
+            if window != self._window:
+                self._window = window
+                self._in_window = 0
+            if self.per_second and self._in_window >= self.per_second:
+                self._dropped += 1
+                return False
+            self._in_window += 1
+            dropped, self._dropped = self._dropped, 0
+        if dropped:
+            record.msg = f"{record.msg} [{dropped} earlier lines dropped]"
+        return True
+
+
+_trace_loggers = {}
+_trace_lock = threading.Lock()
+
+
+def trace_logger(name):
+    """The logger of a hot-path category, with its sampling filter attached"""
+    with _trace_lock:
+        logger = _trace_loggers.get(name)
+        if logger is None:
+            logger = logging.getLogger(name)
+            logger.addFilter(SamplingFilter(_category_setting(LOG_SAMPLE_EVERY, name, 1),
+                                            _category_setting(LOG_RATE_LIMIT, name, 20)))
+            _trace_loggers[name] = logger
+        return logger
+
+
+def trace_loggers():
+    """The trace loggers created so far"""
+    with _trace_lock:
+        return list(_trace_loggers.values())
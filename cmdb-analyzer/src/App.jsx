@@ -298,6 +298,7 @@ const ServiceNowScanner = () => {
   const [isScanning, setIsScanning] = useState(false);
   const [scanResults, setScanResults] = useState(null);
   const [scanProgress, setScanProgress] = useState(0);
+  const [scanStatus, setScanStatus] = useState('');
   const [expandedCI, setExpandedCI] = useState(null);
   const [currentPage, setCurrentPage] = useState(1);
   const [itemsPerPage] = useState(50);
@@ -320,27 +321,10 @@ const ServiceNowScanner = () => {
   const [undoingAssignment, setUndoingAssignment] = useState(null);
   const [showScrollButtons, setShowScrollButtons] = useState(false);
   
-  // Progress effect
+  // Progress is driven by the scan job's events; reset it whenever a scan starts or ends
   useEffect(() => {
-    let timer;
-    if (isScanning) {
-      setScanProgress(0);
-      timer = setInterval(() => {
-        setScanProgress((oldProgress) => {
-          if (oldProgress >= 95) {
-            clearInterval(timer);
-            return 95;
-          }
-          return oldProgress + 1;
-        });
-      }, 150);
-    } else {
-      setScanProgress(0);
-    }
-
-    return () => {
-      if (timer) clearInterval(timer);
-    };
+    setScanProgress(0);
+    setScanStatus('');
   }, [isScanning]);
 
   useEffect(() => {
@@ -424,6 +408,54 @@ const ServiceNowScanner = () => {
     }
   };
 
+  // Describe a scan job progress snapshot in one line
+  const describeScanProgress = (job) => {
+    const details = job.details || {};
+    const eta = details.eta_seconds != null ? ` · about ${Math.ceil(details.eta_seconds)}s left` : '';
+    switch (job.stage) {
+      case 'fetching': {
+        const tables = Object.entries(details.tables || {})
+          .map(([name, table]) => `${name.replace('_data', '')} ${table.records}${table.total != null ? `/${table.total}` : ''}`)
+          .join(', ');
+        return `Fetching from ServiceNow${tables ? `: ${tables}` : '...'}${eta}`;
+      }
+      case 'normalizing':
+        return `Normalizing ${details.records_normalized || 0} records...`;
+      case 'scoring':
+        return `Scoring CIs: ${details.cis_scored}/${details.cis_total}` +
+          (details.cis_per_second ? ` (${Math.round(details.cis_per_second)}/s)` : '') +
+          `, ${details.stale_found} stale so far${eta}`;
+      case 'grouping':
+        return 'Grouping by recommended owner...';
+      case 'queued':
+        return 'Waiting for a free scan worker...';
+      default:
+        return 'Analyzing patterns...';
+    }
+  };
+
+  // Follow a scan job's server-sent events until it finishes
+  const followScanJob = (jobId) => new Promise((resolve, reject) => {
+    const events = new EventSource(`${config.API_URL}/scan-jobs/${jobId}/events`);
+    const update = (event) => {
+      const job = JSON.parse(event.data);
+      setScanProgress(Math.round(job.percent));
+      setScanStatus(describeScanProgress(job));
+      return job;
+    };
+    events.addEventListener('progress', update);
+    events.addEventListener('done', (event) => {
+      events.close();
+      resolve(update(event));
+    });
+    events.onerror = () => {
+      // EventSource reconnects on its own unless the server refused the stream
+      if (events.readyState === EventSource.CLOSED) {
+        reject(new Error('Lost connection to the scan progress stream'));
+      }
+    };
+  });
+
   const scanStaleOwnership = async () => {
     if (!connectionStatus?.success) {
       alert('Please test the connection first');
@@ -438,7 +470,7 @@ const ServiceNowScanner = () => {
     setAssigningCIs(new Set());
 
     try {
-      const response = await fetch(`${config.API_URL}/scan-stale-ownership`, {
+      const response = await fetch(`${config.API_URL}/scan-jobs`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -455,7 +487,14 @@ const ServiceNowScanner = () => {
         throw new Error(errorData.error || 'Scan failed');
       }
 
-      const data = await response.json();
+      const job = await response.json();
+      await followScanJob(job.job_id);
+
+      const resultResponse = await fetch(`${config.API_URL}/scan-jobs/${job.job_id}/result`);
+      const data = await resultResponse.json();
+      if (!resultResponse.ok) {
+        throw new Error(data.error || 'Scan failed');
+      }
       setScanResults(data);
     } catch (err) {
       alert(`Scan failed: ${err.message}`);
@@ -1389,7 +1428,7 @@ const ServiceNowScanner = () => {
                         }}
                       />
                     </div>
-                    <p className="text-center text-sm text-gray-400 mt-2">Analyzing patterns...</p>
+                    <p className="text-center text-sm text-gray-400 mt-2">{scanStatus || 'Analyzing patterns...'}</p>
                   </div>
                 )}
               </div>